@@ -1,15 +1,47 @@
-from flask import Flask
+from flask import Flask, g
 from flasgger import Swagger 
 from database.connection import MongoConnectionHolder
-from routes.feature_routes import feature_toggle_blueprint
+from routes.feature_routes import feature_toggle_blueprint, _publish_changes
+from routes.admin_routes import admin_blueprint
+from routes.event_routes import event_blueprint
+from routes.metrics_routes import metrics_blueprint
+from utils.serialization import init_app as init_json
+from metrics.instrumentation import init_app as init_metrics, METRICS_ENABLED
+from events.event_bus import EVENT_SOURCE
+from events.change_stream import ChangeStreamRelay
+from storage.storage_holder import StorageHolder, STORAGE_ENGINE
+from storage.expiry_sweeper import ExpirySweeper, EXPIRY_MODE
+from database.circuit_breaker import begin_request_scope, end_request_scope
 import os 
 
 app = Flask(__name__)
 Swagger(app)
+init_json(app)
+init_metrics(app)
+
+
+# Ask the database circuit breakers once per request (the ASGI app opens the scope of its requests itself)
+@app.before_request
+def begin_breaker_scope():
+    g.breaker_scope = begin_request_scope()
+
+
+@app.teardown_request
+def end_breaker_scope(exception):
+    end_request_scope(g.pop('breaker_scope', None))
 
-MongoConnectionHolder.initialize_db()
 
 app.register_blueprint(feature_toggle_blueprint)
+app.register_blueprint(admin_blueprint)
+app.register_blueprint(event_blueprint)
+if METRICS_ENABLED:
+    app.register_blueprint(metrics_blueprint)
+
+if EVENT_SOURCE == "change_stream" and STORAGE_ENGINE == "mongo" and MongoConnectionHolder.get_db() is not None:
+    ChangeStreamRelay.start(MongoConnectionHolder.get_db())
+
+if EXPIRY_MODE == "archive":
+    ExpirySweeper.start(StorageHolder.get_store, _publish_changes)
 
 
 
@@ -0,0 +1,245 @@
+"""
+ASGI entry point serving the same routes as app.py.
+
+The polling routes (ASYNC_VIEWS) run natively on the event loop with the async
+MongoDB client, so an idle long-poll or SSE connection costs a coroutine rather
+than a worker thread. Every other request is handed to the unchanged Flask
+(WSGI) app on a thread pool. URL matching, validation and responses are those
+of the Flask app in both cases.
+
+Run with an ASGI server, e.g.:
+
+    uvicorn asgi:app --port 8000
+"""
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import HTTPException
+from app import app as flask_app
+from database.async_connection import AsyncMongoConnectionHolder
+from database.circuit_breaker import begin_request_scope, end_request_scope
+from routes.async_routes import ASYNC_VIEWS
+from storage.storage_holder import STORAGE_ENGINE
+import asyncio
+import io
+import os
+import sys
+
+# Threads running the WSGI views that have no async counterpart
+_wsgi_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ASGI_WSGI_THREADS", 32)),
+    thread_name_prefix="asgi-wsgi")
+
+
+def _build_environ(scope, body):
+    """
+    Translate an ASGI HTTP scope into a WSGI environ (PEP 3333)
+
+    :param scope: The ASGI scope
+    :param body: The request body
+    :return: The WSGI environ
+    :rtype: dict
+    """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    # The body is fully read, including a chunked one
+    environ['CONTENT_LENGTH'] = str(len(body))
+    environ.pop('HTTP_TRANSFER_ENCODING', None)
+    return environ
+
+
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get('body', b"")
+        if not message.get('more_body'):
+            return body
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _send_start(send, status, headers):
+    await send({
+        'type': 'http.response.start',
+        'status': int(status.split(" ", 1)[0]) if isinstance(status, str) else status,
+        'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    })
+
+
+async def _send_body(send, chunk, more_body=True):
+    await send({'type': 'http.response.body', 'body': chunk, 'more_body': more_body})
+
+
+async def _call_wsgi(environ, send):
+    """
+    Run the Flask app on the thread pool and relay its (possibly streamed) response
+
+    :param environ: The WSGI environ
+    :param send: The ASGI send callable
+    """
+    loop = asyncio.get_running_loop()
+    messages = asyncio.Queue()
+
+    def put(message):
+        loop.call_soon_threadsafe(messages.put_nowait, message)
+
+    def run():
+        # The whole response is iterated on one thread, where stream_with_context keeps its request context
+        try:
+            def start_response(status, headers, exc_info=None):
+                put(('start', status, headers))
+
+            iterable = flask_app.wsgi_app(environ, start_response)
+            try:
+                for chunk in iterable:
+                    if chunk:
+                        put(('body', chunk))
+            finally:
+                if hasattr(iterable, 'close'):
+                    iterable.close()
+        except Exception as e:
+            print(f"Error serving {environ['PATH_INFO']}: {e}")
+            put(('error', e))
+        finally:
+            put(('end',))
+
+    loop.run_in_executor(_wsgi_executor, run)
+    started = False
+    while True:
+        message = await messages.get()
+        if message[0] == 'start':
+            await _send_start(send, message[1], message[2])
+            started = True
+        elif message[0] == 'body':
+            await _send_body(send, message[1])
+        elif message[0] == 'error' and not started:
+            await _send_start(send, 500, [('Content-Type', 'text/plain')])
+            started = True
+        elif message[0] == 'end':
+            await _send_body(send, b"", more_body=False)
+            return
+
+
+async def _call_async_view(view, view_args, environ, receive, send):
+    """
+    Run a native async view inside a Flask request context
+
+    :return: False when the view handed the request back to the WSGI app
+    :rtype: bool
+    """
+    with flask_app.request_context(environ):
+        try:
+            # The before_request hooks (request metrics) run as they would under WSGI
+            result = flask_app.preprocess_request()
+            if result is None:
+                result = await view(**view_args)
+            if result is None:
+                return False
+            response = flask_app.process_response(flask_app.make_response(result))
+        except Exception as e:
+            # Same 500 response Flask produces for an unhandled error under WSGI
+            response = flask_app.handle_exception(e)
+
+        try:
+            headers = response.get_wsgi_headers(environ).to_wsgi_list()
+            if hasattr(response.response, '__aiter__'):
+                await _send_start(send, response.status_code, headers)
+                # Stop an open event stream once the client went away
+                disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+                try:
+                    async for chunk in response.response:
+                        if disconnected.done():
+                            break
+                        await _send_body(send, chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+                finally:
+                    disconnected.cancel()
+                    await response.response.aclose()
+            else:
+                app_iter, status, headers = response.get_wsgi_response(environ)
+                await _send_start(send, response.status_code, headers)
+                for chunk in app_iter:
+                    await _send_body(send, chunk)
+            await _send_body(send, b"", more_body=False)
+        finally:
+            response.close()
+    return True
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if STORAGE_ENGINE == "mongo":
+                await AsyncMongoConnectionHolder.initialize_db()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await AsyncMongoConnectionHolder.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """
+    The ASGI application
+
+    :param scope: The ASGI scope
+    :param receive: The ASGI receive callable
+    :param send: The ASGI send callable
+    """
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    # One circuit breaker answer for the whole request, the check below included
+    breaker_scope = begin_request_scope()
+    try:
+        await _handle_http(scope, receive, send)
+    finally:
+        end_request_scope(breaker_scope)
+
+
+async def _handle_http(scope, receive, send):
+    if STORAGE_ENGINE == "mongo" and AsyncMongoConnectionHolder.get_db() is None:
+        # Servers without lifespan support, or a failed startup: retry on demand
+        await AsyncMongoConnectionHolder.initialize_db()
+
+    environ = _build_environ(scope, await _read_body(receive))
+    try:
+        endpoint, view_args = flask_app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        # 404 / 405 / redirects: let Flask answer exactly as under WSGI
+        endpoint, view_args = None, None
+
+    view = ASYNC_VIEWS.get(endpoint)
+    if view is not None and await _call_async_view(view, view_args, environ, receive, send):
+        return
+    await _call_wsgi(environ, send)
@@ -0,0 +1,209 @@
+"""
+Benchmark the WSGI app against the ASGI entry point.
+
+Both servers must already be running against the same database, e.g.:
+
+    python app.py                         # WSGI, port 5000
+    uvicorn asgi:app --port 8000          # ASGI
+
+Each endpoint is driven by `--concurrency` keep-alive clients for `--duration`
+seconds, optionally while `--idle-long-polls` long-poll requests are held open
+on the package's /events endpoint, the load the ASGI mode is meant to absorb.
+
+Run from the repository root:
+
+    python -m benchmarks.asgi_benchmark --package my_package
+"""
+from urllib.parse import urlsplit
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.interval_index_benchmark import percentile
+
+
+class HttpConnection:
+    """
+    Minimal HTTP/1.1 keep-alive client, so the benchmark has no dependencies
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def get(self, path):
+        """
+        Send a GET request and read the whole response
+
+        :param path: The path and query string
+        :return: The status code and the body
+        :rtype: tuple
+        """
+        return await self.request("GET", path)
+
+    async def request(self, method, path, payload=None):
+        """
+        Send a request, with an optional JSON body, and read the whole response
+
+        :param method: The HTTP method
+        :param path: The path and query string
+        :param payload: Object sent as the JSON body, or None
+        :return: The status code and the body
+        :rtype: tuple
+        """
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+        if payload is None:
+            self.writer.write(f"{head}\r\n".encode('latin-1'))
+        else:
+            body = json.dumps(payload).encode()
+            head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+            self.writer.write(head.encode('latin-1') + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by the server")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode('latin-1').partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if 'content-length' in headers:
+            body = await self.reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding') == 'chunked':
+            body = b""
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                body += await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            body = await self.reader.read()
+            headers['connection'] = 'close'
+
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+async def drive(base_url, path, concurrency, duration):
+    """
+    Send requests to one endpoint from concurrent clients
+
+    :param base_url: The server URL
+    :param path: The path and query string
+    :param concurrency: Number of concurrent clients
+    :param duration: Seconds to run
+    :return: Requests per second, latency percentiles in milliseconds and errors
+    :rtype: dict
+    """
+    url = urlsplit(base_url)
+    samples = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        nonlocal errors
+        connection = HttpConnection(url.hostname, url.port or 80)
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status, _ = await connection.get(path)
+                if status >= 400:
+                    errors += 1
+            except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+                errors += 1
+                connection.close()
+                continue
+            samples.append((time.perf_counter() - started) * 1000)
+        connection.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(samples),
+        "rps": round(len(samples) / elapsed, 1),
+        "p50_ms": round(percentile(samples, 0.50), 2) if samples else None,
+        "p99_ms": round(percentile(samples, 0.99), 2) if samples else None,
+        "errors": errors
+    }
+
+
+async def hold_long_polls(base_url, package, count, stop):
+    """
+    Keep long-poll requests open on the events endpoint until stop is set
+
+    :param base_url: The server URL
+    :param package: The package to follow
+    :param count: Number of open requests
+    :param stop: asyncio.Event ending the hold
+    """
+    url = urlsplit(base_url)
+
+    async def poller():
+        connection = HttpConnection(url.hostname, url.port or 80)
+        while not stop.is_set():
+            try:
+                await connection.get(f"/feature-toggles/{package}/events?mode=long-poll&timeout=60")
+            except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+                connection.close()
+                await asyncio.sleep(0.1)
+        connection.close()
+
+    tasks = [asyncio.ensure_future(poller()) for _ in range(count)]
+    await stop.wait()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def run(targets, package, paths, concurrency_levels, duration, idle_long_polls):
+    report = []
+    for name, base_url in targets:
+        stop = asyncio.Event()
+        holder = asyncio.ensure_future(hold_long_polls(base_url, package, idle_long_polls, stop))
+        # Let the long polls connect before measuring
+        await asyncio.sleep(1 if idle_long_polls else 0)
+        for path in paths:
+            for concurrency in concurrency_levels:
+                result = await drive(base_url, path.format(package=package), concurrency, duration)
+                report.append({"server": name, "path": path, "concurrency": concurrency, **result})
+        stop.set()
+        await holder
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--wsgi-url', default='http://127.0.0.1:5000', help='URL of the WSGI server')
+    parser.add_argument('--asgi-url', default='http://127.0.0.1:8000', help='URL of the ASGI server')
+    parser.add_argument('--package', required=True, help='An existing package to query')
+    parser.add_argument('--paths', default='/feature-toggles/{package}/active,/feature-toggles/{package}',
+                        help='Comma separated paths, {package} is replaced by the package')
+    parser.add_argument('--concurrency', default='10,100', help='Comma separated numbers of concurrent clients')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per path and concurrency level')
+    parser.add_argument('--idle-long-polls', type=int, default=0, help='Long-poll requests held open during the run')
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(
+        [('wsgi', args.wsgi_url), ('asgi', args.asgi_url)],
+        args.package,
+        args.paths.split(','),
+        [int(level) for level in args.concurrency.split(',')],
+        args.duration,
+        args.idle_long_polls)), indent=2))
@@ -0,0 +1,84 @@
+"""
+Benchmark the vectorized cohort evaluation against a loop per subject.
+
+Evaluates toggles with a rollout percentage and allow/deny lists for
+`--subjects` subject IDs with evaluation.cohort (NumPy) and with
+evaluation.rules.applies_to called once per subject and toggle, and checks
+that both give the same answers.
+
+Run from the repository root:
+
+    python -m benchmarks.cohort_benchmark
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+
+import numpy as np
+
+from evaluation.cohort import evaluate_cohort, format_result
+from evaluation.rules import applies_to
+
+
+def generate_features(count, seed=42):
+    """
+    Generate feature toggles with rollout rules
+
+    :param count: Number of toggles
+    :param seed: Random seed
+    :return: The toggles
+    :rtype: list
+    """
+    rng = random.Random(seed)
+    return [{
+        "_id": str(uuid.UUID(int=rng.getrandbits(128))),
+        "name": f"feature-{position}",
+        "rollout_percentage": rng.choice([None, 1, 5, 10, 25, 50, 99.5]),
+        "allow_list": [f"user-{rng.randrange(1000000)}" for _ in range(rng.randrange(0, 100))],
+        "deny_list": [f"user-{rng.randrange(1000000)}" for _ in range(rng.randrange(0, 100))]
+    } for position in range(count)]
+
+
+def run(subject_counts, toggles, loop_subjects):
+    features = generate_features(toggles)
+    report = []
+    for count in subject_counts:
+        subjects = [f"user-{position}" for position in range(count)]
+
+        started = time.perf_counter()
+        results = evaluate_cohort(features, subjects)
+        evaluate_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        encoded = [format_result(enabled, "bitmap") for enabled in results.values()]
+        bitmap_seconds = time.perf_counter() - started
+
+        # The loop is timed on a sample and extrapolated, it takes minutes on millions of subjects
+        sample = subjects[:loop_subjects]
+        started = time.perf_counter()
+        expected = {feature['name']: [applies_to(feature, subject) for subject in sample] for feature in features}
+        loop_seconds = (time.perf_counter() - started) * count / len(sample)
+
+        report.append({
+            "subjects": count,
+            "toggles": toggles,
+            "numpy_ms": round(evaluate_seconds * 1000, 1),
+            "bitmap_ms": round(bitmap_seconds * 1000, 1),
+            "bitmap_kb": round(sum(len(result["bitmap"]) for result in encoded) / 1024, 1),
+            "loop_ms_estimate": round(loop_seconds * 1000, 1),
+            "speedup": round(loop_seconds / evaluate_seconds, 1),
+            "same_results": all(np.array_equal(results[name][:len(sample)], values) for name, values in expected.items())
+        })
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--subjects', default='10000,100000,1000000', help='Comma separated numbers of subjects')
+    parser.add_argument('--toggles', type=int, default=10, help='Toggles evaluated for every subject')
+    parser.add_argument('--loop-subjects', type=int, default=20000, help='Subjects timed with the per-subject loop')
+    args = parser.parse_args()
+
+    print(json.dumps(run([int(count) for count in args.subjects.split(',')], args.toggles, args.loop_subjects), indent=2))
@@ -0,0 +1,113 @@
+"""
+Benchmark the in-memory interval index against a linear scan.
+
+Packages grow at a constant creation rate with 1-90 day windows, so the number
+of toggles active at any moment stays roughly constant while the package grows.
+The index latency should stay flat; the scan (what MongoDB does without an
+index) grows with the package.
+
+Run from the repository root:
+
+    python -m benchmarks.interval_index_benchmark
+"""
+from datetime import datetime, timedelta
+import argparse
+import json
+import random
+import time
+import uuid
+
+from cache.interval_index import PackageIndex
+
+
+def generate_features(count, seed=42):
+    """
+    Generate synthetic feature toggles, about 20 created per day
+
+    :param count: Number of toggles
+    :param seed: Random seed
+    :return: The toggles and the span they cover
+    :rtype: tuple
+    """
+    rng = random.Random(seed)
+    start = datetime(2020, 1, 1)
+    span = timedelta(days=max(1, count // 20))
+    features = []
+    for _ in range(count):
+        beginning_date = start + timedelta(seconds=rng.uniform(0, span.total_seconds()))
+        features.append({
+            "_id": str(uuid.uuid4()),
+            "name": f"feature-{len(features)}",
+            "beginning_date": beginning_date,
+            "expiration_date": beginning_date + timedelta(days=rng.uniform(1, 90))
+        })
+    return features, start, span
+
+
+def percentile(samples, fraction):
+    """
+    Get a percentile of a list of samples
+
+    :param samples: The samples
+    :param fraction: The percentile as a fraction (0.99 for p99)
+    :return: The percentile value
+    :rtype: float
+    """
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(query, points):
+    """
+    Time a query over a list of evaluation points
+
+    :param query: Callable taking one point
+    :param points: The evaluation points
+    :return: Latency percentiles in microseconds and the average result size
+    :rtype: dict
+    """
+    samples = []
+    results = 0
+    for point in points:
+        started = time.perf_counter()
+        results += len(query(point))
+        samples.append((time.perf_counter() - started) * 1e6)
+    return {
+        "p50_us": round(percentile(samples, 0.50), 1),
+        "p99_us": round(percentile(samples, 0.99), 1),
+        "avg_results": round(results / len(points), 1)
+    }
+
+
+def run(sizes, queries):
+    rng = random.Random(7)
+    report = []
+    for size in sizes:
+        features, start, span = generate_features(size)
+
+        started = time.perf_counter()
+        index = PackageIndex(features)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        points = [start + timedelta(seconds=rng.uniform(0, span.total_seconds())) for _ in range(queries)]
+        windows = [(point, point + timedelta(days=7)) for point in points]
+
+        report.append({
+            "toggles": size,
+            "build_ms": round(build_ms, 1),
+            "index_stab": measure(index.stab, points),
+            "index_overlap_7d": measure(lambda window: index.overlap(*window), windows),
+            "scan_stab": measure(
+                lambda point: [f for f in features if f["beginning_date"] <= point <= f["expiration_date"]],
+                points[:max(1, queries // 10)])
+        })
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='1000,10000,100000', help='Comma separated package sizes')
+    parser.add_argument('--queries', type=int, default=1000, help='Queries per size')
+    args = parser.parse_args()
+
+    print(json.dumps(run([int(size) for size in args.sizes.split(',')], args.queries), indent=2))
@@ -0,0 +1,360 @@
+"""
+Load-test every endpoint of the feature toggle API.
+
+Synthetic packages of each `--sizes` are seeded through the bulk endpoint,
+then every endpoint is driven by `--concurrency` keep-alive clients for
+`--duration` seconds. Throughput and p50/p95/p99 latency are printed as JSON,
+with the commit they were measured on, so runs can be compared.
+
+By default the app is started in a child process with the in-memory storage
+engine; `--engine mongo` uses the MongoDB configured in the environment, and
+`--url` targets a server that is already running. The seeded packages are
+deleted at the end of the run.
+
+Run from the repository root:
+
+    python -m benchmarks.load_benchmark --sizes 1,1000,100000 --output before.json
+    python -m benchmarks.load_benchmark --sizes 1,1000,100000 --compare before.json
+"""
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+
+from benchmarks.asgi_benchmark import HttpConnection
+from benchmarks.interval_index_benchmark import percentile
+
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Toggles sent per bulk request while seeding, within MAX_BULK_OPERATIONS
+SEED_BATCH_SIZE = 5000
+
+# Toggles changed by one request of the bulk scenario
+BULK_SCENARIO_SIZE = 100
+
+
+def generate_toggles(package_name, count, seed=42):
+    """
+    Generate the create operations of a synthetic package
+
+    Toggles begin at a constant rate over a span that grows with the package
+    (about 20 per day, at least a year) ending 30 days from now, and stay
+    active 1 to 90 days, skewed towards short rollouts. Most toggles are
+    expired, a few thousand at most are active and the last month is scheduled.
+
+    :param package_name: The name of the package
+    :param count: Number of toggles
+    :param seed: Random seed
+    :return: The bulk create operations
+    :rtype: list
+    """
+    rng = random.Random(seed)
+    end = datetime.utcnow().replace(microsecond=0) + timedelta(days=30)
+    span = timedelta(days=max(365, count // 20))
+    operations = []
+    for position in range(count):
+        beginning_date = end - timedelta(seconds=rng.uniform(0, span.total_seconds()))
+        expiration_date = beginning_date + timedelta(days=min(90, 1 + rng.expovariate(1 / 14)))
+        operations.append({
+            "op": "create",
+            "package_name": package_name,
+            "name": f"feature-{position}",
+            "description": f"Rollout of feature {position}",
+            "beginning_date": beginning_date.strftime(DATE_FORMAT),
+            "expiration_date": expiration_date.replace(microsecond=0).strftime(DATE_FORMAT)
+        })
+    return operations
+
+
+async def seed_package(connection, package_name, count):
+    """
+    Recreate a package with synthetic toggles
+
+    :param connection: HttpConnection to the server
+    :param package_name: The name of the package
+    :param count: Number of toggles
+    :return: The `_id` of the created toggles
+    :rtype: list
+    """
+    await connection.request("DELETE", f"/feature-toggles/{package_name}")
+    operations = generate_toggles(package_name, count)
+    feature_ids = []
+    for start in range(0, count, SEED_BATCH_SIZE):
+        status, body = await connection.request(
+            "POST", "/feature-toggles/bulk", {"operations": operations[start:start + SEED_BATCH_SIZE]})
+        if status != 200:
+            raise RuntimeError(f"Seeding '{package_name}' failed with status {status}: {body[:200]}")
+        results = json.loads(body)["results"]
+        failed = [result for result in results if result["status"] != 201]
+        if failed:
+            raise RuntimeError(f"Seeding '{package_name}' failed: {failed[0]}")
+        feature_ids.extend(result["_id"] for result in results)
+    return feature_ids
+
+
+def scenarios(package_name, feature_ids, package_names):
+    """
+    Get the request factories of every endpoint
+
+    A factory is called before each request with the request number and
+    returns the (method, path, JSON body) to send, or None when it ran out of
+    work. Reads come first; the writes that follow modify the package.
+
+    :param package_name: The package to query
+    :param feature_ids: The `_id` of its toggles
+    :param package_names: Every seeded package, for the multi-package routes
+    :return: (name, factory, on_response) tuples, on_response being None or called with each response body
+    :rtype: list
+    """
+    today = datetime.utcnow()
+    base = f"/feature-toggles/{package_name}"
+    created = []
+
+    def fixed(method, path, payload=None):
+        return lambda number: (method, path, payload)
+
+    def create(number):
+        return ("POST", "/feature-toggle", {
+            "package_name": package_name,
+            "name": f"load-{number}-{time.monotonic_ns()}",
+            "description": "Created by the load benchmark",
+            "beginning_date": today.strftime(DATE_FORMAT),
+            "expiration_date": (today + timedelta(days=30)).strftime(DATE_FORMAT)
+        })
+
+    def on_create(body):
+        created.append(json.loads(body)["_id"])
+
+    def update_dates(number):
+        # Alternate between two expiration dates so every update writes
+        expiration_date = today + timedelta(days=3650 + number % 2)
+        return ("PUT", f"{base}/{feature_ids[number % len(feature_ids)]}/update-dates",
+                {"expiration_date": expiration_date.strftime(DATE_FORMAT)})
+
+    def update_info(number):
+        return ("PUT", f"{base}/{feature_ids[number % len(feature_ids)]}/update-info",
+                {"description": f"Updated by the load benchmark ({number})"})
+
+    def bulk(number):
+        start = number * BULK_SCENARIO_SIZE
+        return ("POST", "/feature-toggles/bulk", {"operations": [
+            {"op": "update-info", "package_name": package_name,
+             "feature_id": feature_ids[(start + offset) % len(feature_ids)], "description": f"Bulk update {number}"}
+            for offset in range(BULK_SCENARIO_SIZE)]})
+
+    def delete(number):
+        # Deletes the toggles created by the create scenario, until none is left
+        if not created:
+            return None
+        return ("DELETE", f"{base}/{created.pop()}", None)
+
+    return [
+        ("list", fixed("GET", base), None),
+        ("list_page_100", fixed("GET", f"{base}?limit=100"), None),
+        ("by_date", fixed("GET", f"{base}/by-date?date={today:%Y-%m-%d}"), None),
+        ("active", fixed("GET", f"{base}/active"), None),
+        ("recent", fixed("GET", f"{base}/recent"), None),
+        ("active_in_range_7d", fixed(
+            "GET", f"{base}/active-in-range?start_date={today:%Y-%m-%d}&end_date={today + timedelta(days=7):%Y-%m-%d}"),
+         None),
+        ("statistics", fixed("GET", f"{base}/statistics"), None),
+        ("statistics_all", fixed("GET", "/statistics"), None),
+        ("active_batch", fixed("POST", "/feature-toggles/active", {"packages": package_names}), None),
+        ("create", create, on_create),
+        ("update_dates", update_dates, None),
+        ("update_info", update_info, None),
+        (f"bulk_update_{BULK_SCENARIO_SIZE}", bulk, None),
+        ("delete", delete, None),
+    ]
+
+
+async def drive(base_url, factory, on_response, concurrency, duration):
+    """
+    Send the requests of one scenario from concurrent clients
+
+    :param base_url: The server URL
+    :param factory: Callable(request number) returning (method, path, JSON body), or None to stop
+    :param on_response: None, or callable receiving each successful response body
+    :param concurrency: Number of concurrent clients
+    :param duration: Seconds to run
+    :return: Requests per second, latency percentiles in milliseconds and errors
+    :rtype: dict
+    """
+    url = urlsplit(base_url)
+    samples = []
+    errors = 0
+    numbers = itertools.count()
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        nonlocal errors
+        connection = HttpConnection(url.hostname, url.port or 80)
+        while time.perf_counter() < deadline:
+            request = factory(next(numbers))
+            if request is None:
+                break
+            started = time.perf_counter()
+            try:
+                status, body = await connection.request(*request)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+                errors += 1
+                connection.close()
+                continue
+            if status >= 400:
+                errors += 1
+            elif on_response is not None:
+                on_response(body)
+            samples.append((time.perf_counter() - started) * 1000)
+        connection.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(samples),
+        "rps": round(len(samples) / elapsed, 1),
+        "p50_ms": round(percentile(samples, 0.50), 2) if samples else None,
+        "p95_ms": round(percentile(samples, 0.95), 2) if samples else None,
+        "p99_ms": round(percentile(samples, 0.99), 2) if samples else None,
+        "errors": errors
+    }
+
+
+async def run(base_url, sizes, concurrency_levels, duration, only):
+    url = urlsplit(base_url)
+    connection = HttpConnection(url.hostname, url.port or 80)
+    package_names = [f"load-benchmark-{size}" for size in sizes]
+    feature_ids = {}
+    for package_name, size in zip(package_names, sizes):
+        started = time.perf_counter()
+        feature_ids[package_name] = await seed_package(connection, package_name, size)
+        print(f"Seeded {package_name} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    results = []
+    try:
+        for package_name, size in zip(package_names, sizes):
+            for name, factory, on_response in scenarios(package_name, feature_ids[package_name], package_names):
+                if only and name not in only:
+                    continue
+                for concurrency in concurrency_levels:
+                    result = await drive(base_url, factory, on_response, concurrency, duration)
+                    results.append({"toggles": size, "endpoint": name, "concurrency": concurrency, **result})
+                    print(f"{size:>7} {name:<20} c={concurrency:<4} {result['rps']:>9} rps  "
+                          f"p50 {result['p50_ms']} ms  p99 {result['p99_ms']} ms", file=sys.stderr)
+    finally:
+        for package_name in package_names:
+            await connection.request("DELETE", f"/feature-toggles/{package_name}")
+        connection.close()
+    return results
+
+
+def compare(results, baseline):
+    """
+    Add the baseline figures and the relative change to each result
+
+    :param results: The results of this run
+    :param baseline: A report saved by an earlier run
+    :return: The results
+    :rtype: list
+    """
+    previous = {(entry["toggles"], entry["endpoint"], entry["concurrency"]): entry for entry in baseline["results"]}
+    for entry in results:
+        before = previous.get((entry["toggles"], entry["endpoint"], entry["concurrency"]))
+        if before is None or not before["rps"] or not entry["rps"]:
+            continue
+        entry["baseline"] = {key: before[key] for key in ("rps", "p50_ms", "p95_ms", "p99_ms")}
+        entry["rps_change"] = round(entry["rps"] / before["rps"] - 1, 3)
+        entry["p99_change"] = round(entry["p99_ms"] / before["p99_ms"] - 1, 3) if before["p99_ms"] else None
+    return results
+
+
+def commit():
+    """
+    Get the commit of the working tree
+
+    :return: The commit hash, with a "-dirty" suffix when there are local changes, or None outside a git checkout
+    :rtype: str
+    """
+    try:
+        revision = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision + ("-dirty" if dirty else "")
+
+
+def serve(engine, ports):
+    # Child process: the storage engine is read when the app is imported, and
+    # the app's log lines go to stderr so stdout only holds the report
+    os.environ["STORAGE_ENGINE"] = engine
+    sys.stdout = sys.stderr
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    from app import app
+
+    class KeepAliveHandler(WSGIRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=KeepAliveHandler)
+    ports.put(server.port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--url', help='URL of a running server; by default the app is started in a child process')
+    parser.add_argument('--engine', default='memory', choices=['memory', 'mongo'], help='Storage engine of the started app')
+    parser.add_argument('--sizes', default='1,1000,10000', help='Comma separated package sizes, in toggles')
+    parser.add_argument('--concurrency', default='1,16', help='Comma separated numbers of concurrent clients')
+    parser.add_argument('--duration', type=float, default=5, help='Seconds per endpoint and concurrency level')
+    parser.add_argument('--endpoints', help='Comma separated endpoints to run, all by default')
+    parser.add_argument('--output', help='Also write the report to this file')
+    parser.add_argument('--compare', help='Report saved by an earlier run to compare with')
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        ports = multiprocessing.Queue()
+        server = multiprocessing.Process(target=serve, args=(args.engine, ports), daemon=True)
+        server.start()
+        base_url = f"http://127.0.0.1:{ports.get(timeout=60)}"
+
+    try:
+        sizes = [int(size) for size in args.sizes.split(',')]
+        concurrency_levels = [int(level) for level in args.concurrency.split(',')]
+        results = asyncio.run(run(
+            base_url, sizes, concurrency_levels, args.duration,
+            set(args.endpoints.split(',')) if args.endpoints else None))
+    finally:
+        if server is not None:
+            server.terminate()
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            results = compare(results, json.load(baseline))
+    report = {
+        "commit": commit(),
+        "url": args.url,
+        "engine": None if args.url else args.engine,
+        "duration": args.duration,
+        "python": sys.version.split()[0],
+        "results": results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    print(output)
@@ -0,0 +1,104 @@
+"""
+Benchmark the JSON encoders of the list responses.
+
+Builds full feature toggle documents and times the response the list routes
+send, with Flask's default provider (jsonify) and with the orjson provider,
+for whole documents and for a `fields=name,expiration_date` projection.
+
+Run from the repository root:
+
+    python -m benchmarks.serialization_benchmark
+"""
+from datetime import datetime, timedelta
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+import argparse
+import json
+import random
+import time
+import uuid
+
+from benchmarks.interval_index_benchmark import percentile
+from utils.serialization import OrjsonProvider, parse_fields, project
+
+
+def generate_documents(count, seed=42):
+    """
+    Generate feature toggle documents as they are stored
+
+    :param count: Number of toggles
+    :param seed: Random seed
+    :return: The documents
+    :rtype: list
+    """
+    rng = random.Random(seed)
+    start = datetime(2020, 1, 1)
+    documents = []
+    for position in range(count):
+        created_at = start + timedelta(seconds=rng.uniform(0, 365 * 86400), microseconds=rng.randrange(1000) * 1000)
+        beginning_date = created_at + timedelta(days=rng.uniform(0, 30))
+        documents.append({
+            "_id": str(uuid.uuid4()),
+            "name": f"feature-{position}",
+            "description": f"Rollout of feature {position} to the checkout flow",
+            "beginning_date": beginning_date,
+            "expiration_date": beginning_date + timedelta(days=rng.uniform(1, 90)),
+            "created_at": created_at,
+            "updated_at": created_at,
+            "version": 1
+        })
+    return documents
+
+
+def measure(app, documents, fields, rounds):
+    """
+    Time the JSON response of a list route
+
+    :param app: The Flask app, with the provider to measure
+    :param documents: The feature toggle documents
+    :param fields: The `fields` projection, or None
+    :param rounds: Number of timed responses
+    :return: Latency percentiles in milliseconds, throughput and the body size
+    :rtype: dict
+    """
+    samples = []
+    with app.app_context():
+        for _ in range(rounds):
+            started = time.perf_counter()
+            body = documents if fields is None else [project(document, fields) for document in documents]
+            size = len(app.json.response(body).get_data())
+            samples.append(time.perf_counter() - started)
+    return {
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 2),
+        "toggles_per_second": round(len(documents) / percentile(samples, 0.50)),
+        "body_kb": round(size / 1024, 1)
+    }
+
+
+def run(sizes, rounds):
+    encoders = {}
+    for name, provider_class in [("jsonify", DefaultJSONProvider), ("orjson", OrjsonProvider)]:
+        encoders[name] = Flask(__name__)
+        encoders[name].json = provider_class(encoders[name])
+
+    projection = parse_fields("name,expiration_date")
+    report = []
+    for size in sizes:
+        documents = generate_documents(size)
+        entry = {"toggles": size}
+        for name, app in encoders.items():
+            entry[name] = measure(app, documents, None, rounds)
+            entry[f"{name}_fields"] = measure(app, documents, projection, rounds)
+        entry["orjson_speedup"] = round(entry["jsonify"]["p50_ms"] / entry["orjson"]["p50_ms"], 1)
+        report.append(entry)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='100,1000,10000', help='Comma separated response sizes, in toggles')
+    parser.add_argument('--rounds', type=int, default=50, help='Timed responses per size and encoder')
+    args = parser.parse_args()
+
+    print(json.dumps(run([int(size) for size in args.sizes.split(',')], args.rounds), indent=2))
@@ -0,0 +1,172 @@
+"""
+Benchmark the shared cache against a copy of the cache in every worker process.
+
+Each worker answers "active toggles of a package now" for the same packages,
+either from its own interval indexes (every worker holding a copy, as the
+IntervalIndex cache does) or from the snapshots of one shared cache file.
+All the workers run at the same time, as under gunicorn. For each worker
+count it prints the memory the cache costs (the growth of the proportional
+set size of every worker, which splits the shared pages between the
+workers mapping them; Linux only), the size of the snapshots in the shared
+file, and the p50/p99 latency of a cache hit.
+
+Run from the repository root:
+
+    python -m benchmarks.shared_cache_benchmark --workers 8,32
+"""
+from datetime import datetime, timedelta
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.interval_index_benchmark import percentile
+from cache.interval_index import PackageIndex
+from cache.shared_cache import SharedArena, encode_snapshot, read_active
+
+MODES = ["local", "shared"]
+
+EVALUATION_TIME = datetime(2024, 6, 1)
+
+
+def generate_package(size, seed):
+    """
+    Generate the toggles of a package: mostly expired, some active and some scheduled
+
+    :param size: Number of toggles
+    :param seed: Random seed
+    :return: The toggles
+    :rtype: list
+    """
+    rng = random.Random(seed)
+    features = []
+    for position in range(size):
+        beginning_date = EVALUATION_TIME - timedelta(days=rng.uniform(-30, 730))
+        created_at = beginning_date - timedelta(days=rng.uniform(0, 30))
+        features.append({
+            "_id": f"{seed}-{position:08d}",
+            "name": f"feature-{position}",
+            "description": f"Synthetic feature toggle {position} of package {seed}",
+            "beginning_date": beginning_date,
+            "expiration_date": beginning_date + timedelta(days=rng.uniform(1, 90)),
+            "created_at": created_at,
+            "updated_at": created_at,
+            "version": 1
+        })
+    return features
+
+
+def memory_kib():
+    """
+    Read the memory of the current process
+
+    :return: Resident and proportional set size in KiB, or None where /proc/self/smaps_rollup is missing
+    :rtype: dict
+    """
+    try:
+        with open("/proc/self/smaps_rollup") as smaps:
+            fields = dict(line.split()[:2] for line in smaps if line.split()[0] in ("Rss:", "Pss:"))
+    except OSError:
+        return None
+    return {"rss": int(fields["Rss:"]), "pss": int(fields["Pss:"])}
+
+
+def worker(mode, path, packages, size, queries, ready, measured, results):
+    before = memory_kib()
+    if mode == "local":
+        cache = {f"package-{seed}": PackageIndex(generate_package(size, seed)) for seed in range(packages)}
+
+        def lookup(package_name):
+            return cache[package_name].stab(EVALUATION_TIME)
+    else:
+        arena = SharedArena(path)
+
+        def lookup(package_name):
+            return read_active(arena, package_name, 1, EVALUATION_TIME)[0]
+
+    # Touch every package once, as a warm cache would have
+    for seed in range(packages):
+        lookup(f"package-{seed}")
+    ready.wait()
+    after = memory_kib()
+    # Keep every worker alive until all of them were measured, so shared pages are split between all
+    measured.wait()
+
+    rng = random.Random(os.getpid())
+    samples = []
+    for _ in range(queries):
+        package_name = f"package-{rng.randrange(packages)}"
+        started = time.perf_counter()
+        lookup(package_name)
+        samples.append((time.perf_counter() - started) * 1e6)
+    results.put({
+        "pss_kib": None if before is None else after["pss"] - before["pss"],
+        "rss_kib": None if before is None else after["rss"] - before["rss"],
+        "samples": samples
+    })
+
+
+def run_mode(mode, workers, path, packages, size, queries):
+    context = multiprocessing.get_context("spawn")
+    ready = context.Barrier(workers)
+    measured = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(mode, path, packages, size, queries, ready, measured, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    samples = [sample for report in reports for sample in report["samples"]]
+    measured_memory = reports[0]["pss_kib"] is not None
+    return {
+        "mode": mode,
+        "workers": workers,
+        "pss_total_mib": round(sum(report["pss_kib"] for report in reports) / 1024, 1) if measured_memory else None,
+        "rss_per_worker_mib": round(sum(report["rss_kib"] for report in reports) / len(reports) / 1024, 1)
+        if measured_memory else None,
+        "hit_p50_us": round(percentile(samples, 0.50), 1),
+        "hit_p99_us": round(percentile(samples, 0.99), 1)
+    }
+
+
+def run(worker_counts, packages, size, queries):
+    path = os.path.join(tempfile.mkdtemp(), "feature-toggles.cache")
+    snapshots = [encode_snapshot(generate_package(size, seed)) for seed in range(packages)]
+    arena = SharedArena(path, slot_count=max(64, packages * 2), data_size=max(sum(map(len, snapshots)) * 2,
+                                                                              max(map(len, snapshots)) * 4 + 4096))
+    for seed, snapshot in enumerate(snapshots):
+        arena.publish(f"package-{seed}", 1, snapshot)
+    shared_stats = arena.get_stats()
+    arena.close()
+
+    report = {
+        "packages": packages,
+        "toggles_per_package": size,
+        "snapshot_mib": round(shared_stats["bytes"] / 1024 / 1024, 1),
+        "runs": []
+    }
+    try:
+        for workers in worker_counts:
+            for mode in MODES:
+                report["runs"].append(run_mode(mode, workers, path, packages, size, queries))
+    finally:
+        os.remove(path)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', default='8,32', help='Comma separated worker counts')
+    parser.add_argument('--packages', type=int, default=50, help='Packages held by the cache')
+    parser.add_argument('--size', type=int, default=1000, help='Toggles per package')
+    parser.add_argument('--queries', type=int, default=2000, help='Hits timed per worker')
+    args = parser.parse_args()
+
+    print(json.dumps(run([int(count) for count in args.workers.split(',')], args.packages, args.size, args.queries),
+                     indent=2))
@@ -0,0 +1,158 @@
+from datetime import datetime, timedelta, timezone
+import os
+import threading
+
+
+# Upper bound on how long an entry lives, so writes made by other workers are picked up; a miss is
+# answered from data at most PACKAGE_VERSION_TTL_SECONDS old (see IntervalIndex)
+ACTIVE_CACHE_MAX_TTL_SECONDS = float(os.getenv("ACTIVE_CACHE_MAX_TTL_SECONDS", 30))
+
+
+def utc_now():
+    """
+    Current time as a naive UTC datetime, matching the dates stored in MongoDB
+
+    :return: The current UTC time
+    :rtype: datetime
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def next_boundary(active_features, next_beginning_date):
+    """
+    Compute when a package's active set changes next
+
+    The set changes when an active toggle passes its expiration date or when
+    a scheduled toggle reaches its beginning date.
+
+    :param active_features: The currently active feature toggles
+    :param next_beginning_date: The nearest beginning date in the future, or None
+    :return: The first moment the active set is no longer valid, or None
+    :rtype: datetime
+    """
+    boundaries = [feature['expiration_date'] + timedelta(microseconds=1) for feature in active_features]
+    if next_beginning_date is not None:
+        boundaries.append(next_beginning_date)
+    return min(boundaries) if boundaries else None
+
+
+class ActiveFeaturesCache:
+    """
+    Per-package cache of the currently active feature toggles.
+
+    Each entry expires at the package's next boundary date (or after
+    ACTIVE_CACHE_MAX_TTL_SECONDS, whichever comes first) and is invalidated
+    explicitly by the write routes.
+    """
+    __entries = {}
+    __generations = {}
+    __lock = threading.Lock()
+    __hits = 0
+    __misses = 0
+
+    @staticmethod
+    def get(package_name, now=None):
+        """
+        Get the cached active feature toggles of a package
+
+        :param package_name: The name of the package
+        :param now: Evaluation time (naive UTC), defaults to the current time
+        :return: The active feature toggles, or None if not cached
+        :rtype: list
+        """
+        now = now or utc_now()
+        with ActiveFeaturesCache.__lock:
+            entry = ActiveFeaturesCache.__entries.get(package_name)
+            if entry is not None and now < entry['expires_at']:
+                ActiveFeaturesCache.__hits += 1
+                return entry['features']
+            ActiveFeaturesCache.__misses += 1
+            return None
+
+    @staticmethod
+    def generation(package_name):
+        """
+        Get the invalidation generation of a package
+
+        Read it before loading from the database and pass it to put(), so a
+        result that raced with a write is not cached.
+
+        :param package_name: The name of the package
+        :return: The current generation
+        :rtype: int
+        """
+        with ActiveFeaturesCache.__lock:
+            return ActiveFeaturesCache.__generations.get(package_name, 0)
+
+    @staticmethod
+    def put(package_name, features, boundary, generation, now=None):
+        """
+        Cache the active feature toggles of a package
+
+        :param package_name: The name of the package
+        :param features: The active feature toggles
+        :param boundary: The next boundary date of the package, or None
+        :param generation: The generation read before loading the features
+        :param now: Evaluation time (naive UTC), defaults to the current time
+        """
+        now = now or utc_now()
+        expires_at = now + timedelta(seconds=ACTIVE_CACHE_MAX_TTL_SECONDS)
+        if boundary is not None:
+            expires_at = min(expires_at, boundary)
+
+        with ActiveFeaturesCache.__lock:
+            if ActiveFeaturesCache.__generations.get(package_name, 0) != generation:
+                return
+            ActiveFeaturesCache.__entries[package_name] = {
+                "features": features,
+                "boundary": boundary,
+                "expires_at": expires_at
+            }
+
+    @staticmethod
+    def window(package_name, now=None):
+        """
+        Identify the evaluation window of a cached package
+
+        The active set of a package stays the same until its next boundary
+        date, so that date identifies the window. Lookups are not counted.
+
+        :param package_name: The name of the package
+        :param now: Evaluation time (naive UTC), defaults to the current time
+        :return: The boundary in UNIX milliseconds (0 when there is none), or None if not cached
+        :rtype: int
+        """
+        now = now or utc_now()
+        with ActiveFeaturesCache.__lock:
+            entry = ActiveFeaturesCache.__entries.get(package_name)
+            if entry is None or now >= entry['expires_at']:
+                return None
+            if entry['boundary'] is None:
+                return 0
+            return int(entry['boundary'].replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+    @staticmethod
+    def invalidate(package_name):
+        """
+        Drop the cached active feature toggles of a package
+
+        :param package_name: The name of the package
+        """
+        with ActiveFeaturesCache.__lock:
+            ActiveFeaturesCache.__entries.pop(package_name, None)
+            ActiveFeaturesCache.__generations[package_name] = ActiveFeaturesCache.__generations.get(package_name, 0) + 1
+
+    @staticmethod
+    def get_stats():
+        """
+        Get the cache counters
+
+        :return: Number of cached packages and lookup hits/misses
+        :rtype: dict
+        """
+        with ActiveFeaturesCache.__lock:
+            return {
+                "packages": len(ActiveFeaturesCache.__entries),
+                "hits": ActiveFeaturesCache.__hits,
+                "misses": ActiveFeaturesCache.__misses
+            }
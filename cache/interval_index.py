@@ -0,0 +1,430 @@
+from bisect import bisect_left, bisect_right, insort
+import os
+import threading
+import time
+
+
+# How long a built index is kept before it is rebuilt; an index behind the package version is never served
+INTERVAL_INDEX_TTL_SECONDS = float(os.getenv("INTERVAL_INDEX_TTL_SECONDS", 300))
+
+
+class _Node:
+    """
+    Interval tree node holding every interval that contains its center.
+
+    by_begin is sorted by (beginning_date, seq) and by_end by (expiration_date, seq).
+    """
+    __slots__ = ("center", "by_begin", "by_end", "left", "right")
+
+    def __init__(self, center):
+        self.center = center
+        self.by_begin = []
+        self.by_end = []
+        self.left = None
+        self.right = None
+
+
+class PackageIndex:
+    """
+    Centered interval tree over the feature toggles of one package.
+
+    Answers point-in-time (stab) and overlap-window queries in O(log n + k)
+    and is maintained incrementally by the write routes. The tree is rebuilt
+    once the number of mutations since the last build exceeds its size, which
+    keeps it balanced.
+    """
+
+    def __init__(self, features):
+        self.__lock = threading.RLock()
+        self.__seq = 0
+        self.__items = {}
+        self.__begins = []
+        for feature in features:
+            self.__seq += 1
+            self.__items[feature['_id']] = (feature['beginning_date'], self.__seq, feature['expiration_date'], feature)
+        self.__begins = sorted((item[0], item[1]) for item in self.__items.values())
+        self.__rebuild()
+        self.built_at = time.monotonic()
+        # Package version the index holds, set by IntervalIndex
+        self.version = None
+
+    def __len__(self):
+        return len(self.__items)
+
+    def stab(self, when):
+        """
+        Get the features active at a point in time
+
+        :param when: Naive UTC datetime
+        :return: Features with beginning_date <= when <= expiration_date
+        :rtype: list
+        """
+        return self.overlap(when, when)
+
+    def overlap(self, start, end):
+        """
+        Get the features active at any moment of a window
+
+        :param start: Naive UTC start of the window
+        :param end: Naive UTC end of the window
+        :return: Features with beginning_date <= end and expiration_date >= start
+        :rtype: list
+        """
+        with self.__lock:
+            matches = self.__collect(start, end)
+        # Keep insertion order, like a natural-order collection scan
+        matches.sort(key=lambda item: item[1])
+        return [item[3] for item in matches]
+
+    def count_active(self, when):
+        """
+        Count the features active at a point in time
+
+        :param when: Naive UTC datetime
+        :return: Number of active features
+        :rtype: int
+        """
+        with self.__lock:
+            return len(self.__collect(when, when))
+
+    def next_beginning_after(self, when):
+        """
+        Get the nearest beginning date strictly after a point in time
+
+        :param when: Naive UTC datetime
+        :return: The next beginning date, or None
+        :rtype: datetime
+        """
+        with self.__lock:
+            position = bisect_right(self.__begins, (when, float("inf")))
+            if position < len(self.__begins):
+                return self.__begins[position][0]
+            return None
+
+    def get(self, feature_id):
+        """
+        Get an indexed feature by its `_id`
+
+        :param feature_id: The `_id` of the feature toggle
+        :return: The feature toggle document, or None
+        :rtype: dict
+        """
+        with self.__lock:
+            item = self.__items.get(feature_id)
+        return None if item is None else item[3]
+
+    def insert(self, feature):
+        """
+        Add a feature (or replace the one with the same `_id`)
+
+        :param feature: The feature toggle document
+        """
+        with self.__lock:
+            previous = self.__remove_item(feature['_id'])
+            item = self.__add_item(feature, previous[1] if previous else None)
+            self.__place(item)
+            self.__after_mutation()
+
+    def update(self, feature_id, fields):
+        """
+        Apply a partial update to an indexed feature
+
+        :param feature_id: The `_id` of the feature toggle
+        :param fields: The updated fields
+        """
+        with self.__lock:
+            item = self.__items.get(feature_id)
+            if item is not None:
+                self.insert({**item[3], **fields})
+
+    def remove(self, feature_id):
+        """
+        Remove a feature by its `_id`
+
+        :param feature_id: The `_id` of the feature toggle
+        """
+        with self.__lock:
+            if self.__remove_item(feature_id):
+                self.__after_mutation()
+
+    def __add_item(self, feature, seq=None):
+        # (beginning_date, seq, expiration_date, feature); seq breaks ties and keeps insertion order
+        if seq is None:
+            self.__seq += 1
+            seq = self.__seq
+        item = (feature['beginning_date'], seq, feature['expiration_date'], feature)
+        self.__items[feature['_id']] = item
+        insort(self.__begins, (item[0], item[1]))
+        return item
+
+    def __remove_item(self, feature_id):
+        item = self.__items.pop(feature_id, None)
+        if item is None:
+            return None
+        begins_position = bisect_left(self.__begins, (item[0], item[1]))
+        del self.__begins[begins_position]
+
+        node = self.__root
+        while node is not None:
+            if item[2] < node.center:
+                node = node.left
+            elif item[0] > node.center:
+                node = node.right
+            else:
+                del node.by_begin[bisect_left(node.by_begin, (item[0], item[1]))]
+                del node.by_end[bisect_left(node.by_end, (item[2], item[1]))]
+                break
+        return item
+
+    def __place(self, item):
+        if self.__root is None:
+            self.__root = _Node(item[0])
+        node = self.__root
+        while True:
+            if item[2] < node.center:
+                if node.left is None:
+                    node.left = _Node(item[0])
+                node = node.left
+            elif item[0] > node.center:
+                if node.right is None:
+                    node.right = _Node(item[0])
+                node = node.right
+            else:
+                insort(node.by_begin, (item[0], item[1], item))
+                insort(node.by_end, (item[2], item[1], item))
+                return
+
+    def __after_mutation(self):
+        self.__mutations += 1
+        if self.__mutations > max(64, len(self.__items)):
+            self.__rebuild()
+
+    def __rebuild(self):
+        self.__mutations = 0
+        self.__root = self.__build(sorted(self.__items.values(), key=lambda item: (item[0], item[1])))
+
+    @staticmethod
+    def __build(items):
+        # items are sorted by (beginning_date, seq); the median beginning date is always covered
+        # by at least one interval, so no node is ever created empty
+        if not items:
+            return None
+        node = _Node(items[len(items) // 2][0])
+        left, right = [], []
+        for item in items:
+            if item[2] < node.center:
+                left.append(item)
+            elif item[0] > node.center:
+                right.append(item)
+            else:
+                node.by_begin.append((item[0], item[1], item))
+                node.by_end.append((item[2], item[1], item))
+        node.by_end.sort(key=lambda entry: (entry[0], entry[1]))
+        node.left = PackageIndex.__build(left)
+        node.right = PackageIndex.__build(right)
+        return node
+
+    def __collect(self, start, end):
+        matches = []
+        stack = [self.__root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            if end < node.center:
+                # Every interval here ends at or after the center, so only the beginning matters
+                for begin, _, item in node.by_begin:
+                    if begin > end:
+                        break
+                    matches.append(item)
+                stack.append(node.left)
+            elif start > node.center:
+                # Every interval here begins at or before the center, so only the expiration matters
+                for position in range(len(node.by_end) - 1, -1, -1):
+                    if node.by_end[position][0] < start:
+                        break
+                    matches.append(node.by_end[position][2])
+                stack.append(node.right)
+            else:
+                matches.extend(entry[2] for entry in node.by_begin)
+                stack.append(node.left)
+                stack.append(node.right)
+        return matches
+
+
+class IntervalIndex:
+    """
+    Registry of per-package interval indexes.
+
+    A package is "cold" until its index has been built from the collection;
+    callers then fall back to the storage while the index is built in the
+    background. Indexes older than INTERVAL_INDEX_TTL_SECONDS are rebuilt.
+
+    Each index records the package version it was built for, and this
+    worker's writes advance it. An index behind the current package version
+    (written by another worker or instance) is not served but rebuilt, so the
+    index is as fresh as PackageVersions.
+    """
+    __indexes = {}
+    __generations = {}
+    __building = set()
+    __lock = threading.Lock()
+    __hits = 0
+    __misses = 0
+
+    @staticmethod
+    def get(store, package_name, version):
+        """
+        Get the index of a package, scheduling a build if it is cold or stale
+
+        :param store: The FeatureStore
+        :param package_name: The name of the package
+        :param version: The current version of the package (PackageVersions), or None if unknown
+        :return: The package index, or None if it is cold or behind the package version
+        :rtype: PackageIndex
+        """
+        # The storage answers date queries from its own index, a copy would only double the memory
+        if store.indexes_dates:
+            return None
+
+        with IntervalIndex.__lock:
+            index = IntervalIndex.__indexes.get(package_name)
+            # Another worker wrote the package since the build: the storage answers until the rebuild
+            if index is not None and version is not None and index.version != version:
+                index = None
+            if index is not None:
+                IntervalIndex.__hits += 1
+            else:
+                IntervalIndex.__misses += 1
+            if index is not None and time.monotonic() - index.built_at < INTERVAL_INDEX_TTL_SECONDS:
+                return index
+            if package_name in IntervalIndex.__building:
+                return index
+            IntervalIndex.__building.add(package_name)
+            generation = IntervalIndex.__generations.get(package_name, 0)
+
+        threading.Thread(
+            target=IntervalIndex.__build,
+            args=(store, package_name, generation, version),
+            daemon=True).start()
+        # An old index at the current version is still better than a collection scan while the rebuild runs
+        return index
+
+    @staticmethod
+    def build(store, package_name, version=None):
+        """
+        Build the index of a package synchronously
+
+        :param store: The FeatureStore
+        :param package_name: The name of the package
+        :param version: The package version read before the build, or None if unknown
+        :return: The package index
+        :rtype: PackageIndex
+        """
+        with IntervalIndex.__lock:
+            generation = IntervalIndex.__generations.get(package_name, 0)
+        IntervalIndex.__build(store, package_name, generation, version)
+        with IntervalIndex.__lock:
+            return IntervalIndex.__indexes.get(package_name)
+
+    @staticmethod
+    def get_stats():
+        """
+        Get the index counters
+
+        :return: Number of indexed packages and lookup hits/misses
+        :rtype: dict
+        """
+        with IntervalIndex.__lock:
+            return {
+                "packages": len(IntervalIndex.__indexes),
+                "hits": IntervalIndex.__hits,
+                "misses": IntervalIndex.__misses
+            }
+
+    @staticmethod
+    def on_insert(package_name, feature):
+        """
+        Add a created or updated feature to the index of its package
+
+        :param package_name: The name of the package
+        :param feature: The feature toggle document
+        """
+        index = IntervalIndex.__touch(package_name)
+        if index is not None:
+            index.insert(feature)
+
+    @staticmethod
+    def on_update(package_name, feature_id, fields):
+        """
+        Apply a partial update to a feature in the index of its package
+
+        :param package_name: The name of the package
+        :param feature_id: The `_id` of the feature toggle
+        :param fields: The updated fields
+        """
+        index = IntervalIndex.__touch(package_name)
+        if index is not None:
+            index.update(feature_id, fields)
+
+    @staticmethod
+    def on_delete(package_name, feature_id):
+        """
+        Remove a deleted feature from the index of its package
+
+        :param package_name: The name of the package
+        :param feature_id: The `_id` of the feature toggle
+        """
+        index = IntervalIndex.__touch(package_name)
+        if index is not None:
+            index.remove(feature_id)
+
+    @staticmethod
+    def advance(package_name, version, count):
+        """
+        Move the index of a package to the version produced by this worker's writes
+
+        The writes were applied to the index already; if another write came in
+        between, the index stays behind and is rebuilt.
+
+        :param package_name: The name of the package
+        :param version: The version after the writes
+        :param count: Number of writes, each with its own version
+        """
+        with IntervalIndex.__lock:
+            index = IntervalIndex.__indexes.get(package_name)
+            if index is not None and index.version == version - count:
+                index.version = version
+
+    @staticmethod
+    def drop(package_name):
+        """
+        Forget the index of a package
+
+        :param package_name: The name of the package
+        """
+        with IntervalIndex.__lock:
+            IntervalIndex.__indexes.pop(package_name, None)
+            IntervalIndex.__generations[package_name] = IntervalIndex.__generations.get(package_name, 0) + 1
+
+    @staticmethod
+    def __touch(package_name):
+        # Bump the generation so a build that started before this write is discarded
+        with IntervalIndex.__lock:
+            IntervalIndex.__generations[package_name] = IntervalIndex.__generations.get(package_name, 0) + 1
+            return IntervalIndex.__indexes.get(package_name)
+
+    @staticmethod
+    def __build(store, package_name, generation, version):
+        try:
+            # The version was read before the toggles: a write racing with the read makes the index fresher
+            index = PackageIndex(store.find(package_name))
+            index.version = version
+            with IntervalIndex.__lock:
+                if IntervalIndex.__generations.get(package_name, 0) == generation:
+                    IntervalIndex.__indexes[package_name] = index
+        except Exception as e:
+            print(f"Error building interval index for package '{package_name}': {e}")
+        finally:
+            with IntervalIndex.__lock:
+                IntervalIndex.__building.discard(package_name)
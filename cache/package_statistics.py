@@ -0,0 +1,265 @@
+from datetime import datetime, timedelta
+from heapq import heappop, heappush
+import os
+import threading
+import time
+
+
+# How long built statistics are trusted before they are rebuilt, so writes made by other workers are picked up
+PACKAGE_STATISTICS_TTL_SECONDS = float(os.getenv("PACKAGE_STATISTICS_TTL_SECONDS", 300))
+
+# Creation window of recent_features, the same as /recent
+RECENT_WINDOW = timedelta(days=30)
+
+# Smallest datetime step: a toggle expires and leaves the recent window just after its boundary date
+_TICK = timedelta(microseconds=1)
+
+COUNTERS = ['total_features', 'active_features', 'scheduled_features', 'expired_features', 'recent_features']
+
+
+def _date_bucket(beginning_date, expiration_date, when):
+    if beginning_date > when:
+        return 'scheduled_features'
+    if expiration_date < when:
+        return 'expired_features'
+    return 'active_features'
+
+
+class _PackageCounters:
+    """
+    Statistics document of one package, valid at `evaluated_at`.
+
+    Besides the counters it keeps the dates of every toggle and a heap of the
+    upcoming boundary dates (beginning, expiration, end of the recent window),
+    so advancing the clock only pops the boundaries that passed and moves
+    their toggles between buckets.
+    """
+    __slots__ = ("counters", "features", "boundaries", "evaluated_at", "built_at", "seq")
+
+    def __init__(self, features, when):
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.features = {}
+        self.boundaries = []
+        self.evaluated_at = when
+        self.built_at = time.monotonic()
+        self.seq = 0
+        for feature in features:
+            self.add(feature)
+
+    def add(self, feature):
+        # seq identifies this version of the toggle, so boundaries of an earlier version are ignored
+        self.seq += 1
+        entry = (feature['beginning_date'], feature['expiration_date'], feature['created_at'], self.seq)
+        self.remove(feature['_id'])
+        self.features[feature['_id']] = entry
+        self.__count(entry, 1)
+
+        beginning_date, expiration_date, created_at, seq = entry
+        if beginning_date > self.evaluated_at:
+            heappush(self.boundaries, (beginning_date, seq, feature['_id'], 'scheduled_features', 'active_features'))
+        if expiration_date >= self.evaluated_at:
+            heappush(self.boundaries, (expiration_date + _TICK, seq, feature['_id'], 'active_features', 'expired_features'))
+        if created_at >= self.evaluated_at - RECENT_WINDOW:
+            heappush(self.boundaries, (created_at + RECENT_WINDOW + _TICK, seq, feature['_id'], 'recent_features', None))
+
+    def update(self, feature_id, fields):
+        entry = self.features.get(feature_id)
+        if entry is not None:
+            self.add({
+                '_id': feature_id,
+                'beginning_date': fields.get('beginning_date', entry[0]),
+                'expiration_date': fields.get('expiration_date', entry[1]),
+                'created_at': fields.get('created_at', entry[2])
+            })
+
+    def remove(self, feature_id):
+        entry = self.features.pop(feature_id, None)
+        if entry is not None:
+            self.__count(entry, -1)
+
+    def advance(self, when):
+        if when <= self.evaluated_at:
+            return
+        while self.boundaries and self.boundaries[0][0] <= when:
+            _, seq, feature_id, source, target = heappop(self.boundaries)
+            entry = self.features.get(feature_id)
+            if entry is None or entry[3] != seq:
+                continue
+            self.counters[source] -= 1
+            if target is not None:
+                self.counters[target] += 1
+        self.evaluated_at = when
+
+    def __count(self, entry, delta):
+        beginning_date, expiration_date, created_at, _ = entry
+        self.counters['total_features'] += delta
+        self.counters[_date_bucket(beginning_date, expiration_date, self.evaluated_at)] += delta
+        if created_at >= self.evaluated_at - RECENT_WINDOW:
+            self.counters['recent_features'] += delta
+
+
+class PackageStatistics:
+    """
+    Per-package statistics maintained incrementally by the write routes.
+
+    Each package keeps its total, active, scheduled (beginning date in the
+    future), expired and recently created (last 30 days) counts. A read
+    first moves the toggles whose boundary dates passed since the previous
+    read to their new bucket, then returns the counters, so /statistics
+    never scans the package. A cold package is counted from the storage on
+    its first read; statistics older than PACKAGE_STATISTICS_TTL_SECONDS are
+    rebuilt in the background.
+
+    Like /statistics always did, the counts use the server's local time.
+    """
+    __packages = {}
+    __generations = {}
+    __building = set()
+    __lock = threading.Lock()
+    __hits = 0
+    __misses = 0
+
+    @staticmethod
+    def get(store, package_name):
+        """
+        Get the statistics of a package
+
+        :param store: The FeatureStore
+        :param package_name: The name of the package
+        :return: total_features, active_features, scheduled_features, expired_features and recent_features
+        :rtype: dict
+        """
+        now = datetime.now()
+        with PackageStatistics.__lock:
+            counters = PackageStatistics.__packages.get(package_name)
+            if counters is None:
+                PackageStatistics.__misses += 1
+            else:
+                PackageStatistics.__hits += 1
+                counters.advance(now)
+                statistics = dict(counters.counters)
+                if time.monotonic() - counters.built_at < PACKAGE_STATISTICS_TTL_SECONDS \
+                        or package_name in PackageStatistics.__building:
+                    return statistics
+                PackageStatistics.__building.add(package_name)
+            generation = PackageStatistics.__generations.get(package_name, 0)
+
+        if counters is not None:
+            threading.Thread(
+                target=PackageStatistics.__rebuild,
+                args=(store, package_name, generation),
+                daemon=True).start()
+            # The previous counters stay correct for this worker's writes while the rebuild runs
+            return statistics
+
+        counters = PackageStatistics.__build(store, package_name, generation)
+        with PackageStatistics.__lock:
+            counters.advance(datetime.now())
+            return dict(counters.counters)
+
+    @staticmethod
+    def summary(store, package_names):
+        """
+        Get the statistics of several packages and their totals
+
+        :param store: The FeatureStore
+        :param package_names: The package names
+        :return: The statistics by package name, and the totals
+        :rtype: dict
+        """
+        packages = {package_name: PackageStatistics.get(store, package_name) for package_name in package_names}
+        totals = dict.fromkeys(COUNTERS, 0)
+        for statistics in packages.values():
+            for counter in COUNTERS:
+                totals[counter] += statistics[counter]
+        return {"packages": packages, "totals": totals}
+
+    @staticmethod
+    def get_stats():
+        """
+        Get the statistics counters
+
+        :return: Number of counted packages and lookup hits/misses
+        :rtype: dict
+        """
+        with PackageStatistics.__lock:
+            return {
+                "packages": len(PackageStatistics.__packages),
+                "hits": PackageStatistics.__hits,
+                "misses": PackageStatistics.__misses
+            }
+
+    @staticmethod
+    def on_insert(package_name, feature):
+        """
+        Count a created feature in the statistics of its package
+
+        :param package_name: The name of the package
+        :param feature: The feature toggle document
+        """
+        with PackageStatistics.__lock:
+            counters = PackageStatistics.__touch(package_name)
+            if counters is not None:
+                counters.add(feature)
+
+    @staticmethod
+    def on_update(package_name, feature_id, fields):
+        """
+        Move an updated feature to the buckets of its new dates
+
+        :param package_name: The name of the package
+        :param feature_id: The `_id` of the feature toggle
+        :param fields: The updated fields
+        """
+        with PackageStatistics.__lock:
+            counters = PackageStatistics.__touch(package_name)
+            if counters is not None:
+                counters.update(feature_id, fields)
+
+    @staticmethod
+    def on_delete(package_name, feature_id):
+        """
+        Remove a deleted feature from the statistics of its package
+
+        :param package_name: The name of the package
+        :param feature_id: The `_id` of the feature toggle
+        """
+        with PackageStatistics.__lock:
+            counters = PackageStatistics.__touch(package_name)
+            if counters is not None:
+                counters.remove(feature_id)
+
+    @staticmethod
+    def drop(package_name):
+        """
+        Forget the statistics of a package
+
+        :param package_name: The name of the package
+        """
+        with PackageStatistics.__lock:
+            PackageStatistics.__packages.pop(package_name, None)
+            PackageStatistics.__generations[package_name] = PackageStatistics.__generations.get(package_name, 0) + 1
+
+    @staticmethod
+    def __touch(package_name):
+        # Called with the lock held; bump the generation so a build that started before this write is discarded
+        PackageStatistics.__generations[package_name] = PackageStatistics.__generations.get(package_name, 0) + 1
+        return PackageStatistics.__packages.get(package_name)
+
+    @staticmethod
+    def __build(store, package_name, generation):
+        counters = _PackageCounters(store.find(package_name), datetime.now())
+        with PackageStatistics.__lock:
+            if PackageStatistics.__generations.get(package_name, 0) == generation:
+                PackageStatistics.__packages[package_name] = counters
+        return counters
+
+    @staticmethod
+    def __rebuild(store, package_name, generation):
+        try:
+            PackageStatistics.__build(store, package_name, generation)
+        except Exception as e:
+            print(f"Error building statistics for package '{package_name}': {e}")
+        finally:
+            with PackageStatistics.__lock:
+                PackageStatistics.__building.discard(package_name)
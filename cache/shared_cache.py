@@ -0,0 +1,613 @@
+"""
+Cache of package versions and snapshots shared by the worker processes of a host.
+
+The cache is a memory-mapped file (on /dev/shm by default) with a fixed
+layout (little endian):
+
+    header     magic, format version, slot count, data area size, and the
+               number of bytes ever written to the data area (the head)
+    slots      per package: a sequence number, the hash of the name, the
+               package version, and the version, position and length of its
+               latest snapshot
+    data area  ring of snapshot records: the package name, then the toggles
+               sorted by beginning date as fixed-size records holding their
+               dates, the largest expiration date of every block of
+               BLOCK_SIZE records, and the JSON payloads of the other fields
+
+Readers take no lock: they read a slot, work on the mapped snapshot in
+place and only keep the result if the slot sequence number did not change
+and the ring did not wrap over the snapshot meanwhile. Writers, rare
+(a version bump or a snapshot published after a miss), hold a file lock.
+"""
+from bisect import bisect_right
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import hashlib
+import json
+import mmap
+import orjson
+import os
+import struct
+import tempfile
+import threading
+import time
+
+
+# Share the package versions and the /active snapshots between the worker processes of a host
+SHARED_CACHE_ENABLED = os.getenv("SHARED_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# File backing the shared cache; every worker of a host must use the same one
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "feature-toggles.cache"))
+
+# Packages whose version and snapshot the shared cache holds; the least recently published are evicted beyond it
+SHARED_CACHE_SLOTS = int(os.getenv("SHARED_CACHE_SLOTS", 4096))
+
+# Size of the snapshot ring; the oldest snapshots are overwritten beyond it, and larger snapshots than a quarter are not shared
+SHARED_CACHE_SIZE_BYTES = int(os.getenv("SHARED_CACHE_SIZE_BYTES", 64 * 1024 * 1024))
+
+MAGIC = b"FTSHARED"
+FORMAT_VERSION = 1
+
+# magic, format version, slot count, data area size, head
+HEADER = struct.Struct("<8sHxxIQQ")
+HEAD = struct.Struct("<Q")
+HEAD_OFFSET = 24
+# sequence number (odd while the slot is written), key, package version, snapshot version,
+# snapshot position in the ring, snapshot length
+SLOT = struct.Struct("<QQqqQI4x")
+SEQUENCE = struct.Struct("<Q")
+# key, name length
+RECORD = struct.Struct("<QI4x")
+
+# Slots probed for a package before the oldest one is evicted
+PROBES = 16
+
+# Attempts to read a slot that a writer keeps changing
+READ_ATTEMPTS = 8
+
+# Records per block; a block whose largest expiration date is in the past is skipped as a whole
+BLOCK_SIZE = 64
+
+# toggle count, blocks offset, payloads offset, 1 if payloads hold other dates than DATE_FIELDS
+SNAPSHOT_HEADER = struct.Struct("<IIII")
+# beginning, expiration, created_at, updated_at (microseconds since the epoch, NO_DATE when missing),
+# payload offset, payload length, position in the storage order
+FEATURE = struct.Struct("<qqqqIII4x")
+BEGINNING = struct.Struct("<q")
+BLOCK_MAX = struct.Struct("<q")
+
+EPOCH = datetime(1970, 1, 1)
+
+# Dates kept in the fixed-size records; the payloads hold null in their place, so the field order is kept
+DATE_FIELDS = ("beginning_date", "expiration_date", "created_at", "updated_at")
+NO_DATE = -2 ** 63
+
+# Packages too large to share are evaluated locally for this long before trying again
+OVERSIZED_RETRY_SECONDS = 300
+
+
+def _key(name):
+    # 64-bit hash of a package name, never 0 (the key of an empty slot)
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), 'little') | 1
+
+
+def _to_micros(date):
+    return (date - EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(micros):
+    return EPOCH + timedelta(0, 0, micros)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"$date": _to_micros(value)}
+    raise TypeError(f"Cannot share a value of type {type(value).__name__}")
+
+
+def _decode_object(value):
+    if len(value) == 1 and "$date" in value:
+        return _from_micros(value["$date"])
+    return value
+
+
+def _align(length):
+    return length + (-length % 8)
+
+
+def encode_snapshot(features):
+    """
+    Serialize the feature toggles of a package for the shared cache
+
+    :param features: The feature toggle documents, in storage order
+    :return: The snapshot
+    :rtype: bytes
+    """
+    ordered = sorted(enumerate(features), key=lambda item: (item[1]['beginning_date'], item[0]))
+    other_dates = [False]
+
+    def encode_value(value):
+        other_dates[0] = True
+        return _encode_value(value)
+
+    payloads = [json.dumps({key: None if key in DATE_FIELDS and isinstance(value, datetime) else value
+                            for key, value in feature.items()},
+                           default=encode_value, separators=(",", ":")).encode()
+                for _, feature in ordered]
+
+    blocks_offset = SNAPSHOT_HEADER.size + len(ordered) * FEATURE.size
+    payloads_offset = blocks_offset + (len(ordered) + BLOCK_SIZE - 1) // BLOCK_SIZE * BLOCK_MAX.size
+    buffer = bytearray(payloads_offset)
+    SNAPSHOT_HEADER.pack_into(buffer, 0, len(ordered), blocks_offset, payloads_offset, int(other_dates[0]))
+
+    for index, ((position, feature), payload) in enumerate(zip(ordered, payloads)):
+        dates = [_to_micros(feature[field]) if isinstance(feature.get(field), datetime) else NO_DATE
+                 for field in DATE_FIELDS]
+        FEATURE.pack_into(
+            buffer, SNAPSHOT_HEADER.size + index * FEATURE.size,
+            *dates, len(buffer), len(payload), position)
+        buffer.extend(payload)
+
+    for block, start in enumerate(range(0, len(ordered), BLOCK_SIZE)):
+        BLOCK_MAX.pack_into(buffer, blocks_offset + block * BLOCK_MAX.size, max(
+            _to_micros(feature['expiration_date']) for _, feature in ordered[start:start + BLOCK_SIZE]))
+    return bytes(buffer)
+
+
+def active_at(features, when):
+    """
+    Evaluate the feature toggles of a package without a snapshot
+
+    :param features: The feature toggle documents
+    :param when: Evaluation time (naive UTC)
+    :return: The active toggles and the nearest beginning date after `when` (or None)
+    :rtype: tuple
+    """
+    active_features = [feature for feature in features
+                       if feature['beginning_date'] <= when <= feature['expiration_date']]
+    next_beginning_date = min(
+        (feature['beginning_date'] for feature in features if feature['beginning_date'] > when), default=None)
+    return active_features, next_beginning_date
+
+
+def _decode_feature(buffer, record, other_dates):
+    payload = buffer[record[4]:record[4] + record[5]]
+    # orjson parses the mapped bytes in place; payloads with other dates go through json's object hook
+    feature = json.loads(bytes(payload), object_hook=_decode_object) if other_dates else orjson.loads(payload)
+    for field, micros in zip(DATE_FIELDS, record):
+        if micros != NO_DATE:
+            feature[field] = EPOCH + timedelta(0, 0, micros)
+    return feature
+
+
+def _find_active(buffer, offset, micros):
+    """
+    Decode the active toggles of a mapped snapshot
+
+    Records are read in place; only the payloads of the active toggles are parsed.
+
+    :param buffer: Memoryview of the map
+    :param offset: Offset of the snapshot
+    :param micros: Evaluation time in microseconds since the epoch
+    :return: The active toggles in storage order and the next beginning date in microseconds (or None)
+    :rtype: tuple
+    """
+    snapshot = buffer[offset:]
+    count, blocks_offset, _, other_dates = SNAPSHOT_HEADER.unpack_from(snapshot, 0)
+
+    # Records are sorted by beginning date: only the ones before `end` have begun
+    end = bisect_right(_Beginnings(snapshot, SNAPSHOT_HEADER.size, count), micros)
+    matches = []
+    for block in range((end + BLOCK_SIZE - 1) // BLOCK_SIZE):
+        if BLOCK_MAX.unpack_from(snapshot, blocks_offset + block * BLOCK_MAX.size)[0] < micros:
+            continue
+        for index in range(block * BLOCK_SIZE, min(end, (block + 1) * BLOCK_SIZE)):
+            record = FEATURE.unpack_from(snapshot, SNAPSHOT_HEADER.size + index * FEATURE.size)
+            if record[1] >= micros:
+                matches.append(record)
+
+    matches.sort(key=lambda record: record[6])
+    next_beginning = BEGINNING.unpack_from(snapshot, SNAPSHOT_HEADER.size + end * FEATURE.size)[0] \
+        if end < count else None
+    return [_decode_feature(snapshot, record, other_dates) for record in matches], next_beginning
+
+
+class _Beginnings:
+    """
+    Read-only sequence view of the beginning dates of a snapshot's records, for bisect.
+    """
+    __slots__ = ("buffer", "offset", "length")
+
+    def __init__(self, buffer, offset, length):
+        self.buffer = buffer
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        return BEGINNING.unpack_from(self.buffer, self.offset + index * FEATURE.size)[0]
+
+
+class SharedArena:
+    """
+    The memory-mapped file of the shared cache, opened by one process.
+
+    The first process formats the file; the others map it with the geometry
+    written in its header, whatever their own settings. Changes made by one
+    process are read by the others without any copy through the storage.
+    """
+
+    def __init__(self, path, slot_count=SHARED_CACHE_SLOTS, data_size=SHARED_CACHE_SIZE_BYTES):
+        # Cross-process file locks; POSIX only, like the workers sharing the file
+        import fcntl
+        self.__fcntl = fcntl
+        self.path = path
+        self.__thread_lock = threading.Lock()
+        self.__fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            with self.__locked():
+                header = os.pread(self.__fd, HEADER.size, 0)
+                if len(header) == HEADER.size and header[:len(MAGIC)] == MAGIC:
+                    magic, version, slot_count, data_size, _ = HEADER.unpack(header)
+                    if version != FORMAT_VERSION:
+                        raise ValueError(f"'{path}' is a version {version} shared cache, expected {FORMAT_VERSION}")
+                else:
+                    data_size = _align(data_size)
+                    os.ftruncate(self.__fd, 0)
+                    os.ftruncate(self.__fd, self.__data_offset(slot_count) + data_size)
+                    os.pwrite(self.__fd, HEADER.pack(MAGIC, FORMAT_VERSION, slot_count, data_size, 0), 0)
+            self.slot_count = slot_count
+            self.data_size = data_size
+            self.size = self.__data_offset(slot_count) + data_size
+            self.__map = mmap.mmap(self.__fd, self.size)
+        except Exception:
+            os.close(self.__fd)
+            raise
+
+    @staticmethod
+    def __data_offset(slot_count):
+        return _align(HEADER.size + slot_count * SLOT.size)
+
+    @contextmanager
+    def __locked(self):
+        # File locks belong to the process: the threads of a process also take a thread lock
+        with self.__thread_lock:
+            self.__fcntl.lockf(self.__fd, self.__fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                self.__fcntl.lockf(self.__fd, self.__fcntl.LOCK_UN)
+
+    def __head(self):
+        return HEAD.unpack_from(self.__map, HEAD_OFFSET)[0]
+
+    def __slot_offsets(self, key):
+        for probe in range(min(PROBES, self.slot_count)):
+            yield HEADER.size + (key + probe) % self.slot_count * SLOT.size
+
+    def __read_slot(self, offset):
+        # A slot is consistent when its sequence number is even and did not change while it was read
+        for _ in range(READ_ATTEMPTS):
+            slot = SLOT.unpack_from(self.__map, offset)
+            if slot[0] % 2 == 0 and SEQUENCE.unpack_from(self.__map, offset)[0] == slot[0]:
+                return slot
+        return None
+
+    def __find(self, key):
+        for offset in self.__slot_offsets(key):
+            slot = self.__read_slot(offset)
+            if slot is None:
+                return None, None
+            if slot[1] == key:
+                return offset, slot
+            # Slots are never emptied, so an empty slot ends the probe sequence
+            if slot[1] == 0:
+                return None, None
+        return None, None
+
+    def __write_slot(self, offset, key, version, snapshot_version, start, length):
+        sequence = SEQUENCE.unpack_from(self.__map, offset)[0]
+        SEQUENCE.pack_into(self.__map, offset, sequence + 1)
+        SLOT.pack_into(self.__map, offset, sequence + 1, key, version, snapshot_version, start, length)
+        SEQUENCE.pack_into(self.__map, offset, sequence + 2)
+
+    def __claim(self, key):
+        # Under the lock: the slot of a key, else a free slot, else the one with the oldest snapshot
+        victim = None
+        for offset in self.__slot_offsets(key):
+            slot = SLOT.unpack_from(self.__map, offset)
+            if slot[1] == key:
+                return offset, slot
+            if slot[1] == 0:
+                return offset, (slot[0], key, 0, -1, 0, 0)
+            if victim is None or slot[4] < victim[1][4]:
+                victim = (offset, slot)
+        return victim[0], (victim[1][0], key, 0, -1, 0, 0)
+
+    def version(self, name):
+        """
+        Get the version of a package
+
+        :param name: The package name
+        :return: The version, or None if the package has no slot
+        :rtype: int
+        """
+        _, slot = self.__find(_key(name))
+        return None if slot is None else slot[2]
+
+    def publish_version(self, name, version):
+        """
+        Raise the version of a package; versions never go back
+
+        :param name: The package name
+        :param version: The new version
+        """
+        with self.__locked():
+            offset, (_, key, current, snapshot_version, start, length) = self.__claim(_key(name))
+            if version > current:
+                self.__write_slot(offset, key, version, snapshot_version, start, length)
+
+    def read(self, name, version, function):
+        """
+        Run a function on the mapped snapshot of a package
+
+        The function gets a memoryview of the map and the offset of the
+        snapshot. It must not keep views of the buffer: its result is dropped
+        if a writer reused the memory while it ran.
+
+        :param name: The package name
+        :param version: The package version the snapshot must have
+        :param function: Callable taking the buffer and the snapshot offset
+        :return: The result of the function, or None if there is no valid snapshot at that version
+        """
+        key = _key(name)
+        offset, slot = self.__find(key)
+        if slot is None or slot[3] != version or slot[5] == 0:
+            return None
+        sequence, _, _, _, start, _ = slot
+        if self.__head() - start > self.data_size:
+            return None
+
+        position = self.__data_offset(self.slot_count) + start % self.data_size
+        record_key, name_length = RECORD.unpack_from(self.__map, position)
+        encoded_name = name.encode()
+        if record_key != key or self.__map[position + RECORD.size:position + RECORD.size + name_length] != encoded_name:
+            return None
+        error = result = None
+        with memoryview(self.__map) as buffer:
+            try:
+                result = function(buffer, _align(position + RECORD.size + name_length))
+            except (ValueError, IndexError, struct.error) as e:
+                # Bytes overwritten while they were parsed; raised again if the snapshot turns out valid
+                error = e
+
+        # The ring may have wrapped over the snapshot, or the slot been rewritten, while the function ran
+        if SEQUENCE.unpack_from(self.__map, offset)[0] != sequence or self.__head() - start > self.data_size:
+            return None
+        if error is not None:
+            raise error
+        return result
+
+    def publish(self, name, version, snapshot):
+        """
+        Store the snapshot of a package
+
+        :param name: The package name
+        :param version: The package version of the snapshot
+        :param snapshot: The snapshot, from encode_snapshot
+        :return: False if the snapshot is too large to be shared
+        :rtype: bool
+        """
+        encoded_name = name.encode()
+        length = _align(RECORD.size + len(encoded_name)) + _align(len(snapshot))
+        if length > self.data_size // 4:
+            return False
+
+        data_offset = self.__data_offset(self.slot_count)
+        with self.__locked():
+            offset, (_, key, current, snapshot_version, start, _) = self.__claim(_key(name))
+            head = self.__head()
+            if snapshot_version >= version and head - start <= self.data_size:
+                return True
+
+            # Snapshots never wrap around the end of the ring
+            start = head
+            if start % self.data_size + length > self.data_size:
+                start += self.data_size - start % self.data_size
+            # Move the head first: readers of the snapshots being overwritten then drop their result
+            HEAD.pack_into(self.__map, HEAD_OFFSET, start + length)
+            position = data_offset + start % self.data_size
+            RECORD.pack_into(self.__map, position, key, len(encoded_name))
+            self.__map[position + RECORD.size:position + RECORD.size + len(encoded_name)] = encoded_name
+            snapshot_position = _align(position + RECORD.size + len(encoded_name))
+            self.__map[snapshot_position:snapshot_position + len(snapshot)] = snapshot
+            self.__write_slot(offset, key, max(current, version), version, start, length)
+        return True
+
+    def get_stats(self):
+        """
+        Get the arena occupancy
+
+        :return: Packages with a slot, bytes of the ring in use and size of the file
+        :rtype: dict
+        """
+        packages = sum(1 for index in range(self.slot_count)
+                       if SLOT.unpack_from(self.__map, HEADER.size + index * SLOT.size)[1] != 0)
+        return {"packages": packages, "bytes": min(self.__head(), self.data_size), "size": self.size}
+
+    def close(self):
+        """
+        Unmap and close the file; the file itself is kept for the other workers
+        """
+        if not self.__map.closed:
+            self.__map.close()
+            os.close(self.__fd)
+
+
+def read_active(arena, name, version, when):
+    """
+    Evaluate a package from its shared snapshot
+
+    :param arena: The SharedArena
+    :param name: The package name
+    :param version: The package version the snapshot must have
+    :param when: Evaluation time (naive UTC)
+    :return: The active toggles in storage order and the next beginning date (or None), or None without a snapshot
+    :rtype: tuple
+    """
+    found = arena.read(name, version, lambda buffer, offset: _find_active(buffer, offset, _to_micros(when)))
+    if found is None:
+        return None
+    active_features, next_beginning = found
+    return active_features, None if next_beginning is None else _from_micros(next_beginning)
+
+
+class SharedCache:
+    """
+    Package versions and /active snapshots shared by the workers of a host (SHARED_CACHE_ENABLED).
+
+    Versions bumped by a worker are seen by the others on their next read,
+    instead of after PACKAGE_VERSION_TTL_SECONDS. A snapshot is published at a
+    package version by the first worker that misses it; every worker then
+    answers /active for that version from the same memory. A write makes the
+    snapshot stale by bumping the version, so no invalidation has to reach
+    the other workers. Every call degrades to a miss if the file cannot be used.
+    """
+    __arena = None
+    __opened = False
+    __oversized = {}
+    __lock = threading.Lock()
+    __hits = 0
+    __misses = 0
+    __publishes = 0
+
+    @staticmethod
+    def __get_arena():
+        if not SHARED_CACHE_ENABLED:
+            return None
+        if not SharedCache.__opened:
+            with SharedCache.__lock:
+                if not SharedCache.__opened:
+                    try:
+                        SharedCache.__arena = SharedArena(SHARED_CACHE_PATH)
+                    except Exception as e:
+                        print(f"Error opening the shared cache '{SHARED_CACHE_PATH}': {e}")
+                    SharedCache.__opened = True
+        return SharedCache.__arena
+
+    @staticmethod
+    def version(package_name):
+        """
+        Get the version of a package as last published by any worker
+
+        :param package_name: The name of the package
+        :return: The version, or None if unknown
+        :rtype: int
+        """
+        arena = SharedCache.__get_arena()
+        return arena.version(package_name) if arena is not None else None
+
+    @staticmethod
+    def publish_version(package_name, version):
+        """
+        Publish the version of a package after a write
+
+        :param package_name: The name of the package
+        :param version: The new version
+        """
+        arena = SharedCache.__get_arena()
+        if arena is None:
+            return
+        try:
+            arena.publish_version(package_name, version)
+        except Exception as e:
+            print(f"Error publishing the version of package '{package_name}' to the shared cache: {e}")
+
+    @staticmethod
+    def is_oversized(package_name):
+        """
+        Check if a package was recently too large to be shared
+
+        :param package_name: The name of the package
+        :return: True if the package should be evaluated without the shared cache
+        :rtype: bool
+        """
+        with SharedCache.__lock:
+            since = SharedCache.__oversized.get(package_name)
+        return since is not None and time.monotonic() - since < OVERSIZED_RETRY_SECONDS
+
+    @staticmethod
+    def active_features(package_name, version, when):
+        """
+        Evaluate a package from its shared snapshot
+
+        :param package_name: The name of the package
+        :param version: The current package version
+        :param when: Evaluation time (naive UTC)
+        :return: The active feature toggles and the next beginning date, or None if no snapshot has that version
+        :rtype: tuple
+        """
+        arena = SharedCache.__get_arena()
+        found = None
+        if arena is not None:
+            try:
+                found = read_active(arena, package_name, version, when)
+            except Exception as e:
+                print(f"Error reading package '{package_name}' from the shared cache: {e}")
+        with SharedCache.__lock:
+            if found is not None:
+                SharedCache.__hits += 1
+            else:
+                SharedCache.__misses += 1
+        return found
+
+    @staticmethod
+    def publish(package_name, version, features):
+        """
+        Publish the snapshot of a package for every worker
+
+        :param package_name: The name of the package
+        :param version: The package version read before loading the features
+        :param features: Every feature toggle of the package, in storage order
+        :return: False if the snapshot was not shared
+        :rtype: bool
+        """
+        arena = SharedCache.__get_arena()
+        if arena is None:
+            return False
+        try:
+            published = arena.publish(package_name, version, encode_snapshot(features))
+        except Exception as e:
+            print(f"Error publishing package '{package_name}' to the shared cache: {e}")
+            return False
+        with SharedCache.__lock:
+            if published:
+                SharedCache.__publishes += 1
+                SharedCache.__oversized.pop(package_name, None)
+            else:
+                SharedCache.__oversized[package_name] = time.monotonic()
+        return published
+
+    @staticmethod
+    def get_stats():
+        """
+        Get the cache counters
+
+        :return: Packages with a slot, lookup hits/misses, snapshots published by this worker,
+                 bytes of the ring in use and size of the file
+        :rtype: dict
+        """
+        arena = SharedCache.__get_arena()
+        occupancy = {"packages": 0, "bytes": 0, "size": 0}
+        if arena is not None:
+            occupancy = arena.get_stats()
+        with SharedCache.__lock:
+            return {
+                **occupancy,
+                "hits": SharedCache.__hits,
+                "misses": SharedCache.__misses,
+                "publishes": SharedCache.__publishes
+            }
@@ -0,0 +1,261 @@
+from bisect import bisect_right
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+from cache.interval_index import PackageIndex
+from evaluation.rules import applies_to
+import json
+import threading
+import time
+
+
+DATE_FIELDS = ['beginning_date', 'expiration_date', 'created_at', 'updated_at']
+
+
+def _parse_date(value):
+    # The API sends HTTP dates ("Wed, 01 Jan 2020 00:00:00 GMT"); ISO 8601 is accepted too
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        date = datetime.fromisoformat(value)
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+
+def _utc(at):
+    # Naive datetimes are taken as UTC, like the dates stored by the API
+    if at is None:
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+    if at.tzinfo is not None:
+        return at.astimezone(timezone.utc).replace(tzinfo=None)
+    return at
+
+
+class _ToggleSet:
+    """
+    Immutable evaluation structure of one version of a package.
+
+    Each name maps to its (beginning_date, expiration_date, position) windows
+    sorted by beginning date, so is_enabled is a dict lookup and a bisect.
+    Names are unique in a package, so there is normally one window per name.
+    """
+    __slots__ = ("features", "windows", "beginnings", "index")
+
+    def __init__(self, features):
+        self.features = features
+        windows = {}
+        for position, feature in enumerate(features):
+            windows.setdefault(feature['name'], []).append(
+                (feature['beginning_date'], feature['expiration_date'], position))
+        self.windows = {name: sorted(name_windows) for name, name_windows in windows.items()}
+        self.beginnings = {name: [window[0] for window in name_windows] for name, name_windows in self.windows.items()}
+        self.index = PackageIndex(features)
+
+    def is_enabled(self, name, at, subject=None):
+        windows = self.windows.get(name)
+        if windows is None:
+            return False
+        # Only the windows that began by `at` can contain it
+        begun = bisect_right(self.beginnings[name], at)
+        return any(expiration_date >= at and (subject is None or applies_to(self.features[position], subject))
+                   for _, expiration_date, position in windows[:begun])
+
+
+class FeatureToggleClient:
+    """
+    In-process evaluation of one package's feature toggles.
+
+    The toggles are fetched once from GET /feature-toggles/<package_name> and
+    evaluated locally. A background thread re-fetches them every
+    `refresh_interval` seconds with If-None-Match, so an unchanged package
+    costs a 304. A toggle is enabled at T when beginning_date <= T <=
+    expiration_date, as with /active. Given a subject, its rollout rules must
+    also include the subject, with the same buckets as the evaluate endpoint.
+
+    By default the first evaluation waits for the first fetch. With
+    `stale_while_revalidate`, evaluations never wait on the network: before
+    the first fetch completes every toggle is reported disabled, and data
+    older than `refresh_interval` is served while a refresh runs in the
+    background.
+    """
+
+    def __init__(self, base_url, package_name, refresh_interval=30, stale_while_revalidate=False,
+                 background_refresh=True, timeout=5):
+        self.url = f"{base_url.rstrip('/')}/feature-toggles/{quote(package_name, safe='')}"
+        self.package_name = package_name
+        self.refresh_interval = refresh_interval
+        self.stale_while_revalidate = stale_while_revalidate
+        self.background_refresh = background_refresh
+        self.timeout = timeout
+        self.__toggles = None
+        self.__etag = None
+        self.__refreshed_at = None
+        self.__attempted_at = None
+        self.__refresh_lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.__fetches = 0
+        self.__not_modified = 0
+        self.__errors = 0
+
+    def start(self):
+        """
+        Start the background refresh thread
+
+        Without stale_while_revalidate the first fetch happens before returning.
+
+        :return: The client
+        :rtype: FeatureToggleClient
+        """
+        if not self.stale_while_revalidate:
+            self.refresh()
+        if self.background_refresh and self.__thread is None:
+            self.__stop.clear()
+            self.__thread = threading.Thread(target=self.__run, name=f"feature-toggles-{self.package_name}", daemon=True)
+            self.__thread.start()
+        return self
+
+    def close(self):
+        """
+        Stop the background refresh thread
+        """
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join(self.timeout)
+            self.__thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def is_enabled(self, name, at=None, subject=None):
+        """
+        Check if a feature toggle is enabled
+
+        :param name: The name of the feature toggle
+        :param at: Evaluation time, now by default; naive datetimes are UTC
+        :param subject: Subject ID checked against the toggle's rollout rules, or None to ignore them
+        :return: True if the toggle exists and is active at that time (and applies to the subject)
+        :rtype: bool
+        """
+        toggles = self.__current()
+        return toggles is not None and toggles.is_enabled(name, _utc(at), subject)
+
+    def enabled_features(self, at=None, subject=None):
+        """
+        Get the feature toggles enabled at a point in time
+
+        :param at: Evaluation time, now by default; naive datetimes are UTC
+        :param subject: Subject ID checked against the toggles' rollout rules, or None to ignore them
+        :return: The active feature toggle documents, which must not be modified
+        :rtype: list
+        """
+        toggles = self.__current()
+        if toggles is None:
+            return []
+        features = toggles.index.stab(_utc(at))
+        if subject is None:
+            return features
+        return [feature for feature in features if applies_to(feature, subject)]
+
+    def refresh(self):
+        """
+        Re-fetch the package if it changed, with a conditional request
+
+        Concurrent calls share one request. Errors are logged and leave the
+        current toggles in place.
+
+        :return: True if new toggles were loaded
+        :rtype: bool
+        """
+        if not self.__refresh_lock.acquire(blocking=False):
+            # Another caller is fetching: wait for it instead of sending a second request
+            with self.__refresh_lock:
+                return False
+        try:
+            return self.__fetch()
+        finally:
+            self.__refresh_lock.release()
+
+    def get_stats(self):
+        """
+        Get the client counters
+
+        :return: Fetches, 304 answers, errors, the current ETag and the age of the data in seconds
+        :rtype: dict
+        """
+        refreshed_at = self.__refreshed_at
+        return {
+            "fetches": self.__fetches,
+            "not_modified": self.__not_modified,
+            "errors": self.__errors,
+            "etag": self.__etag,
+            "age_seconds": round(time.monotonic() - refreshed_at, 3) if refreshed_at is not None else None
+        }
+
+    def __current(self):
+        toggles = self.__toggles
+        if toggles is None and not self.stale_while_revalidate and self.__fetches == 0:
+            # Only the first evaluation waits; after a failed fetch the background thread retries
+            self.refresh()
+            return self.__toggles
+        # The lock is taken here and released by the thread, so concurrent stale reads start one refresh
+        if self.stale_while_revalidate and self.__is_stale() and self.__refresh_lock.acquire(blocking=False):
+            threading.Thread(target=self.__revalidate, daemon=True).start()
+        return toggles
+
+    def __revalidate(self):
+        try:
+            self.__fetch()
+        finally:
+            self.__refresh_lock.release()
+
+    def __is_stale(self):
+        # Measured from the last attempt, so an unreachable server is retried once per interval
+        attempted_at = self.__attempted_at
+        return attempted_at is None or time.monotonic() - attempted_at >= self.refresh_interval
+
+    def __fetch(self):
+        request = Request(self.url, headers={"Accept": "application/json"})
+        if self.__etag is not None:
+            request.add_header("If-None-Match", self.__etag)
+        self.__fetches += 1
+        self.__attempted_at = time.monotonic()
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                features = json.loads(response.read())
+                etag = response.headers.get("ETag")
+        except HTTPError as e:
+            if e.code == 304:
+                self.__not_modified += 1
+                self.__refreshed_at = time.monotonic()
+                return False
+            if e.code == 404:
+                # The package does not exist (yet): every toggle is disabled
+                features, etag = [], None
+            else:
+                self.__errors += 1
+                print(f"Error refreshing feature toggles of package '{self.package_name}': HTTP {e.code}")
+                return False
+        except (URLError, OSError, ValueError) as e:
+            self.__errors += 1
+            print(f"Error refreshing feature toggles of package '{self.package_name}': {e}")
+            return False
+
+        for feature in features:
+            for field in DATE_FIELDS:
+                if isinstance(feature.get(field), str):
+                    feature[field] = _parse_date(feature[field])
+        self.__toggles = _ToggleSet(features)
+        self.__etag = etag
+        self.__refreshed_at = time.monotonic()
+        return True
+
+    def __run(self):
+        while not self.__stop.wait(self.refresh_interval):
+            self.refresh()
@@ -0,0 +1,81 @@
+from pymongo import AsyncMongoClient
+from pymongo.server_api import ServerApi
+from database.connection import (MONGO_URI, DB_NAME, client_options, DB_BREAKER_FAILURE_THRESHOLD,
+                                 DB_BREAKER_BACKOFF_SECONDS, DB_BREAKER_MAX_BACKOFF_SECONDS)
+from database.circuit_breaker import CircuitBreaker
+from database.connection_monitor import ConnectionMonitor
+from metrics.instrumentation import command_listeners
+
+
+class AsyncMongoConnectionHolder:
+    """
+    Async (AsyncMongoClient) counterpart of MongoConnectionHolder for the ASGI entry point.
+
+    The client is bound to the event loop it is created on, so it is created
+    from the ASGI lifespan startup (or the first request) rather than at import
+    time. Like the synchronous holder it does no I/O on creation and is guarded
+    by its own circuit breaker.
+    """
+    __client = None
+    __db = None
+    __breaker = CircuitBreaker(DB_BREAKER_FAILURE_THRESHOLD, DB_BREAKER_BACKOFF_SECONDS, DB_BREAKER_MAX_BACKOFF_SECONDS)
+    __monitor = ConnectionMonitor(__breaker)
+
+    @staticmethod
+    async def initialize_db():
+        """
+        Initialize the async database connection
+
+        :return: Async MongoDB database
+        :rtype: AsyncDatabase
+        """
+        if AsyncMongoConnectionHolder.__db is None and AsyncMongoConnectionHolder.__breaker.admit():
+            try:
+                print("Initializing async MongoDB connection...")
+                client = AsyncMongoClient(
+                    MONGO_URI,
+                    server_api=ServerApi('1'),
+                    event_listeners=[AsyncMongoConnectionHolder.__monitor] + command_listeners(),
+                    **client_options())
+                AsyncMongoConnectionHolder.__client = client
+                AsyncMongoConnectionHolder.__db = client[DB_NAME]
+            except Exception as e:
+                print(e)
+                AsyncMongoConnectionHolder.__breaker.record_failure()
+        return AsyncMongoConnectionHolder.__db
+
+    @staticmethod
+    def get_db():
+        """
+        Get the async database connection
+
+        :return: Async MongoDB database, or None before initialize_db() succeeded or while the database is unreachable
+        :rtype: AsyncDatabase
+        """
+        if AsyncMongoConnectionHolder.__db is None or not AsyncMongoConnectionHolder.__breaker.admit():
+            return None
+        return AsyncMongoConnectionHolder.__db
+
+    @staticmethod
+    def get_stats():
+        """
+        Get the connection pool counters and the circuit breaker state
+
+        :return: Pool counters and breaker state
+        :rtype: dict
+        """
+        return {
+            "connected": AsyncMongoConnectionHolder.__client is not None,
+            "pool": AsyncMongoConnectionHolder.__monitor.get_stats(),
+            "circuit_breaker": AsyncMongoConnectionHolder.__breaker.get_stats()
+        }
+
+    @staticmethod
+    async def close():
+        """
+        Close the async client
+        """
+        if AsyncMongoConnectionHolder.__client is not None:
+            await AsyncMongoConnectionHolder.__client.close()
+            AsyncMongoConnectionHolder.__client = None
+            AsyncMongoConnectionHolder.__db = None
@@ -0,0 +1,92 @@
+from database.package_registry import SYSTEM_COLLECTION_PREFIX
+from events.event_bus import EventBus, make_event
+import os
+
+
+# Capped collection holding the recent changes of every package, one document per package version
+CHANGE_LOG_COLLECTION = f"{SYSTEM_COLLECTION_PREFIX}change_log"
+
+# Size of the capped change log collection; the oldest changes are dropped beyond it
+CHANGE_LOG_SIZE_BYTES = int(os.getenv("CHANGE_LOG_SIZE_BYTES", 64 * 1024 * 1024))
+
+# Changes kept per package by the in-memory storage
+CHANGE_LOG_MAX_ENTRIES = int(os.getenv("CHANGE_LOG_MAX_ENTRIES", 10000))
+
+# Most changes returned by one /changes request
+CHANGE_LOG_PAGE_SIZE = int(os.getenv("CHANGE_LOG_PAGE_SIZE", 1000))
+
+
+def _contiguous(changes, version):
+    """
+    Keep the changes that directly follow a version, up to the first gap
+
+    :param changes: Changes in version order
+    :param version: The last version the client has seen
+    :return: The changes numbered version + 1, version + 2, ...
+    :rtype: list
+    """
+    for position, change in enumerate(changes):
+        if change['version'] != version + 1 + position:
+            return changes[:position]
+    return changes
+
+
+class ChangeLog:
+    """
+    Ordered log of the changes of each package, numbered by package version.
+
+    Every write appends its changes to the storage (a capped collection on
+    MongoDB), so a client can catch up with the changes made since the version
+    it last saw, whichever worker made them. Reads are answered from the
+    EventBus buffer when it holds every change up to the current version.
+    Entries have the format of the change events.
+    """
+
+    @staticmethod
+    def record(store, package_name, version, changes):
+        """
+        Append the changes of a write to the log of a package
+
+        :param store: The FeatureStore
+        :param package_name: The name of the package
+        :param version: The package version after the write, the last change gets it
+        :param changes: (kind, payload) pairs in write order, as given to the write routes' _publish_changes
+        :return: The change events, with their versions
+        :rtype: list
+        """
+        first_version = version - len(changes) + 1
+        events = [make_event(package_name, first_version + offset, kind, payload)
+                  for offset, (kind, payload) in enumerate(changes)]
+        try:
+            store.append_changes(package_name, events)
+        except Exception as e:
+            # Clients reading past the missing versions are asked to resync
+            print(f"Error appending to the change log of package '{package_name}': {e}")
+        return events
+
+    @staticmethod
+    def since(store, package_name, version, current_version, limit=CHANGE_LOG_PAGE_SIZE):
+        """
+        Get the changes of a package newer than a version
+
+        A gap right after the version means its changes were compacted out of
+        the log (or never logged); the client must then re-read the package.
+
+        :param store: The FeatureStore
+        :param package_name: The name of the package
+        :param version: The last version the client has seen
+        :param current_version: The current package version, or None if unknown
+        :param limit: Maximum number of changes
+        :return: The changes in version order, and True if the client must resync instead
+        :rtype: tuple
+        """
+        buffered = _contiguous(EventBus.events_since(package_name, version)[0], version)
+        latest = buffered[-1]['version'] if buffered else version
+        if current_version is not None and latest >= current_version:
+            return buffered[:limit], False
+
+        logged = store.changes_since(package_name, version, limit)
+        changes = _contiguous(logged, version)
+        if changes:
+            return changes, False
+        return [], bool(logged) or (current_version is not None and current_version > version)
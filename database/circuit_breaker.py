@@ -0,0 +1,140 @@
+import contextvars
+import threading
+import time
+
+
+# Answer of each breaker for the current request, or None outside a request scope
+_admissions = contextvars.ContextVar("circuit_breaker_admissions", default=None)
+
+
+def begin_request_scope():
+    """
+    Start a request scope, in which every breaker is asked at most once
+
+    Called by the entry points (the Flask app and the ASGI app); a scope that
+    is already open is kept, so the ASGI app and the Flask hooks of the same
+    request share one.
+
+    :return: Token for end_request_scope, or None if a scope was already open
+    """
+    if _admissions.get() is not None:
+        return None
+    return _admissions.set({})
+
+
+def end_request_scope(token):
+    """
+    End the request scope started by begin_request_scope
+
+    :param token: The token returned by begin_request_scope
+    """
+    if token is not None:
+        _admissions.reset(token)
+
+
+class CircuitBreaker:
+    """
+    Fails fast while a dependency is unreachable.
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    allow() returns False for `backoff` seconds. It then lets one trial through
+    per backoff period (half-open): a success closes it, a failure re-opens it
+    with the backoff doubled, up to `max_backoff`.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold, backoff, max_backoff):
+        self.failure_threshold = failure_threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.__state = CircuitBreaker.CLOSED
+        self.__failures = 0
+        self.__opened = 0
+        self.__retry_at = 0
+        self.__lock = threading.Lock()
+
+    def allow(self):
+        """
+        Check if a call may go to the dependency
+
+        :return: False while the breaker is open
+        :rtype: bool
+        """
+        with self.__lock:
+            if self.__state == CircuitBreaker.CLOSED:
+                return True
+            now = time.monotonic()
+            if now < self.__retry_at:
+                return False
+            # Let one trial through, the next one waits for another backoff period
+            self.__state = CircuitBreaker.HALF_OPEN
+            self.__retry_at = now + self.__current_backoff()
+            return True
+
+    def admit(self):
+        """
+        Check if the current request may call the dependency
+
+        A request uses the dependency several times (e.g. decorators, then the
+        view): within a request scope the first answer is kept, so the single
+        half-open trial is a whole request rather than its first call. Outside
+        a scope (background threads) this is allow().
+
+        :return: False while the breaker is open
+        :rtype: bool
+        """
+        admissions = _admissions.get()
+        if admissions is None:
+            return self.allow()
+        admitted = admissions.get(self)
+        if admitted is None:
+            admitted = admissions[self] = self.allow()
+        return admitted
+
+    def record_success(self):
+        """
+        Close the breaker after the dependency answered
+        """
+        with self.__lock:
+            if self.__state != CircuitBreaker.CLOSED:
+                print("Circuit breaker closed")
+            self.__state = CircuitBreaker.CLOSED
+            self.__failures = 0
+            self.__opened = 0
+
+    def record_failure(self):
+        """
+        Count a failed call, opening the breaker past the threshold
+        """
+        with self.__lock:
+            self.__failures += 1
+            # Failures reported while open (e.g. background heartbeats) do not extend the backoff
+            if self.__state == CircuitBreaker.OPEN:
+                return
+            if self.__state == CircuitBreaker.HALF_OPEN or self.__failures >= self.failure_threshold:
+                backoff = self.__current_backoff()
+                if self.__state == CircuitBreaker.CLOSED:
+                    print(f"Circuit breaker opened for {backoff}s after {self.__failures} failures")
+                self.__state = CircuitBreaker.OPEN
+                self.__retry_at = time.monotonic() + backoff
+                self.__opened += 1
+
+    def get_stats(self):
+        """
+        Get the breaker state
+
+        :return: The state, consecutive failures and seconds until the next trial
+        :rtype: dict
+        """
+        with self.__lock:
+            return {
+                "state": self.__state,
+                "consecutive_failures": self.__failures,
+                "retry_in_seconds": round(max(0, self.__retry_at - time.monotonic()), 3)
+                if self.__state != CircuitBreaker.CLOSED else 0
+            }
+
+    def __current_backoff(self):
+        return min(self.max_backoff, self.backoff * 2 ** self.__opened)
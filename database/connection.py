@@ -1,7 +1,12 @@
 from dotenv import load_dotenv
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
+from database.index_manager import IndexManager
+from database.circuit_breaker import CircuitBreaker
+from database.connection_monitor import ConnectionMonitor
+from metrics.instrumentation import command_listeners
 import os
+import threading
 
 
 # Load the environment variables
@@ -17,8 +22,55 @@ DB_PASSWORD = os.getenv("DB_PASSWORD")
 
 MONGO_URI = f"mongodb+srv://{DB_USERNAME}:{DB_PASSWORD}@{DB_CONNECTION_STRING}/{DB_NAME}"
 
+# Client options read from the environment; unset ones keep the driver defaults
+CLIENT_OPTION_VARIABLES = {
+    "maxPoolSize": ("DB_MAX_POOL_SIZE", int),
+    "minPoolSize": ("DB_MIN_POOL_SIZE", int),
+    "maxIdleTimeMS": ("DB_MAX_IDLE_TIME_MS", int),
+    "waitQueueTimeoutMS": ("DB_WAIT_QUEUE_TIMEOUT_MS", int),
+    "connectTimeoutMS": ("DB_CONNECT_TIMEOUT_MS", int),
+    "socketTimeoutMS": ("DB_SOCKET_TIMEOUT_MS", int),
+    "serverSelectionTimeoutMS": ("DB_SERVER_SELECTION_TIMEOUT_MS", int),
+    "readPreference": ("DB_READ_PREFERENCE", str),
+}
+
+# Consecutive connection failures before requests stop waiting on the database
+DB_BREAKER_FAILURE_THRESHOLD = int(os.getenv("DB_BREAKER_FAILURE_THRESHOLD", 3))
+
+# First and longest pause before the database is tried again once the breaker is open
+DB_BREAKER_BACKOFF_SECONDS = float(os.getenv("DB_BREAKER_BACKOFF_SECONDS", 1))
+DB_BREAKER_MAX_BACKOFF_SECONDS = float(os.getenv("DB_BREAKER_MAX_BACKOFF_SECONDS", 30))
+
+
+def client_options():
+    """
+    Read the MongoClient options from the environment
+
+    :return: Keyword arguments for MongoClient / AsyncMongoClient
+    :rtype: dict
+    """
+    options = {"serverSelectionTimeoutMS": 5000}
+    for option, (variable, parse) in CLIENT_OPTION_VARIABLES.items():
+        value = os.getenv(variable)
+        if value:
+            options[option] = parse(value)
+    return options
+
+
 class MongoConnectionHolder:
+    """
+    Lazily created MongoDB client shared by the whole process.
+
+    Creating the client does no I/O: the driver connects in the background and
+    on first use. While the database is unreachable a circuit breaker makes
+    get_db() return None right away instead of every request waiting for the
+    server selection timeout.
+    """
+    __client = None
     __db = None
+    __lock = threading.Lock()
+    __breaker = CircuitBreaker(DB_BREAKER_FAILURE_THRESHOLD, DB_BREAKER_BACKOFF_SECONDS, DB_BREAKER_MAX_BACKOFF_SECONDS)
+    __monitor = ConnectionMonitor(__breaker)
 
     @staticmethod
     def initialize_db():
@@ -28,21 +80,24 @@ class MongoConnectionHolder:
         :return: MongoDB connection
          :rtype: Database
         """
-        if MongoConnectionHolder.__db is None:
-            try:
-                print("Initializing MongoDB connection...")
-                print(MONGO_URI)
-                # Create a new client and connect to the server
-                client = MongoClient(MONGO_URI, server_api=ServerApi('1'))
-
-                # Send a ping to confirm a successful connection
-                client.admin.command('ping')
-                print("Pinged your deployment. You successfully connected to MongoDB!")
-                
-                MongoConnectionHolder.__db = client[DB_NAME]
-            except Exception as e:
-                print(MONGO_URI)
-                print(e)
+        if MongoConnectionHolder.__db is None and MongoConnectionHolder.__breaker.admit():
+            with MongoConnectionHolder.__lock:
+                if MongoConnectionHolder.__db is None:
+                    try:
+                        print("Initializing MongoDB connection...")
+                        client = MongoClient(
+                            MONGO_URI,
+                            server_api=ServerApi('1'),
+                            event_listeners=[MongoConnectionHolder.__monitor] + command_listeners(),
+                            **client_options())
+                        MongoConnectionHolder.__client = client
+                        MongoConnectionHolder.__db = client[DB_NAME]
+
+                        # Make sure every existing package has its indexes, without delaying startup
+                        IndexManager.backfill_async(MongoConnectionHolder.__db)
+                    except Exception as e:
+                        print(e)
+                        MongoConnectionHolder.__breaker.record_failure()
         return MongoConnectionHolder.__db
 
     @staticmethod
@@ -50,10 +105,28 @@ class MongoConnectionHolder:
         """
         Get the database connection
 
-        :return: MongoDB connection
+        :return: MongoDB connection, or None while the database is unreachable
         :rtype: Database
         """
         if MongoConnectionHolder.__db is None:
             MongoConnectionHolder.initialize_db()
+        elif not MongoConnectionHolder.__breaker.admit():
+            return None
 
         return MongoConnectionHolder.__db
+
+    @staticmethod
+    def get_stats():
+        """
+        Get the connection pool counters and the circuit breaker state
+
+        :return: Pool counters, breaker state and the effective client options
+        :rtype: dict
+        """
+        options = client_options()
+        return {
+            "connected": MongoConnectionHolder.__client is not None,
+            "pool": MongoConnectionHolder.__monitor.get_stats(),
+            "circuit_breaker": MongoConnectionHolder.__breaker.get_stats(),
+            "options": {option: str(value) for option, value in options.items()}
+        }
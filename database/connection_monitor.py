@@ -0,0 +1,102 @@
+from pymongo import monitoring
+import threading
+
+
+# Command failures caused by the connection rather than by the command itself
+NETWORK_ERROR_TYPES = ('AutoReconnect', 'NetworkTimeout', 'ConnectionFailure')
+
+
+class ConnectionMonitor(monitoring.ServerHeartbeatListener, monitoring.ConnectionPoolListener,
+                        monitoring.CommandListener):
+    """
+    pymongo event listener keeping connection pool counters and feeding a circuit breaker.
+
+    Heartbeats and network-level command failures report to the breaker, so an
+    unreachable server is detected by the driver's background monitoring as
+    well as by requests.
+    """
+
+    def __init__(self, breaker):
+        self.breaker = breaker
+        self.__counters = {
+            "connections_created": 0,
+            "connections_closed": 0,
+            "checkouts": 0,
+            "checkins": 0,
+            "checkout_failures": 0,
+            "pools_cleared": 0,
+            "heartbeat_failures": 0,
+            "network_errors": 0
+        }
+        self.__lock = threading.Lock()
+
+    def __count(self, name):
+        with self.__lock:
+            self.__counters[name] += 1
+
+    def get_stats(self):
+        """
+        Get the pool counters
+
+        :return: Open and in-use connections plus cumulative event counts
+        :rtype: dict
+        """
+        with self.__lock:
+            counters = dict(self.__counters)
+        counters["connections_open"] = counters["connections_created"] - counters["connections_closed"]
+        counters["connections_in_use"] = counters["checkouts"] - counters["checkins"]
+        return counters
+
+    # Server heartbeats
+
+    def started(self, event):
+        # Shared by heartbeats and commands; nothing to count
+        pass
+
+    def succeeded(self, event):
+        self.breaker.record_success()
+
+    def failed(self, event):
+        if isinstance(event, monitoring.ServerHeartbeatFailedEvent):
+            self.__count("heartbeat_failures")
+            self.breaker.record_failure()
+        elif event.failure.get('errtype') in NETWORK_ERROR_TYPES:
+            self.__count("network_errors")
+            self.breaker.record_failure()
+
+    # Connection pool
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.__count("pools_cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.__count("connections_created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.__count("connections_closed")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self.__count("checkout_failures")
+        if event.reason == monitoring.ConnectionCheckOutFailedReason.CONN_ERROR:
+            self.breaker.record_failure()
+
+    def connection_checked_out(self, event):
+        self.__count("checkouts")
+
+    def connection_checked_in(self, event):
+        self.__count("checkins")
@@ -0,0 +1,156 @@
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from database.package_registry import list_package_names
+from storage.expiry_sweeper import EXPIRY_MODE, EXPIRY_RETENTION_DAYS
+from storage.layout import STORAGE_LAYOUT, STORAGE_DUAL_READ, FEATURES_COLLECTION
+import threading
+
+
+# In ttl mode MongoDB deletes the toggles EXPIRY_RETENTION_DAYS after their expiration date
+EXPIRATION_TTL_OPTIONS = {"expireAfterSeconds": int(EXPIRY_RETENTION_DAYS * 86400)} if EXPIRY_MODE == "ttl" else {}
+
+# Error codes of an index that exists with other options
+INDEX_CONFLICT_CODES = (85, 86)
+
+# Indexes every package collection should have
+PACKAGE_INDEXES = [
+    IndexModel([("beginning_date", ASCENDING), ("expiration_date", ASCENDING)], name="beginning_date_expiration_date"),
+    IndexModel([("expiration_date", ASCENDING)], name="expiration_date", **EXPIRATION_TTL_OPTIONS),
+    # Serves the created_at range of /recent and the (created_at, _id) keyset of paginated lists
+    IndexModel([("created_at", ASCENDING), ("_id", ASCENDING)], name="created_at_id"),
+    IndexModel([("name", ASCENDING)], name="name_unique", unique=True),
+]
+
+# Indexes of the shared layout's collection, each led by the package name
+SHARED_INDEXES = [
+    IndexModel([("package_name", ASCENDING), ("beginning_date", ASCENDING), ("expiration_date", ASCENDING)],
+               name="package_beginning_date_expiration_date"),
+    IndexModel([("package_name", ASCENDING), ("expiration_date", ASCENDING)], name="package_expiration_date"),
+    IndexModel([("package_name", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)], name="package_created_at_id"),
+    IndexModel([("package_name", ASCENDING), ("name", ASCENDING)], name="package_name_unique", unique=True),
+]
+if EXPIRATION_TTL_OPTIONS:
+    # A TTL index must be on a single field
+    SHARED_INDEXES.append(IndexModel([("expiration_date", ASCENDING)], name="expiration_date", **EXPIRATION_TTL_OPTIONS))
+
+
+class IndexManager:
+    """
+    Provisions the indexes of the package collections.
+
+    Indexes are ensured when a package collection is first created and
+    backfilled across all existing packages (or on the shared layout's
+    collection) at startup. The last error per
+    package and index is kept for the admin status endpoint.
+    """
+    __errors = {}
+    __lock = threading.Lock()
+
+    @staticmethod
+    def ensure_indexes(collection, indexes=PACKAGE_INDEXES):
+        """
+        Create the missing indexes of a package collection
+
+        Each index is created on its own, so an index that cannot be built
+        (e.g. the unique name index over duplicate names) does not prevent
+        the others.
+
+        :param collection: The package collection
+        :param indexes: The indexes to create, SHARED_INDEXES for the shared layout's collection
+        :return: True if every index exists
+        :rtype: bool
+        """
+        errors = {}
+        for index in indexes:
+            try:
+                try:
+                    collection.create_indexes([index])
+                except OperationFailure as e:
+                    if e.code not in INDEX_CONFLICT_CODES or 'expireAfterSeconds' not in index.document:
+                        raise
+                    # The expiration index predates ttl mode or another retention: convert it in place
+                    collection.database.command(
+                        "collMod", collection.name,
+                        index={"name": index.document['name'], "expireAfterSeconds": index.document['expireAfterSeconds']})
+            except Exception as e:
+                errors[index.document['name']] = str(e)
+                print(f"Error creating index '{index.document['name']}' on package '{collection.name}': {e}")
+
+        with IndexManager.__lock:
+            if errors:
+                IndexManager.__errors[collection.name] = errors
+            else:
+                IndexManager.__errors.pop(collection.name, None)
+        return not errors
+
+    @staticmethod
+    def backfill(db, package_names=None):
+        """
+        Ensure the indexes of every existing package
+
+        :param db: MongoDB database
+        :param package_names: The packages to backfill, defaults to all packages
+        :return: Number of packages with every index in place
+        :rtype: int
+        """
+        if package_names is None:
+            package_names = list_package_names(db)
+
+        complete = 0
+        for package_name in package_names:
+            if IndexManager.ensure_indexes(db[package_name]):
+                complete += 1
+        print(f"Index backfill finished: {complete}/{len(package_names)} packages fully indexed")
+        return complete
+
+    @staticmethod
+    def backfill_async(db):
+        """
+        Run the startup backfill in a background thread
+
+        :param db: MongoDB database
+        :return: The backfill thread
+        :rtype: threading.Thread
+        """
+        thread = threading.Thread(target=IndexManager.__safe_backfill, args=(db,), daemon=True)
+        thread.start()
+        return thread
+
+    @staticmethod
+    def status(db, package_names=None, indexes=PACKAGE_INDEXES):
+        """
+        Report the index status of the package collections
+
+        :param db: MongoDB database
+        :param package_names: The packages to report, defaults to all packages
+        :param indexes: The expected indexes
+        :return: Per-package existing, missing and failed indexes
+        :rtype: list
+        """
+        if package_names is None:
+            package_names = list_package_names(db)
+
+        expected = [index.document['name'] for index in indexes]
+        with IndexManager.__lock:
+            errors = dict(IndexManager.__errors)
+
+        report = []
+        for package_name in sorted(package_names):
+            existing = [index['name'] for index in db[package_name].list_indexes()]
+            report.append({
+                "package_name": package_name,
+                "indexes": existing,
+                "missing": [name for name in expected if name not in existing],
+                "errors": errors.get(package_name, {})
+            })
+        return report
+
+    @staticmethod
+    def __safe_backfill(db):
+        try:
+            if STORAGE_LAYOUT == "shared" or STORAGE_DUAL_READ:
+                IndexManager.ensure_indexes(db[FEATURES_COLLECTION], SHARED_INDEXES)
+            if STORAGE_LAYOUT == "collections" or STORAGE_DUAL_READ:
+                IndexManager.backfill(db)
+        except Exception as e:
+            print(f"Error backfilling indexes: {e}")
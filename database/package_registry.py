@@ -0,0 +1,202 @@
+import os
+import threading
+import time
+
+
+# Collections whose name starts with this prefix hold service data, not packages
+SYSTEM_COLLECTION_PREFIX = "__"
+
+# How long the in-process package set is trusted before it is re-synced with the storage
+PACKAGE_REGISTRY_TTL_SECONDS = float(os.getenv("PACKAGE_REGISTRY_TTL_SECONDS", 60))
+
+
+def is_system_collection(name):
+    """
+    Check if a collection holds service data rather than a package
+
+    :param name: The name of the collection
+    :return: True for service collections
+    :rtype: bool
+    """
+    return name.startswith(SYSTEM_COLLECTION_PREFIX)
+
+
+def list_package_names(db):
+    """
+    List the packages stored in the database
+
+    :param db: MongoDB database
+    :return: The package names
+    :rtype: list
+    """
+    return [name for name in db.list_collection_names() if not is_system_collection(name)]
+
+
+class PackageRegistry:
+    """
+    In-process set of known packages (a MongoDB collection or a __packages entry per package with the mongo engine).
+
+    Lookups for known packages are answered from memory. The set is warmed when
+    the database is initialized, updated by the write routes and re-synced with
+    the storage at most once every PACKAGE_REGISTRY_TTL_SECONDS.
+    """
+    __packages = set()
+    __lock = threading.Lock()
+    __refresh_lock = threading.Lock()
+    __last_refresh = None
+    __hits = 0
+    __misses = 0
+
+    @staticmethod
+    def warm(store):
+        """
+        Load the full list of packages from the storage
+
+        :param store: The FeatureStore
+        """
+        PackageRegistry.__load(store.package_names())
+
+    @staticmethod
+    async def warm_async(store):
+        """
+        Load the full list of packages from the storage, for the async routes
+
+        :param store: The FeatureStore
+        """
+        PackageRegistry.__load(await store.package_names_async())
+
+    @staticmethod
+    def exists(store, package_name):
+        """
+        Check if a package exists
+
+        Known packages never touch the storage. Unknown names are confirmed
+        with a single lookup (a filtered listCollections, or a __packages key in
+        the shared layout) so packages created by another worker are picked up
+        without waiting for the next refresh.
+
+        :param store: The FeatureStore
+        :param package_name: The name of the package
+        :return: True if the package exists
+        :rtype: bool
+        """
+        if is_system_collection(package_name):
+            return False
+
+        PackageRegistry.__refresh_if_stale(store)
+        if PackageRegistry.__lookup(package_name):
+            return True
+
+        if store.package_exists(package_name):
+            PackageRegistry.register(package_name)
+            return True
+        return False
+
+    @staticmethod
+    async def exists_async(store, package_name):
+        """
+        Check if a package exists, for the async routes
+
+        Same as exists(); only registry misses and refreshes await the storage.
+
+        :param store: The FeatureStore
+        :param package_name: The name of the package
+        :return: True if the package exists
+        :rtype: bool
+        """
+        if is_system_collection(package_name):
+            return False
+
+        if PackageRegistry.__is_stale() and PackageRegistry.__refresh_lock.acquire(blocking=False):
+            try:
+                await PackageRegistry.warm_async(store)
+            except Exception as e:
+                print(f"Error refreshing package registry: {e}")
+                PackageRegistry.__last_refresh = time.monotonic()
+            finally:
+                PackageRegistry.__refresh_lock.release()
+        if PackageRegistry.__lookup(package_name):
+            return True
+
+        if await store.package_exists_async(package_name):
+            PackageRegistry.register(package_name)
+            return True
+        return False
+
+    @staticmethod
+    def register(package_name):
+        """
+        Record a package as existing
+
+        :param package_name: The name of the package
+        :return: True if the package was not known before
+        :rtype: bool
+        """
+        with PackageRegistry.__lock:
+            if package_name in PackageRegistry.__packages:
+                return False
+            PackageRegistry.__packages.add(package_name)
+            return True
+
+    @staticmethod
+    def unregister(package_name):
+        """
+        Forget a package after it was dropped
+
+        :param package_name: The name of the package
+        """
+        with PackageRegistry.__lock:
+            PackageRegistry.__packages.discard(package_name)
+
+    @staticmethod
+    def get_stats():
+        """
+        Get the registry counters
+
+        :return: Number of known packages and lookup hits/misses
+        :rtype: dict
+        """
+        with PackageRegistry.__lock:
+            return {
+                "packages": len(PackageRegistry.__packages),
+                "hits": PackageRegistry.__hits,
+                "misses": PackageRegistry.__misses
+            }
+
+    @staticmethod
+    def __load(package_names):
+        packages = set(package_names)
+        with PackageRegistry.__lock:
+            PackageRegistry.__packages = packages
+            PackageRegistry.__last_refresh = time.monotonic()
+
+    @staticmethod
+    def __lookup(package_name):
+        with PackageRegistry.__lock:
+            if package_name in PackageRegistry.__packages:
+                PackageRegistry.__hits += 1
+                return True
+            PackageRegistry.__misses += 1
+            return False
+
+    @staticmethod
+    def __is_stale():
+        last_refresh = PackageRegistry.__last_refresh
+        return last_refresh is None or time.monotonic() - last_refresh >= PACKAGE_REGISTRY_TTL_SECONDS
+
+    @staticmethod
+    def __refresh_if_stale(store):
+        if not PackageRegistry.__is_stale():
+            return
+
+        # Only one request pays for the refresh, the others keep using the current set
+        if not PackageRegistry.__refresh_lock.acquire(blocking=False):
+            return
+        try:
+            PackageRegistry.warm(store)
+        except Exception as e:
+            print(f"Error refreshing package registry: {e}")
+            # Back off until the next TTL window instead of retrying on every request
+            PackageRegistry.__last_refresh = time.monotonic()
+        finally:
+            PackageRegistry.__refresh_lock.release()
@@ -0,0 +1,146 @@
+from database.package_registry import SYSTEM_COLLECTION_PREFIX
+from cache.active_cache import ActiveFeaturesCache
+from cache.shared_cache import SharedCache, SHARED_CACHE_ENABLED
+import os
+import threading
+import time
+
+
+# Collection holding one {_id: package_name, version} document per package
+VERSIONS_COLLECTION = f"{SYSTEM_COLLECTION_PREFIX}package_versions"
+
+# How long the local copy of the versions is trusted before it is re-read from the storage
+PACKAGE_VERSION_TTL_SECONDS = float(os.getenv("PACKAGE_VERSION_TTL_SECONDS", 5))
+
+
+class PackageVersions:
+    """
+    Monotonically increasing version per package, bumped by every write.
+
+    Versions live in the storage so every worker sees the same sequence. Reads are
+    served from a local copy that is refreshed at most once every
+    PACKAGE_VERSION_TTL_SECONDS, and immediately after this worker's own writes.
+    With SHARED_CACHE_ENABLED the writes of the other workers of the host are
+    seen immediately too, through the shared cache.
+    """
+    __versions = {}
+    __lock = threading.Lock()
+    __refresh_lock = threading.Lock()
+    __last_refresh = None
+    __loaded = False
+
+    @staticmethod
+    def get(store, package_name):
+        """
+        Get the current version of a package
+
+        :param store: The FeatureStore
+        :param package_name: The name of the package
+        :return: The version (0 if the package was never written), or None until the versions were loaded once
+        :rtype: int
+        """
+        PackageVersions.__refresh_if_stale(store)
+        with PackageVersions.__lock:
+            if not PackageVersions.__loaded:
+                return None
+            version = PackageVersions.__versions.get(package_name, 0)
+        return PackageVersions.__follow_shared(package_name, version)
+
+    @staticmethod
+    async def get_async(store, package_name):
+        """
+        Get the current version of a package, for the async routes
+
+        :param store: The FeatureStore
+        :param package_name: The name of the package
+        :return: The version (0 if the package was never written), or None until the versions were loaded once
+        :rtype: int
+        """
+        if PackageVersions.__is_stale() and PackageVersions.__refresh_lock.acquire(blocking=False):
+            try:
+                PackageVersions.__merge(await store.versions_async())
+            except Exception as e:
+                print(f"Error refreshing package versions: {e}")
+                PackageVersions.__last_refresh = time.monotonic()
+            finally:
+                PackageVersions.__refresh_lock.release()
+
+        with PackageVersions.__lock:
+            if not PackageVersions.__loaded:
+                return None
+            version = PackageVersions.__versions.get(package_name, 0)
+        return PackageVersions.__follow_shared(package_name, version)
+
+    @staticmethod
+    def bump(store, package_name, count=1):
+        """
+        Increment the version of a package after a write
+
+        :param store: The FeatureStore
+        :param package_name: The name of the package
+        :param count: Number of changes written, each gets its own version
+        :return: The new version
+        :rtype: int
+        """
+        version = store.bump_version(package_name, count)
+        with PackageVersions.__lock:
+            PackageVersions.__versions[package_name] = version
+        if SHARED_CACHE_ENABLED:
+            SharedCache.publish_version(package_name, version)
+        return version
+
+    @staticmethod
+    def refresh(store):
+        """
+        Re-read every package version from the storage
+
+        :param store: The FeatureStore
+        """
+        PackageVersions.__merge(store.versions())
+
+    @staticmethod
+    def __merge(versions):
+        with PackageVersions.__lock:
+            # Versions only grow; keep a newer value bumped by a write that raced with this read
+            for package_name, version in PackageVersions.__versions.items():
+                if version > versions.get(package_name, 0):
+                    versions[package_name] = version
+            PackageVersions.__versions = versions
+            PackageVersions.__last_refresh = time.monotonic()
+            PackageVersions.__loaded = True
+
+    @staticmethod
+    def __follow_shared(package_name, version):
+        if not SHARED_CACHE_ENABLED:
+            return version
+        shared_version = SharedCache.version(package_name)
+        if shared_version is None or shared_version <= version:
+            return version
+
+        with PackageVersions.__lock:
+            if shared_version > PackageVersions.__versions.get(package_name, 0):
+                PackageVersions.__versions[package_name] = shared_version
+        # Another worker wrote the package: what this worker cached of it is stale
+        ActiveFeaturesCache.invalidate(package_name)
+        return shared_version
+
+    @staticmethod
+    def __is_stale():
+        last_refresh = PackageVersions.__last_refresh
+        return last_refresh is None or time.monotonic() - last_refresh >= PACKAGE_VERSION_TTL_SECONDS
+
+    @staticmethod
+    def __refresh_if_stale(store):
+        if not PackageVersions.__is_stale():
+            return
+
+        # Only one request pays for the refresh, the others keep using the current versions
+        if not PackageVersions.__refresh_lock.acquire(blocking=False):
+            return
+        try:
+            PackageVersions.refresh(store)
+        except Exception as e:
+            print(f"Error refreshing package versions: {e}")
+            PackageVersions.__last_refresh = time.monotonic()
+        finally:
+            PackageVersions.__refresh_lock.release()
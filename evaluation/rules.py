@@ -0,0 +1,125 @@
+import os
+
+
+# Subjects are hashed into this many rollout buckets, so a rollout percentage has two decimals
+ROLLOUT_BUCKETS = 10000
+
+# Largest number of subject IDs in the allow or deny list of a feature toggle
+MAX_RULE_LIST_SIZE = int(os.getenv("MAX_RULE_LIST_SIZE", 10000))
+
+RULE_FIELDS = ['rollout_percentage', 'allow_list', 'deny_list']
+
+FNV_OFFSET = 0xcbf29ce484222325
+FNV_PRIME = 0x100000001b3
+MIX_MULTIPLIERS = (0xbf58476d1ce4e5b9, 0x94d049bb133111eb)
+
+_MASK = (1 << 64) - 1
+
+
+def fnv1a(data):
+    """
+    64-bit FNV-1a hash
+
+    :param data: The bytes to hash
+    :return: The hash
+    :rtype: int
+    """
+    value = FNV_OFFSET
+    for byte in data:
+        value = ((value ^ byte) * FNV_PRIME) & _MASK
+    return value
+
+
+def mix(value):
+    """
+    splitmix64 finalizer, spreading the bits of a 64-bit hash
+
+    :param value: The hash
+    :return: The mixed hash
+    :rtype: int
+    """
+    value = ((value ^ (value >> 30)) * MIX_MULTIPLIERS[0]) & _MASK
+    value = ((value ^ (value >> 27)) * MIX_MULTIPLIERS[1]) & _MASK
+    return value ^ (value >> 31)
+
+
+def rollout_bucket(feature_id, subject):
+    """
+    Stable rollout bucket of a subject for a feature toggle
+
+    The bucket only depends on the toggle's `_id` and the subject ID, so a
+    subject keeps its bucket across requests, workers and clients, and
+    different toggles spread the same subjects differently.
+
+    :param feature_id: The `_id` of the feature toggle
+    :param subject: The subject ID (a string or an integer)
+    :return: A bucket in [0, ROLLOUT_BUCKETS)
+    :rtype: int
+    """
+    return mix(fnv1a(str(subject).encode('utf-8')) ^ fnv1a(feature_id.encode('utf-8'))) % ROLLOUT_BUCKETS
+
+
+def rollout_threshold(percentage):
+    """
+    Number of rollout buckets enabled by a rollout percentage
+
+    :param percentage: The rollout percentage, or None for every subject
+    :return: The subjects whose bucket is below this threshold are in the rollout
+    :rtype: int
+    """
+    if percentage is None:
+        return ROLLOUT_BUCKETS
+    return int(round(percentage * ROLLOUT_BUCKETS / 100))
+
+
+def applies_to(feature, subject):
+    """
+    Check whether the rules of a feature toggle include a subject
+
+    The deny list wins over the allow list, which wins over the rollout
+    percentage. The dates of the toggle are not checked.
+
+    :param feature: The feature toggle document
+    :param subject: The subject ID (a string or an integer)
+    :return: True if the toggle applies to the subject
+    :rtype: bool
+    """
+    subject = str(subject)
+    if subject in (feature.get('deny_list') or ()):
+        return False
+    if subject in (feature.get('allow_list') or ()):
+        return True
+    return rollout_bucket(feature['_id'], subject) < rollout_threshold(feature.get('rollout_percentage'))
+
+
+def parse_rules(data):
+    """
+    Validate the optional rollout rules of a create or update-info request
+
+    :param data: The request body
+    :return: The rule fields present in the request and None, or None and the error message
+    :rtype: tuple
+    """
+    rules = {}
+    if 'rollout_percentage' in data:
+        percentage = data['rollout_percentage']
+        if percentage is not None and (isinstance(percentage, bool) or not isinstance(percentage, (int, float))
+                                       or not 0 <= percentage <= 100):
+            return None, "'rollout_percentage' must be a number between 0 and 100, or null"
+        rules['rollout_percentage'] = percentage
+
+    for field in ['allow_list', 'deny_list']:
+        if field not in data:
+            continue
+        subjects = data[field]
+        if subjects is None:
+            subjects = []
+        if not isinstance(subjects, list) or not all(
+                isinstance(subject, (str, int)) and not isinstance(subject, bool) for subject in subjects):
+            return None, f"'{field}' must be a list of subject IDs"
+        if len(subjects) > MAX_RULE_LIST_SIZE:
+            return None, f"'{field}' accepts at most {MAX_RULE_LIST_SIZE} subject IDs"
+        # Subject IDs are compared as strings
+        rules[field] = sorted({str(subject) for subject in subjects})
+
+    return rules, None
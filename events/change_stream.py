@@ -0,0 +1,180 @@
+from pymongo.errors import PyMongoError
+from database.package_registry import PackageRegistry, is_system_collection
+from database.package_versions import VERSIONS_COLLECTION
+from cache.active_cache import ActiveFeaturesCache
+from cache.interval_index import IntervalIndex
+from cache.package_statistics import PackageStatistics
+from events.event_bus import EventBus, make_event
+from storage.layout import STORAGE_LAYOUT, FEATURES_COLLECTION, PACKAGES_COLLECTION
+import threading
+import time
+
+
+# Changes whose version bump was not seen within this delay are published without a version
+PENDING_CHANGE_TIMEOUT_SECONDS = 5
+
+# Delay before re-opening the change stream after an error
+RECONNECT_DELAY_SECONDS = 5
+
+
+class ChangeStreamRelay:
+    """
+    Relays a MongoDB change stream into the local EventBus.
+
+    Used when EVENT_SOURCE is "change_stream", so every worker sees the writes
+    made by all workers. Changes of a package collection are held until the
+    matching bump of __package_versions arrives, which assigns their versions.
+    Remote writes also invalidate this worker's in-process caches.
+
+    In the shared layout the package of a change is read from the document;
+    deleted toggles need the pre-images of __feature_toggles (MongoDB 6.0),
+    which the relay enables. A package drop is the delete of its __packages
+    entry. Only the STORAGE_LAYOUT collections are followed, so the writes
+    mirrored by dual reads are not relayed twice.
+
+    Change streams require a replica set (any Atlas cluster).
+    """
+    __thread = None
+    __stop = threading.Event()
+    __pending = {}
+    __known_versions = {}
+
+    @staticmethod
+    def start(db):
+        """
+        Start relaying in a background thread
+
+        :param db: MongoDB database
+        """
+        if ChangeStreamRelay.__thread is not None:
+            return
+        ChangeStreamRelay.__stop.clear()
+        ChangeStreamRelay.__thread = threading.Thread(target=ChangeStreamRelay.__run, args=(db,), daemon=True)
+        ChangeStreamRelay.__thread.start()
+
+    @staticmethod
+    def stop():
+        """
+        Stop relaying
+        """
+        ChangeStreamRelay.__stop.set()
+        ChangeStreamRelay.__thread = None
+
+    @staticmethod
+    def __run(db):
+        options = {}
+        if STORAGE_LAYOUT == "shared":
+            ChangeStreamRelay.__enable_pre_images(db)
+            options['full_document_before_change'] = 'whenAvailable'
+
+        resume_token = None
+        while not ChangeStreamRelay.__stop.is_set():
+            try:
+                with db.watch(full_document='updateLookup', resume_after=resume_token, max_await_time_ms=1000,
+                              **options) as stream:
+                    print("Relaying MongoDB change stream to the event bus")
+                    while stream.alive and not ChangeStreamRelay.__stop.is_set():
+                        change = stream.try_next()
+                        if change is not None:
+                            ChangeStreamRelay.handle(change)
+                        resume_token = stream.resume_token
+                        ChangeStreamRelay.__flush_expired()
+            except PyMongoError as e:
+                print(f"Error reading the change stream: {e}")
+                time.sleep(RECONNECT_DELAY_SECONDS)
+
+    @staticmethod
+    def __enable_pre_images(db):
+        # A delete of the shared collection only names its package in the pre-image
+        try:
+            if db.list_collection_names(filter={"name": FEATURES_COLLECTION}):
+                db.command("collMod", FEATURES_COLLECTION, changeStreamPreAndPostImages={"enabled": True})
+            else:
+                db.create_collection(FEATURES_COLLECTION, changeStreamPreAndPostImages={"enabled": True})
+        except PyMongoError as e:
+            print(f"Error enabling the change stream pre-images of {FEATURES_COLLECTION}: {e}")
+
+    @staticmethod
+    def handle(change):
+        """
+        Process one change stream document
+
+        :param change: The change document
+        """
+        collection = change.get('ns', {}).get('coll')
+        if collection is None:
+            return
+
+        if collection == VERSIONS_COLLECTION:
+            document = change.get('fullDocument')
+            if document is not None:
+                ChangeStreamRelay.__assign_versions(document['_id'], document['version'])
+            return
+
+        operation = change['operationType']
+        if STORAGE_LAYOUT == "shared":
+            if collection == PACKAGES_COLLECTION:
+                if operation != 'delete':
+                    return
+                # drop_package deletes the toggles, then the package: one delete-all stands for all of them
+                collection, operation = change['documentKey']['_id'], 'drop'
+                ChangeStreamRelay.__pending[collection] = [
+                    pending for pending in ChangeStreamRelay.__pending.get(collection, []) if pending[1] != 'delete']
+            elif collection == FEATURES_COLLECTION:
+                document = change.get('fullDocument') or change.get('fullDocumentBeforeChange') or {}
+                collection = document.get('package_name')
+                if collection is None:
+                    return
+                if change.get('fullDocument') is not None:
+                    change = {**change, 'fullDocument': {key: value for key, value in change['fullDocument'].items()
+                                                         if key != 'package_name'}}
+            else:
+                return
+        elif is_system_collection(collection):
+            return
+
+        feature_id = change.get('documentKey', {}).get('_id')
+        if operation == 'insert':
+            kind, payload = 'create', change['fullDocument']
+            PackageRegistry.register(collection)
+            IntervalIndex.on_insert(collection, payload)
+            PackageStatistics.on_insert(collection, payload)
+        elif operation in ('update', 'replace'):
+            fields = change.get('updateDescription', {}).get('updatedFields') or change.get('fullDocument') or {}
+            kind, payload = 'update', (feature_id, fields)
+            IntervalIndex.on_update(collection, feature_id, fields)
+            PackageStatistics.on_update(collection, feature_id, fields)
+        elif operation == 'delete':
+            kind, payload = 'delete', feature_id
+            IntervalIndex.on_delete(collection, feature_id)
+            PackageStatistics.on_delete(collection, feature_id)
+        elif operation == 'drop':
+            kind, payload = 'delete-all', None
+            PackageRegistry.unregister(collection)
+            IntervalIndex.drop(collection)
+            PackageStatistics.drop(collection)
+        else:
+            return
+        ActiveFeaturesCache.invalidate(collection)
+        ChangeStreamRelay.__pending.setdefault(collection, []).append((time.monotonic(), kind, payload))
+
+    @staticmethod
+    def __assign_versions(package_name, version):
+        pending = ChangeStreamRelay.__pending.get(package_name, [])
+        previous = ChangeStreamRelay.__known_versions.get(package_name)
+        ChangeStreamRelay.__known_versions[package_name] = version
+
+        # A bump of n covers the n oldest pending changes of the package
+        count = len(pending) if previous is None else max(0, min(version - previous, len(pending)))
+        covered, ChangeStreamRelay.__pending[package_name] = pending[:count], pending[count:]
+        first_version = version - count + 1
+        for offset, (_, kind, payload) in enumerate(covered):
+            EventBus.publish(package_name, make_event(package_name, first_version + offset, kind, payload))
+
+    @staticmethod
+    def __flush_expired():
+        deadline = time.monotonic() - PENDING_CHANGE_TIMEOUT_SECONDS
+        for package_name, pending in list(ChangeStreamRelay.__pending.items()):
+            while pending and pending[0][0] < deadline:
+                _, kind, payload = pending.pop(0)
+                EventBus.publish(package_name, make_event(package_name, None, kind, payload))
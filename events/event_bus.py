@@ -0,0 +1,209 @@
+from collections import deque
+import asyncio
+import os
+import queue
+import threading
+
+
+# Where toggle change events come from: "local" (published by this worker's write routes)
+# or "change_stream" (relayed from a MongoDB change stream, for multi-worker deployments)
+EVENT_SOURCE = os.getenv("EVENT_SOURCE", "local")
+
+# Recent events kept per package to replay a `since` version
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", 1000))
+
+# Events queued per subscriber before it is considered too slow and asked to resync
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", 1000))
+
+
+def make_event(package_name, version, kind, payload):
+    """
+    Build a change event from a (kind, payload) change of the write routes
+
+    :param package_name: The name of the package
+    :param version: The package version the change produced, or None if unknown
+    :param kind: 'create', 'update', 'delete' or 'delete-all'
+    :param payload: The feature document, (feature_id, fields), the feature_id or None
+    :return: The event
+    :rtype: dict
+    """
+    event = {"version": version, "type": kind, "package_name": package_name}
+    if kind == 'create':
+        event['feature'] = payload
+    elif kind == 'update':
+        event['feature_id'], event['fields'] = payload
+    elif kind == 'delete':
+        event['feature_id'] = payload
+    return event
+
+
+class Subscription:
+    """
+    A subscriber's queue of events for one package.
+
+    `overflowed` is set when the subscriber fell more than EVENT_QUEUE_SIZE
+    events behind; it must then resync from a full read. A subscription bound
+    to an event loop can also be awaited with next_async().
+    """
+
+    def __init__(self, package_name, loop=None):
+        self.package_name = package_name
+        self.overflowed = False
+        self.__queue = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self.__loop = loop
+        self.__ready = asyncio.Event() if loop is not None else None
+
+    def push(self, event):
+        try:
+            self.__queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+        if self.__loop is not None:
+            try:
+                self.__loop.call_soon_threadsafe(self.__ready.set)
+            except RuntimeError:
+                # The loop is closed, the subscriber is gone
+                pass
+
+    def next(self, timeout):
+        """
+        Wait for the next event
+
+        :param timeout: Seconds to wait
+        :return: The event, or None on timeout
+        :rtype: dict
+        """
+        try:
+            return self.__queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    async def next_async(self, timeout):
+        """
+        Wait for the next event without blocking the event loop
+
+        :param timeout: Seconds to wait
+        :return: The event, or None on timeout
+        :rtype: dict
+        """
+        deadline = self.__loop.time() + timeout
+        while True:
+            self.__ready.clear()
+            # Checked after clear(), so a push racing with this call still wakes the wait below
+            try:
+                return self.__queue.get_nowait()
+            except queue.Empty:
+                pass
+            remaining = deadline - self.__loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(self.__ready.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+
+    def drain(self):
+        """
+        Take every queued event without waiting
+
+        :return: The queued events
+        :rtype: list
+        """
+        events = []
+        while True:
+            try:
+                events.append(self.__queue.get_nowait())
+            except queue.Empty:
+                return events
+
+
+class EventBus:
+    """
+    In-process publish/subscribe of toggle change events, per package.
+
+    The write routes (or the change stream relay) publish; the streaming
+    endpoints subscribe. The last EVENT_BUFFER_SIZE events of each package are
+    kept so a reconnecting client can replay from a version. No MongoDB is
+    involved, so tests can drive the bus with publish() directly.
+    """
+    __subscriptions = {}
+    __history = {}
+    __lock = threading.Lock()
+
+    @staticmethod
+    def publish(package_name, event):
+        """
+        Deliver an event to the subscribers of its package
+
+        :param package_name: The name of the package
+        :param event: The event
+        """
+        with EventBus.__lock:
+            history = EventBus.__history.get(package_name)
+            if history is None:
+                history = EventBus.__history[package_name] = deque(maxlen=EVENT_BUFFER_SIZE)
+            history.append(event)
+            subscriptions = list(EventBus.__subscriptions.get(package_name, ()))
+
+        for subscription in subscriptions:
+            subscription.push(event)
+
+    @staticmethod
+    def subscribe(package_name, loop=None):
+        """
+        Start receiving the events of a package
+
+        :param package_name: The name of the package
+        :param loop: The event loop of an async subscriber, to wait with next_async()
+        :return: The subscription
+        :rtype: Subscription
+        """
+        subscription = Subscription(package_name, loop)
+        with EventBus.__lock:
+            EventBus.__subscriptions.setdefault(package_name, set()).add(subscription)
+        return subscription
+
+    @staticmethod
+    def unsubscribe(subscription):
+        """
+        Stop receiving events
+
+        :param subscription: The subscription returned by subscribe()
+        """
+        with EventBus.__lock:
+            subscriptions = EventBus.__subscriptions.get(subscription.package_name)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del EventBus.__subscriptions[subscription.package_name]
+
+    @staticmethod
+    def events_since(package_name, version, current_version=None):
+        """
+        Replay the buffered events newer than a version
+
+        :param package_name: The name of the package
+        :param version: The last version the client has seen
+        :param current_version: The current package version, if known, to detect events that were never buffered
+        :return: The newer events, and False if the buffer no longer reaches back to that version
+        :rtype: tuple
+        """
+        with EventBus.__lock:
+            history = list(EventBus.__history.get(package_name, ()))
+
+        events = [event for event in history if event['version'] is not None and event['version'] > version]
+        if events:
+            # Without a gap the oldest replayed event directly follows the client's version
+            return events, events[0]['version'] == version + 1
+        return events, current_version is None or current_version <= version
+
+    @staticmethod
+    def subscriber_count():
+        """
+        Count the open subscriptions
+
+        :return: Number of subscriptions across all packages
+        :rtype: int
+        """
+        with EventBus.__lock:
+            return sum(len(subscriptions) for subscriptions in EventBus.__subscriptions.values())
@@ -0,0 +1,176 @@
+from contextvars import ContextVar
+from flask import g, request
+from pymongo import monitoring
+from metrics.registry import MetricsRegistry, Counter, Histogram, SIZE_BUCKETS
+import os
+import time
+
+
+# Record request, MongoDB and cache metrics and serve them at /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Add a Server-Timing header splitting each response time into MongoDB commands, JSON serialization and the rest
+METRICS_TIMING_HEADER = os.getenv("METRICS_TIMING_HEADER", "false").lower() in ("1", "true", "yes")
+
+REQUEST_DURATION = MetricsRegistry.register(Histogram(
+    "feature_toggles_http_request_duration_seconds",
+    "Time to build the response of a request, by route, method and status",
+    ["endpoint", "method", "status"]))
+
+RESPONSE_ITEMS = MetricsRegistry.register(Histogram(
+    "feature_toggles_http_response_items",
+    "Number of feature toggles returned by a list response, by route",
+    ["endpoint"], buckets=SIZE_BUCKETS))
+
+MONGO_COMMAND_DURATION = MetricsRegistry.register(Histogram(
+    "feature_toggles_mongo_command_duration_seconds",
+    "Duration of the MongoDB commands as reported by the driver, by command",
+    ["command"]))
+
+MONGO_COMMAND_FAILURES = MetricsRegistry.register(Counter(
+    "feature_toggles_mongo_command_failures_total",
+    "MongoDB commands that failed, by command",
+    ["command"]))
+
+JSON_SERIALIZATION_DURATION = MetricsRegistry.register(Histogram(
+    "feature_toggles_json_serialization_duration_seconds",
+    "Time spent serializing JSON responses"))
+
+# Timing of the request being served; a context variable, so async views on one event loop stay apart
+_request_timing = ContextVar("request_timing", default=None)
+
+
+class RequestTiming:
+    """
+    Time spent by one request in MongoDB commands and in JSON serialization.
+    """
+    __slots__ = ("started", "commands", "serialization")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        # command name -> [count, seconds]
+        self.commands = {}
+        self.serialization = 0.0
+
+    def add_command(self, command_name, seconds):
+        entry = self.commands.get(command_name)
+        if entry is None:
+            entry = self.commands[command_name] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += seconds
+
+    def server_timing(self, total):
+        """
+        Format the breakdown as a Server-Timing header value
+
+        :param total: The request duration in seconds
+        :return: The header value
+        :rtype: str
+        """
+        database = sum(seconds for _, seconds in self.commands.values())
+        entries = [f'db;dur={database * 1000:.3f};desc="{sum(count for count, _ in self.commands.values())} commands"']
+        entries.extend(f'db-{name};dur={seconds * 1000:.3f};desc="{count}x"'
+                       for name, (count, seconds) in sorted(self.commands.items()))
+        entries.append(f"serialize;dur={self.serialization * 1000:.3f}")
+        entries.append(f"app;dur={max(total - database - self.serialization, 0) * 1000:.3f}")
+        entries.append(f"total;dur={total * 1000:.3f}")
+        return ", ".join(entries)
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """
+    pymongo command listener recording every command's duration.
+
+    The driver calls it in the thread (or task) running the command, so the
+    duration is also added to the breakdown of the current request.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.__record(event)
+
+    def failed(self, event):
+        MONGO_COMMAND_FAILURES.inc(command=event.command_name)
+        self.__record(event)
+
+    @staticmethod
+    def __record(event):
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMAND_DURATION.observe(seconds, command=event.command_name)
+        timing = _request_timing.get()
+        if timing is not None:
+            timing.add_command(event.command_name, seconds)
+
+
+class TimedJSONProvider:
+    """
+    Mixin timing each serialization of the Flask JSON provider it is combined with.
+    """
+
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            seconds = time.perf_counter() - started
+            JSON_SERIALIZATION_DURATION.observe(seconds)
+            timing = _request_timing.get()
+            if timing is not None:
+                timing.serialization += seconds
+
+
+def observe_result_size(count):
+    """
+    Record the number of feature toggles returned by the current request
+
+    :param count: The number of returned toggles
+    """
+    if METRICS_ENABLED:
+        g.result_size = count
+
+
+def init_app(app):
+    """
+    Instrument every route of a Flask app
+
+    Call it after the app's JSON provider is set, so its serializations are timed.
+
+    :param app: The Flask app
+    """
+    if not METRICS_ENABLED:
+        return
+    provider_class = type(app.json)
+    app.json = type(f"Timed{provider_class.__name__}", (TimedJSONProvider, provider_class), {})(app)
+
+    @app.before_request
+    def start_timing():
+        _request_timing.set(RequestTiming())
+
+    @app.after_request
+    def record_timing(response):
+        timing = _request_timing.get()
+        if timing is None:
+            return response
+        _request_timing.set(None)
+
+        total = time.perf_counter() - timing.started
+        endpoint = request.endpoint or "unmatched"
+        REQUEST_DURATION.observe(total, endpoint=endpoint, method=request.method, status=str(response.status_code))
+        result_size = g.get('result_size')
+        if result_size is not None:
+            RESPONSE_ITEMS.observe(result_size, endpoint=endpoint)
+        if METRICS_TIMING_HEADER:
+            response.headers['Server-Timing'] = timing.server_timing(total)
+        return response
+
+
+def command_listeners():
+    """
+    Get the pymongo event listeners recording the MongoDB commands
+
+    :return: The listeners to pass to MongoClient, empty when metrics are disabled
+    :rtype: list
+    """
+    return [CommandMetrics()] if METRICS_ENABLED else []
@@ -0,0 +1,182 @@
+from bisect import bisect_left
+import threading
+
+
+# Latency buckets in seconds, from half a millisecond to ten seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Result-set size buckets, in documents
+SIZE_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonically increasing value per label set.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.__values = {}
+        self.__lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """
+        Add to the counter of a label set
+
+        :param amount: The increment
+        :param labels: One value per label name
+        """
+        key = tuple(labels[name] for name in self.labelnames)
+        with self.__lock:
+            self.__values[key] = self.__values.get(key, 0) + amount
+
+    def collect(self):
+        """
+        Get the exposition lines of the counter
+
+        :return: The lines
+        :rtype: list
+        """
+        with self.__lock:
+            values = sorted(self.__values.items())
+        return [f"{self.name}{_format_labels(zip(self.labelnames, key))} {_format_value(value)}"
+                for key, value in values]
+
+
+class Histogram:
+    """
+    Distribution of observed values per label set, with cumulative buckets.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last one is +Inf), sum, count]
+        self.__series = {}
+        self.__lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """
+        Record a value
+
+        :param value: The observed value
+        :param labels: One value per label name
+        """
+        key = tuple(labels[name] for name in self.labelnames)
+        position = bisect_left(self.buckets, value)
+        with self.__lock:
+            series = self.__series.get(key)
+            if series is None:
+                series = self.__series[key] = [[0] * (len(self.buckets) + 1), 0, 0]
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        """
+        Get the exposition lines of the histogram
+
+        :return: The lines
+        :rtype: list
+        """
+        with self.__lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self.__series.items())
+        lines = []
+        for key, (counts, total, count) in series:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    The metrics of the process and the collectors reading other components' counters.
+
+    A collector is a callable returning (name, type, documentation, samples)
+    tuples, where samples are (labels dict, value) pairs. Collectors run when
+    the metrics are rendered, so counters that already exist elsewhere (cache
+    hits, connection pool) cost nothing on the request path.
+    """
+    __metrics = []
+    __collectors = []
+    __lock = threading.Lock()
+
+    @staticmethod
+    def register(metric):
+        """
+        Add a Counter or Histogram to the exposition
+
+        :param metric: The metric
+        :return: The metric
+        :rtype: Counter
+        """
+        with MetricsRegistry.__lock:
+            MetricsRegistry.__metrics.append(metric)
+        return metric
+
+    @staticmethod
+    def add_collector(collector):
+        """
+        Add a callable producing metrics when they are rendered
+
+        :param collector: Callable returning (name, type, documentation, samples) tuples
+        """
+        with MetricsRegistry.__lock:
+            MetricsRegistry.__collectors.append(collector)
+
+    @staticmethod
+    def render():
+        """
+        Render every metric in the Prometheus text exposition format
+
+        :return: The exposition
+        :rtype: str
+        """
+        with MetricsRegistry.__lock:
+            metrics = list(MetricsRegistry.__metrics)
+            collectors = list(MetricsRegistry.__collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {'counter' if isinstance(metric, Counter) else 'histogram'}")
+            lines.extend(metric.collect())
+        for collector in collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+                continue
+            for name, metric_type, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                lines.extend(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}"
+                             for labels, value in samples)
+        return "\n".join(lines) + "\n"
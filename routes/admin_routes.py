@@ -0,0 +1,190 @@
+from flask import jsonify, Blueprint, send_file
+from database.connection import MongoConnectionHolder
+from storage.storage_holder import StorageHolder, STORAGE_ENGINE
+from storage.layout import STORAGE_LAYOUT, STORAGE_DUAL_READ, STORAGE_DUAL_READ_SAMPLE_RATE
+from storage.dual_store import DualLayoutStore
+from storage.expiry_sweeper import ExpirySweeper, EXPIRY_MODE
+from snapshot.snapshot_file import export_snapshot
+from routes.feature_routes import _publish_changes
+import io
+
+admin_blueprint = Blueprint('admin', __name__)
+
+
+@admin_blueprint.route('/admin/indexes', methods=['GET'])
+def get_index_status():
+    """
+    Report the index status of every package collection
+    ---
+    responses:
+        200:
+            description: Per-package existing, missing and failed indexes
+            schema:
+              type: array
+              items:
+                type: object
+                properties:
+                  package_name:
+                    type: string
+                    description: The name of the package
+                  indexes:
+                    type: array
+                    items:
+                      type: string
+                    description: The indexes that exist on the package collection
+                  missing:
+                    type: array
+                    items:
+                      type: string
+                    description: The expected indexes that do not exist
+                  errors:
+                    type: object
+                    description: The last error per index that could not be created
+        500:
+            description: An error occurred while reading the indexes
+    """
+    store = StorageHolder.get_store()
+    if store is None:
+        return jsonify({"error": "Could not connect to the database"}), 500
+
+    try:
+        return jsonify(store.index_status()), 200
+    except Exception as e:
+        print(f"Error reading index status: {e}")
+        return jsonify({"error": "An error occurred while reading the indexes"}), 500
+
+
+@admin_blueprint.route('/admin/indexes', methods=['POST'])
+def backfill_indexes():
+    """
+    Create the missing indexes of every package collection
+    ---
+    responses:
+        200:
+            description: The backfill finished, with the resulting index status
+        500:
+            description: An error occurred while creating the indexes
+    """
+    store = StorageHolder.get_store()
+    if store is None:
+        return jsonify({"error": "Could not connect to the database"}), 500
+
+    try:
+        store.provision_all()
+        return jsonify(store.index_status()), 200
+    except Exception as e:
+        print(f"Error backfilling indexes: {e}")
+        return jsonify({"error": "An error occurred while creating the indexes"}), 500
+
+
+@admin_blueprint.route('/admin/connection', methods=['GET'])
+def get_connection_status():
+    """
+    Report the MongoDB connection pool and circuit breaker state
+    ---
+    responses:
+        200:
+            description: Pool counters, circuit breaker state and client options
+            schema:
+              type: object
+              properties:
+                connected:
+                  type: boolean
+                  description: Whether the client was created
+                pool:
+                  type: object
+                  description: Open and in-use connections, checkouts, checkout failures, pool clears, heartbeat failures and network errors
+                circuit_breaker:
+                  type: object
+                  description: The breaker state (closed, open or half-open), consecutive failures and seconds until the next trial
+                options:
+                  type: object
+                  description: The client options read from the environment
+    """
+    return jsonify(MongoConnectionHolder.get_stats()), 200
+
+
+@admin_blueprint.route('/admin/storage', methods=['GET'])
+def get_storage_status():
+    """
+    Report the storage engine, the MongoDB layout and the dual-read counters
+    ---
+    responses:
+        200:
+            description: >
+              engine, layout and dual_read. While dual reads are on, also the
+              sample rate, the reads served, the compared reads that matched or
+              differed, the failed secondary reads and the failed mirrored writes
+    """
+    status = {"engine": STORAGE_ENGINE, "layout": STORAGE_LAYOUT, "dual_read": STORAGE_DUAL_READ}
+    if STORAGE_DUAL_READ:
+        status.update(DualLayoutStore.get_stats(), sample_rate=STORAGE_DUAL_READ_SAMPLE_RATE)
+    return jsonify(status), 200
+
+
+@admin_blueprint.route('/admin/snapshot', methods=['GET'])
+def get_snapshot():
+    """
+    Export every package's feature toggles as a binary snapshot file
+    ---
+    produces:
+        - application/octet-stream
+    responses:
+        200:
+            description: The snapshot file, to be read with snapshot.snapshot_file.SnapshotReader
+        500:
+            description: An error occurred while exporting the feature toggles
+    """
+    store = StorageHolder.get_store()
+    if store is None:
+        return jsonify({"error": "Could not connect to the database"}), 500
+
+    output = io.BytesIO()
+    try:
+        export_snapshot(store, output)
+    except Exception as e:
+        print(f"Error exporting snapshot: {e}")
+        return jsonify({"error": "An error occurred while exporting the feature toggles"}), 500
+
+    output.seek(0)
+    return send_file(output, mimetype="application/octet-stream", as_attachment=True,
+                     download_name="feature-toggles.snapshot")
+
+
+@admin_blueprint.route('/admin/expiry', methods=['GET'])
+def get_expiry_status():
+    """
+    Report the expiry mode and the sweeper counters
+    ---
+    responses:
+        200:
+            description: Mode, retention, whether the sweeper runs, sweeps run, toggles archived, errors and the age of the last sweep
+    """
+    return jsonify(ExpirySweeper.get_stats()), 200
+
+
+@admin_blueprint.route('/admin/expiry', methods=['POST'])
+def sweep_expired_features():
+    """
+    Archive the expired feature toggles of every package now
+    ---
+    responses:
+        200:
+            description: The number of archived toggles by package name
+        400:
+            description: EXPIRY_MODE is not archive
+        500:
+            description: An error occurred while archiving the feature toggles
+    """
+    if EXPIRY_MODE != "archive":
+        return jsonify({"error": "Archiving requires EXPIRY_MODE=archive"}), 400
+
+    store = StorageHolder.get_store()
+    if store is None:
+        return jsonify({"error": "Could not connect to the database"}), 500
+
+    try:
+        return jsonify({"archived": ExpirySweeper.sweep(store, _publish_changes)}), 200
+    except Exception as e:
+        print(f"Error sweeping expired feature toggles: {e}")
+        return jsonify({"error": "An error occurred while archiving the feature toggles"}), 500
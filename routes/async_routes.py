@@ -0,0 +1,302 @@
+from flask import request, jsonify, make_response, Response
+from database.package_registry import PackageRegistry
+from database.package_versions import PackageVersions
+from cache.active_cache import ActiveFeaturesCache, next_boundary, utc_now
+from cache.interval_index import IntervalIndex
+from cache.shared_cache import SharedCache, SHARED_CACHE_ENABLED, active_at
+from events.event_bus import EventBus
+from storage.storage_holder import StorageHolder
+from routes import event_routes
+from routes.event_routes import _parse_event_args, _long_poll_pending, _long_poll_result, _format_event, _is_replayed
+from utils.pagination import documents_response
+from metrics.instrumentation import observe_result_size
+from utils.single_flight import SingleFlight, SINGLE_FLIGHT_ENABLED, flight_key, capture_response, replay_response
+from functools import wraps
+import asyncio
+import time
+
+# Query parameters whose handling stays with the WSGI views
+PAGINATION_ARGS = ['limit', 'cursor', 'stream', 'include_archived', 'fields']
+
+
+def _conditional_get_async(time_bucket=None):
+    """
+    Async counterpart of feature_routes._conditional_get
+
+    :param time_bucket: Optional callable returning the time bucket of a package, or None when it is not known yet
+    :return: The decorator
+    :rtype: function
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(package_name, **kwargs):
+            store = StorageHolder.get_async_store()
+            version = None
+            if store is not None and await PackageRegistry.exists_async(store, package_name):
+                version = await PackageVersions.get_async(store, package_name)
+            if version is None:
+                return await view(package_name, **kwargs)
+
+            def current_etag():
+                if time_bucket is None:
+                    return str(version)
+                bucket = time_bucket(package_name)
+                return None if bucket is None else f"{version}-{bucket}"
+
+            def not_modified(etag):
+                response = make_response("", 304)
+                response.set_etag(etag, weak=True)
+                return response
+
+            etag = current_etag()
+            if etag is not None and request.if_none_match.contains_weak(etag):
+                return not_modified(etag)
+
+            result = await view(package_name, **kwargs)
+            if result is None:
+                return None
+            response = make_response(result)
+            if response.status_code != 200:
+                return response
+
+            etag = etag or current_etag()
+            if etag is not None:
+                if request.if_none_match.contains_weak(etag):
+                    return not_modified(etag)
+                response.set_etag(etag, weak=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def _single_flight_async(time_bucket=None):
+    """
+    Async counterpart of feature_routes._single_flight
+
+    :param time_bucket: Optional callable returning the time bucket of a package, for endpoints that depend on the current time
+    :return: The decorator
+    :rtype: function
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(package_name, **kwargs):
+            store = StorageHolder.get_async_store()
+            # Streamed responses are never shared
+            if not SINGLE_FLIGHT_ENABLED or store is None or 'stream' in request.args:
+                return await view(package_name, **kwargs)
+
+            version = None
+            if await PackageRegistry.exists_async(store, package_name):
+                version = await PackageVersions.get_async(store, package_name)
+            bucket = time_bucket(package_name) if time_bucket is not None else None
+
+            async def run():
+                result = await view(package_name, **kwargs)
+                # None hands the request back to the WSGI views, for every request of the flight
+                return None if result is None else capture_response(make_response(result))
+
+            captured = await SingleFlight.do_async(flight_key(package_name, (version, bucket)), run)
+            return None if captured is None else replay_response(captured)
+        return wrapper
+    return decorator
+
+
+async def _load_shared_active_features_async(store, package_name, current_time):
+    """
+    Async counterpart of feature_routes._load_shared_active_features
+
+    :param store: The async FeatureStore
+    :param package_name: The name of the package
+    :param current_time: Evaluation time (naive UTC)
+    :return: The active feature toggles and the next beginning date, or None when the package is not shared
+    :rtype: tuple
+    """
+    if not SHARED_CACHE_ENABLED or store.indexes_dates:
+        return None
+    version = await PackageVersions.get_async(store, package_name)
+    if version is None or SharedCache.is_oversized(package_name):
+        return None
+
+    shared = SharedCache.active_features(package_name, version, current_time)
+    if shared is not None:
+        return shared
+    features = await store.find_async(package_name)
+    SharedCache.publish(package_name, version, features)
+    return active_at(features, current_time)
+
+
+def _stab_interval_index(package_name, version, current_time):
+    """
+    Evaluate a package from its interval index, which uses the synchronous store
+
+    Blocking: run it in a worker thread, not on the event loop.
+
+    :param package_name: The name of the package
+    :param version: The current version of the package, or None if unknown
+    :param current_time: Evaluation time (naive UTC)
+    :return: The active feature toggles and the next beginning date, or None while the index is cold
+    :rtype: tuple
+    """
+    sync_store = StorageHolder.get_store()
+    index = IntervalIndex.get(sync_store, package_name, version) if sync_store is not None else None
+    if index is None:
+        return None
+    return index.stab(current_time), index.next_beginning_after(current_time)
+
+
+async def _load_active_features_async(store, package_name, current_time):
+    """
+    Async counterpart of feature_routes._load_active_features
+
+    The interval index is still built in the background with the synchronous store;
+    it is looked up from a worker thread so the event loop never waits on it.
+
+    :param store: The async FeatureStore
+    :param package_name: The name of the package
+    :param current_time: Evaluation time (naive UTC)
+    :return: The active feature toggles
+    :rtype: list
+    """
+    active_features = ActiveFeaturesCache.get(package_name, current_time)
+    if active_features is not None:
+        return active_features
+
+    generation = ActiveFeaturesCache.generation(package_name)
+
+    shared = await _load_shared_active_features_async(store, package_name, current_time)
+    if shared is not None:
+        active_features, next_beginning_date = shared
+    else:
+        indexed = await asyncio.to_thread(
+            _stab_interval_index, package_name, await PackageVersions.get_async(store, package_name), current_time)
+        if indexed is not None:
+            active_features, next_beginning_date = indexed
+        else:
+            active_features = await store.find_async(package_name, active_at=current_time)
+            next_beginning_date = await store.next_beginning_after_async(package_name, current_time)
+
+    ActiveFeaturesCache.put(
+        package_name, active_features,
+        next_boundary(active_features, next_beginning_date),
+        generation, current_time)
+    return active_features
+
+
+@_conditional_get_async()
+@_single_flight_async()
+async def get_all_features_for_package(package_name):
+    if any(name in request.args for name in PAGINATION_ARGS):
+        return None
+
+    store = StorageHolder.get_async_store()
+    if store is None:
+        return jsonify({"error": "Could not connect to the database"}), 500
+
+    if not await PackageRegistry.exists_async(store, package_name):
+        return jsonify({"error": f"Package '{package_name}' does not exist"}), 404
+
+    try:
+        features = await store.find_async(package_name)
+        observe_result_size(len(features))
+        return jsonify(features), 200
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"error": "An error occurred"}), 500
+
+
+@_conditional_get_async(ActiveFeaturesCache.window)
+@_single_flight_async(ActiveFeaturesCache.window)
+async def get_active_features(package_name):
+    store = StorageHolder.get_async_store()
+    if store is None:
+        return jsonify({"error": "Could not connect to the database"}), 500
+
+    if not await PackageRegistry.exists_async(store, package_name):
+        return jsonify({"error": f"Package '{package_name}' does not exist"}), 404
+
+    try:
+        return documents_response(await _load_active_features_async(store, package_name, utc_now()))
+    except Exception as e:
+        return jsonify({"error": "An error occurred while retrieving active feature toggles"}), 500
+
+
+def _sse_response_async(subscription, replay, complete, since, current_version):
+    async def generate():
+        try:
+            if not complete:
+                yield _format_event({"version": current_version, "type": "resync"})
+                return
+
+            last_version = since
+            for event in replay:
+                yield _format_event(event)
+                last_version = event['version']
+
+            deadline = time.monotonic() + event_routes.SSE_MAX_STREAM_SECONDS
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                event = await subscription.next_async(min(event_routes.SSE_HEARTBEAT_SECONDS, remaining))
+                if subscription.overflowed:
+                    yield _format_event({"version": None, "type": "resync"})
+                    return
+                if event is None:
+                    yield ": keep-alive\n\n"
+                elif not _is_replayed(event, last_version):
+                    yield _format_event(event)
+        finally:
+            EventBus.unsubscribe(subscription)
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers['Cache-Control'] = "no-cache"
+    response.headers['X-Accel-Buffering'] = "no"
+    return response, 200
+
+
+async def get_feature_events(package_name):
+    mode, since, timeout, error = _parse_event_args()
+    if error is not None:
+        return jsonify({"error": error}), 400
+
+    store = StorageHolder.get_async_store()
+    if store is None:
+        return jsonify({"error": "Could not connect to the database"}), 500
+
+    if not await PackageRegistry.exists_async(store, package_name):
+        return jsonify({"error": f"Package '{package_name}' does not exist"}), 404
+
+    subscription = EventBus.subscribe(package_name, asyncio.get_running_loop())
+    try:
+        current_version = await PackageVersions.get_async(store, package_name)
+    except Exception as e:
+        EventBus.unsubscribe(subscription)
+        print(f"Error reading the version of package '{package_name}': {e}")
+        return jsonify({"error": "An error occurred"}), 500
+
+    replay, complete = [], True
+    if since is not None:
+        replay, complete = EventBus.events_since(package_name, since, current_version)
+
+    if mode == 'sse':
+        return _sse_response_async(subscription, replay, complete, since, current_version)
+
+    # Waiting here only holds a coroutine, not a worker thread
+    try:
+        result = _long_poll_pending(replay, complete, current_version)
+        if result is None:
+            event = await subscription.next_async(timeout)
+            events = [] if event is None else [event] + subscription.drain()
+            result = _long_poll_result(subscription, events, since, current_version)
+        return jsonify(result), 200
+    finally:
+        EventBus.unsubscribe(subscription)
+
+
+# Flask endpoints served natively by the ASGI entry point: the polling routes.
+# A view returning None hands the request back to the WSGI view.
+ASYNC_VIEWS = {
+    'feature_toggle.get_all_features_for_package': get_all_features_for_package,
+    'feature_toggle.get_active_features': get_active_features,
+    'events.get_feature_events': get_feature_events,
+}
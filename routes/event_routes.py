@@ -0,0 +1,276 @@
+from flask import request, jsonify, Blueprint, Response, current_app, stream_with_context
+from storage.storage_holder import StorageHolder
+from database.package_registry import PackageRegistry
+from database.package_versions import PackageVersions
+from database.change_log import ChangeLog, CHANGE_LOG_PAGE_SIZE
+from events.event_bus import EventBus
+from metrics.instrumentation import observe_result_size
+import os
+import time
+
+event_blueprint = Blueprint('events', __name__)
+
+# Seconds between keep-alive comments on an idle event stream
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", 15))
+
+# Longest an event stream stays open; clients reconnect with Last-Event-ID
+SSE_MAX_STREAM_SECONDS = float(os.getenv("SSE_MAX_STREAM_SECONDS", 300))
+
+# Longest a long-poll request waits for an event
+LONG_POLL_MAX_TIMEOUT_SECONDS = float(os.getenv("LONG_POLL_MAX_TIMEOUT_SECONDS", 60))
+
+EVENT_MODES = ['sse', 'long-poll']
+
+
+def _format_event(event):
+    lines = []
+    if event['version'] is not None:
+        lines.append(f"id: {event['version']}")
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {current_app.json.dumps(event)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def _is_replayed(event, last_version):
+    return last_version is not None and event['version'] is not None and event['version'] <= last_version
+
+
+def _sse_response(subscription, replay, complete, since, current_version):
+    def generate():
+        try:
+            if not complete:
+                yield _format_event({"version": current_version, "type": "resync"})
+                return
+
+            last_version = since
+            for event in replay:
+                yield _format_event(event)
+                last_version = event['version']
+
+            deadline = time.monotonic() + SSE_MAX_STREAM_SECONDS
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                event = subscription.next(min(SSE_HEARTBEAT_SECONDS, remaining))
+                if subscription.overflowed:
+                    yield _format_event({"version": None, "type": "resync"})
+                    return
+                if event is None:
+                    yield ": keep-alive\n\n"
+                elif not _is_replayed(event, last_version):
+                    yield _format_event(event)
+        finally:
+            EventBus.unsubscribe(subscription)
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers['Cache-Control'] = "no-cache"
+    # Keep reverse proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = "no"
+    return response, 200
+
+
+def _long_poll_pending(replay, complete, current_version):
+    """
+    Answer a long-poll request that does not need to wait
+
+    :return: The response body, or None when the request has to wait for live events
+    :rtype: dict
+    """
+    if not complete:
+        return {"events": [], "resync": True, "version": current_version}
+    if replay:
+        return {"events": replay, "resync": False, "version": replay[-1]['version']}
+    return None
+
+
+def _long_poll_result(subscription, events, since, current_version):
+    """
+    Build the body of a long-poll request from the live events it received
+
+    :return: The response body
+    :rtype: dict
+    """
+    events = [event for event in events if not _is_replayed(event, since)]
+    if subscription.overflowed:
+        return {"events": [], "resync": True, "version": current_version}
+
+    versions = [event['version'] for event in events if event['version'] is not None]
+    if versions:
+        version = versions[-1]
+    else:
+        # The local version may lag behind one the client already saw
+        version = max(since, current_version or 0) if since is not None else current_version
+    return {"events": events, "resync": False, "version": version}
+
+
+def _long_poll_response(subscription, replay, complete, since, current_version, timeout):
+    try:
+        result = _long_poll_pending(replay, complete, current_version)
+        if result is None:
+            event = subscription.next(timeout)
+            events = [] if event is None else [event] + subscription.drain()
+            result = _long_poll_result(subscription, events, since, current_version)
+        return jsonify(result), 200
+    finally:
+        EventBus.unsubscribe(subscription)
+
+
+def _parse_event_args():
+    """
+    Read the mode, since and timeout of an events request
+
+    :return: The mode, since version, timeout and an error message (None when valid)
+    :rtype: tuple
+    """
+    mode = request.args.get('mode', 'sse')
+    if mode not in EVENT_MODES:
+        return None, None, None, f"mode must be one of: {', '.join(EVENT_MODES)}"
+
+    since = request.args.get('since', request.headers.get('Last-Event-ID'))
+    try:
+        since = int(since) if since is not None else None
+        timeout = min(float(request.args.get('timeout', LONG_POLL_MAX_TIMEOUT_SECONDS)), LONG_POLL_MAX_TIMEOUT_SECONDS)
+    except ValueError:
+        return None, None, None, "since must be an integer and timeout a number"
+    if (since is not None and since < 0) or timeout < 0:
+        return None, None, None, "since and timeout must not be negative"
+    return mode, since, timeout, None
+
+
+@event_blueprint.route('/feature-toggles/<package_name>/events', methods=['GET'])
+def get_feature_events(package_name):
+    """
+    Follow the changes of a package as Server-Sent Events or by long polling
+    ---
+    parameters:
+      - name: package_name
+        in: path
+        type: string
+        required: true
+        description: The name of the package
+      - name: since
+        in: query
+        type: integer
+        required: false
+        description: The last package version the client has seen; newer buffered events are replayed first. Defaults to the Last-Event-ID header
+      - name: mode
+        in: query
+        type: string
+        enum: [sse, long-poll]
+        required: false
+        description: sse (default) keeps a text/event-stream open; long-poll answers with the next events as JSON
+      - name: timeout
+        in: query
+        type: number
+        required: false
+        description: Seconds a long-poll request waits for an event
+    responses:
+      200:
+        description: >
+          A text/event-stream of create, update, delete and delete-all events (the
+          id of each event is the package version it produced), or for long-poll
+          {"events", "resync", "version"}. A resync event / flag means the client
+          must re-read the package because events are no longer available.
+      400:
+        description: Invalid since, mode or timeout
+      404:
+        description: The specified package does not exist
+      500:
+        description: An error occurred while reading the package version
+    """
+    mode, since, timeout, error = _parse_event_args()
+    if error is not None:
+        return jsonify({"error": error}), 400
+
+    store = StorageHolder.get_store()
+    if store is None:
+        return jsonify({"error": "Could not connect to the database"}), 500
+
+    if not PackageRegistry.exists(store, package_name):
+        return jsonify({"error": f"Package '{package_name}' does not exist"}), 404
+
+    # Subscribe before replaying, so no event falls between the replay and the live feed
+    subscription = EventBus.subscribe(package_name)
+    try:
+        current_version = PackageVersions.get(store, package_name)
+    except Exception as e:
+        EventBus.unsubscribe(subscription)
+        print(f"Error reading the version of package '{package_name}': {e}")
+        return jsonify({"error": "An error occurred"}), 500
+
+    replay, complete = [], True
+    if since is not None:
+        replay, complete = EventBus.events_since(package_name, since, current_version)
+
+    if mode == 'long-poll':
+        return _long_poll_response(subscription, replay, complete, since, current_version, timeout)
+    return _sse_response(subscription, replay, complete, since, current_version)
+
+
+@event_blueprint.route('/feature-toggles/<package_name>/changes', methods=['GET'])
+def get_feature_changes(package_name):
+    """
+    Get the changes of a package since a version, for delta sync
+    ---
+    parameters:
+      - name: package_name
+        in: path
+        type: string
+        required: true
+        description: The name of the package
+      - name: since
+        in: query
+        type: integer
+        required: false
+        description: The last package version the client has seen (the ETag of a full read). Defaults to 0
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Maximum number of changes to return
+    responses:
+      200:
+        description: >
+          {"changes", "version", "has_more", "resync"}. changes are the create,
+          update, delete and delete-all events after `since` in version order,
+          version is the version of the last one (pass it as the next `since`)
+          and has_more tells that newer changes remain. resync is true when the
+          log no longer reaches back to `since`: the client must re-read the
+          package, then sync from the returned version.
+      400:
+        description: Invalid since or limit
+      404:
+        description: The specified package does not exist
+      500:
+        description: An error occurred while reading the change log
+    """
+    try:
+        since = int(request.args.get('since', 0))
+        limit = int(request.args.get('limit', CHANGE_LOG_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "since and limit must be integers"}), 400
+    if since < 0 or not 1 <= limit <= CHANGE_LOG_PAGE_SIZE:
+        return jsonify({"error": f"since must not be negative and limit must be between 1 and {CHANGE_LOG_PAGE_SIZE}"}), 400
+
+    store = StorageHolder.get_store()
+    if store is None:
+        return jsonify({"error": "Could not connect to the database"}), 500
+
+    try:
+        current_version = PackageVersions.get(store, package_name)
+        # A deleted package keeps its log, so clients still receive the delete-all
+        if not current_version and not PackageRegistry.exists(store, package_name):
+            return jsonify({"error": f"Package '{package_name}' does not exist"}), 404
+        changes, resync = ChangeLog.since(store, package_name, since, current_version, limit)
+    except Exception as e:
+        print(f"Error reading the changes of package '{package_name}': {e}")
+        return jsonify({"error": "An error occurred"}), 500
+
+    if resync:
+        return jsonify({"changes": [], "version": current_version, "has_more": False, "resync": True}), 200
+
+    observe_result_size(len(changes))
+    version = changes[-1]['version'] if changes else since
+    has_more = current_version is not None and version < current_version
+    return jsonify({"changes": changes, "version": version, "has_more": has_more, "resync": False}), 200
@@ -1,10 +1,457 @@
-from flask import request, jsonify, Blueprint
-from database.connection import MongoConnectionHolder
+from flask import request, jsonify, Blueprint, make_response
+from database.package_registry import PackageRegistry, is_system_collection, SYSTEM_COLLECTION_PREFIX
+from database.package_versions import PackageVersions
+from database.change_log import ChangeLog
+from storage.base import DuplicateFeatureError, FeatureConflictError
+from storage.storage_holder import StorageHolder
+from cache.active_cache import ActiveFeaturesCache, next_boundary, utc_now
+from cache.interval_index import IntervalIndex
+from cache.package_statistics import PackageStatistics
+from cache.shared_cache import SharedCache, SHARED_CACHE_ENABLED, active_at
+from events.event_bus import EventBus, EVENT_SOURCE, make_event
+from evaluation.rules import parse_rules
+from evaluation.cohort import evaluate_cohort, format_result, MAX_EVALUATION_SUBJECTS, COHORT_FORMATS
+from utils.pagination import query_response, documents_response
+from utils.single_flight import SingleFlight, SINGLE_FLIGHT_ENABLED, flight_key, capture_response, replay_response
 from datetime import datetime,timezone,timedelta
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+import os
+import time
 import uuid
+import zlib
 
 feature_toggle_blueprint = Blueprint('feature_toggle', __name__)
 
+# Largest number of operations accepted by the bulk endpoint
+MAX_BULK_OPERATIONS = int(os.getenv("MAX_BULK_OPERATIONS", 5000))
+
+# Largest number of packages accepted by the batch evaluation endpoint
+MAX_BATCH_PACKAGES = int(os.getenv("MAX_BATCH_PACKAGES", 100))
+
+# Shared pool fanning the per-package queries of a batch evaluation out concurrently
+_evaluation_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("BATCH_EVALUATION_WORKERS", 16)),
+    thread_name_prefix="batch-evaluation")
+
+BULK_OPERATIONS = ['create', 'update-dates', 'update-info', 'delete']
+
+# Width of the time buckets in the ETag of endpoints whose answer drifts with the clock
+ETAG_TIME_BUCKET_SECONDS = int(os.getenv("ETAG_TIME_BUCKET_SECONDS", 60))
+
+
+def _clock_bucket(package_name):
+    """
+    Evaluation time bucket of a package, for endpoints that depend on the current time
+
+    Each package's buckets are shifted by a stable offset (the same in every
+    worker), so the ETags of all packages do not change in the same second
+    and send every client back to the database at once.
+
+    :param package_name: The name of the package
+    :return: The index of the package's current time bucket
+    :rtype: int
+    """
+    offset = zlib.crc32(package_name.encode()) % (ETAG_TIME_BUCKET_SECONDS * 1000) / 1000
+    return int((time.time() + offset) // ETAG_TIME_BUCKET_SECONDS)
+
+
+def _include_archived():
+    """
+    Read the `include_archived` query parameter of the request
+
+    :return: True if archived feature toggles should be returned too
+    :rtype: bool
+    """
+    return request.args.get('include_archived', '').lower() in ('1', 'true', 'yes')
+
+
+def _conditional_get(time_bucket=None):
+    """
+    Decorate a package read endpoint with ETag / If-None-Match support
+
+    The ETag is derived from the package version, plus the evaluation time
+    bucket for endpoints that depend on the current time. A matching
+    If-None-Match is answered with 304 before the database is queried.
+
+    :param time_bucket: Optional callable returning the time bucket of a package, or None when it is not known yet
+    :return: The decorator
+    :rtype: function
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(package_name, **kwargs):
+            store = StorageHolder.get_store()
+            version = None
+            if store is not None and PackageRegistry.exists(store, package_name):
+                version = PackageVersions.get(store, package_name)
+            if version is None:
+                return view(package_name, **kwargs)
+
+            def current_etag():
+                if time_bucket is None:
+                    return str(version)
+                bucket = time_bucket(package_name)
+                return None if bucket is None else f"{version}-{bucket}"
+
+            def not_modified(etag):
+                response = make_response("", 304)
+                response.set_etag(etag, weak=True)
+                return response
+
+            etag = current_etag()
+            if etag is not None and request.if_none_match.contains_weak(etag):
+                return not_modified(etag)
+
+            response = make_response(view(package_name, **kwargs))
+            if response.status_code != 200:
+                return response
+
+            # The bucket may only be known once the view has evaluated the package
+            etag = etag or current_etag()
+            if etag is not None:
+                if request.if_none_match.contains_weak(etag):
+                    return not_modified(etag)
+                response.set_etag(etag, weak=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def _single_flight(time_bucket=None):
+    """
+    Decorate a package read endpoint so identical concurrent requests share one query
+
+    Requests with the same endpoint, package, package version, time bucket
+    and query parameters that arrive while one of them is being answered get
+    a copy of its response. Streamed responses are never shared.
+
+    :param time_bucket: Optional callable returning the time bucket of a package, for endpoints that depend on the current time
+    :return: The decorator
+    :rtype: function
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(package_name, **kwargs):
+            store = StorageHolder.get_store()
+            if not SINGLE_FLIGHT_ENABLED or store is None or 'stream' in request.args:
+                return view(package_name, **kwargs)
+
+            version = PackageVersions.get(store, package_name) if PackageRegistry.exists(store, package_name) else None
+            bucket = time_bucket(package_name) if time_bucket is not None else None
+            return replay_response(SingleFlight.do(
+                flight_key(package_name, (version, bucket)),
+                lambda: capture_response(make_response(view(package_name, **kwargs)))))
+        return wrapper
+    return decorator
+
+
+def _publish_changes(package_name, changes):
+    """
+    Propagate writes to a package: bump its version, update the in-process caches,
+    append to its change log and publish the change events
+
+    :param package_name: The name of the package
+    :param changes: (kind, payload) pairs in write order, where kind is 'create'
+        (the feature document), 'update' ((feature_id, fields)), 'delete'
+        (feature_id) or 'delete-all' (None)
+    """
+    for kind, payload in changes:
+        if kind == 'create':
+            IntervalIndex.on_insert(package_name, payload)
+            PackageStatistics.on_insert(package_name, payload)
+        elif kind == 'update':
+            IntervalIndex.on_update(package_name, *payload)
+            PackageStatistics.on_update(package_name, *payload)
+        elif kind == 'delete':
+            IntervalIndex.on_delete(package_name, payload)
+            PackageStatistics.on_delete(package_name, payload)
+        else:
+            PackageRegistry.unregister(package_name)
+            IntervalIndex.drop(package_name)
+            PackageStatistics.drop(package_name)
+    ActiveFeaturesCache.invalidate(package_name)
+
+    store = StorageHolder.get_store()
+    try:
+        version = PackageVersions.bump(store, package_name, len(changes))
+        IntervalIndex.advance(package_name, version, len(changes))
+    except Exception as e:
+        version = None
+        print(f"Error bumping the version of package '{package_name}': {e}")
+
+    if version is not None:
+        events = ChangeLog.record(store, package_name, version, changes)
+    else:
+        events = [make_event(package_name, None, kind, payload) for kind, payload in changes]
+
+    # With a change stream source the relay publishes the events of every worker, including this one
+    if EVENT_SOURCE == "local":
+        for event in events:
+            EventBus.publish(package_name, event)
+
+
+def _timestamp():
+    """
+    Current local time, truncated to the millisecond precision MongoDB keeps
+
+    Cached copies of a document then compare equal to the stored one.
+
+    :return: The current time
+    :rtype: datetime
+    """
+    now = datetime.now()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def _validate_new_feature(data):
+    """
+    Validate a create request and build the feature toggle document
+
+    :param data: The request body
+    :return: The feature toggle document and None, or None and the error message
+    :rtype: tuple
+    """
+    # Check if the request is valid
+    if not isinstance(data, dict) or not all(key in data for key in ['package_name', 'name', 'description', 'beginning_date', 'expiration_date']):
+        return None, "Invalid request"
+
+    if not isinstance(data['package_name'], str):
+        return None, "Invalid request"
+    if is_system_collection(data['package_name']):
+        return None, f"Package names starting with '{SYSTEM_COLLECTION_PREFIX}' are reserved"
+
+    # Check data is valid
+    try:
+        # Parse the dates
+        beginning_date = datetime.strptime(
+            data['beginning_date'], '%Y-%m-%d %H:%M:%S')
+        expiration_date = datetime.strptime(
+            data['expiration_date'], '%Y-%m-%d %H:%M:%S')
+    except (ValueError, TypeError):
+        return None, "Invalid date format. Please use YYYY-MM-DD HH:MM:SS"
+
+    if beginning_date > expiration_date:
+        return None, "Beginning date must be before expiration date"
+
+    rules, error = parse_rules(data)
+    if error:
+        return None, error
+
+    now = _timestamp()
+
+    # Create the feature toggle item
+    return {
+        "_id": str(uuid.uuid4()),
+        "name": data['name'],
+        "description": data['description'],
+        "beginning_date": beginning_date,
+        "expiration_date": expiration_date,
+        "created_at": now,
+        "updated_at": now,
+        "version": 1,
+        **rules
+    }, None
+
+
+def _parse_date_updates(data):
+    """
+    Validate an update-dates request on its own
+
+    :param data: The request body
+    :return: The parsed dates to set and None, or None and the error message
+    :rtype: tuple
+    """
+    if not isinstance(data, dict) or ('expiration_date' not in data and 'beginning_date' not in data):
+        return None, "No dates provided"
+
+    fields = {}
+    try:
+        # Parse new dates
+        if data.get('expiration_date'):
+            fields['expiration_date'] = datetime.strptime(
+                data['expiration_date'], '%Y-%m-%d %H:%M:%S')
+        if data.get('beginning_date'):
+            fields['beginning_date'] = datetime.strptime(
+                data['beginning_date'], '%Y-%m-%d %H:%M:%S')
+    except (ValueError, TypeError):
+        return None, "Invalid date format, use YYYY-MM-DD HH:MM:SS"
+
+    if 'beginning_date' in fields and 'expiration_date' in fields and fields['beginning_date'] > fields['expiration_date']:
+        return None, "Beginning date must be before expiration date"
+
+    return fields, None
+
+
+def _check_date_updates(feature, fields):
+    """
+    Validate new dates against the stored feature toggle
+
+    :param feature: The stored feature toggle document
+    :param fields: The parsed dates to set
+    :return: The error message, or None if the dates are valid
+    :rtype: str
+    """
+    if 'expiration_date' in fields and fields['expiration_date'] < feature['beginning_date']:
+        return "Expiration date cannot be before beginning date"
+    expiration_date = fields.get('expiration_date', feature['expiration_date'])
+    if 'beginning_date' in fields and fields['beginning_date'] > expiration_date:
+        return "Beginning date cannot be after expiration date"
+    return None
+
+
+def _parse_expected_version(data):
+    """
+    Read the optional `version` of an update request, for optimistic concurrency
+
+    :param data: The request body
+    :return: The expected version (or None) and None, or None and the error message
+    :rtype: tuple
+    """
+    version = data.get('version') if isinstance(data, dict) else None
+    if version is not None and (not isinstance(version, int) or isinstance(version, bool) or version < 0):
+        return None, "'version' must be a non-negative integer"
+    return version, None
+
+
+def _update_failure(store, package_name, feature_id, fields, version, not_found_error):
+    """
+    Explain why a conditional update matched no feature toggle
+
+    Only runs when the update failed, so a successful update stays a single
+    round-trip.
+
+    :param store: The FeatureStore
+    :param package_name: The name of the package
+    :param feature_id: The `_id` of the feature toggle
+    :param fields: The fields the update would have set
+    :param version: The expected version, or None
+    :param not_found_error: The error message when the toggle does not exist
+    :return: The Flask response and status code
+    :rtype: tuple
+    """
+    feature = store.get(package_name, feature_id)
+    if feature is None:
+        return jsonify({"error": not_found_error}), 404
+    current_version = feature.get('version', 0)
+    if version is None or current_version == version:
+        error = _check_date_updates(feature, fields)
+        if error:
+            return jsonify({"error": error}), 400
+    # Either the expected version is outdated or the toggle changed since the update was tried
+    return jsonify({"error": "The feature toggle was modified by another request", "version": current_version}), 409
+
+
+def _parse_info_updates(data):
+    """
+    Validate an update-info request
+
+    :param data: The request body
+    :return: The fields to set and None, or None and the error message
+    :rtype: tuple
+    """
+    # Update fields
+    updates = {}
+    if isinstance(data, dict):
+        if 'name' in data and data['name']:
+            updates['name'] = data['name']
+        if 'description' in data and data['description']:
+            updates['description'] = data['description']
+        rules, error = parse_rules(data)
+        if error:
+            return None, error
+        updates.update(rules)
+
+    if not updates:
+        return None, "No valid fields provided for update"
+    return updates, None
+
+
+def _load_shared_active_features(store, package_name, current_time):
+    """
+    Evaluate a package from its snapshot in the shared cache, publishing the snapshot on a miss
+
+    :param store: The FeatureStore
+    :param package_name: The name of the package
+    :param current_time: Evaluation time (naive UTC)
+    :return: The active feature toggles and the next beginning date, or None when the package is not shared
+    :rtype: tuple
+    """
+    # The storage answers date queries from its own index, a copy would only double the memory
+    if not SHARED_CACHE_ENABLED or store.indexes_dates:
+        return None
+    version = PackageVersions.get(store, package_name)
+    if version is None or SharedCache.is_oversized(package_name):
+        return None
+
+    shared = SharedCache.active_features(package_name, version, current_time)
+    if shared is not None:
+        return shared
+    # The version is read before the toggles: a write racing with the read makes the snapshot fresher, never staler
+    features = list(store.find(package_name))
+    SharedCache.publish(package_name, version, features)
+    return active_at(features, current_time)
+
+
+def _load_active_features(store, package_name, current_time):
+    """
+    Get the feature toggles of a package active at a point in time
+
+    Reads through ActiveFeaturesCache, then the shared cache, then the interval index, then the storage.
+
+    :param store: The FeatureStore
+    :param package_name: The name of the package
+    :param current_time: Evaluation time (naive UTC)
+    :return: The active feature toggles
+    :rtype: list
+    """
+    # Serve polling traffic from memory until the next boundary date or write
+    active_features = ActiveFeaturesCache.get(package_name, current_time)
+    if active_features is not None:
+        return active_features
+
+    generation = ActiveFeaturesCache.generation(package_name)
+
+    shared = _load_shared_active_features(store, package_name, current_time)
+    if shared is not None:
+        active_features, next_beginning_date = shared
+    else:
+        index = IntervalIndex.get(store, package_name, PackageVersions.get(store, package_name))
+        if index is not None:
+            active_features = index.stab(current_time)
+            next_beginning_date = index.next_beginning_after(current_time)
+        else:
+            # Query the storage for all active features
+            active_features = list(store.find(package_name, active_at=current_time))
+
+            # The nearest scheduled feature decides when the active set grows
+            next_beginning_date = store.next_beginning_after(package_name, current_time)
+
+    ActiveFeaturesCache.put(
+        package_name, active_features,
+        next_boundary(active_features, next_beginning_date),
+        generation, current_time)
+    return active_features
+
+
+def _evaluate_package(store, package_name, current_time):
+    """
+    Evaluate the active feature toggles of one package for the batch endpoint
+
+    :param store: The FeatureStore
+    :param package_name: The name of the package
+    :param current_time: Evaluation time (naive UTC)
+    :return: The per-package result with an HTTP-like status
+    :rtype: dict
+    """
+    try:
+        if not PackageRegistry.exists(store, package_name):
+            return {"status": 404, "error": f"Package '{package_name}' does not exist"}
+        return {"status": 200, "features": _load_active_features(store, package_name, current_time)}
+    except Exception as e:
+        print(f"Error evaluating package '{package_name}': {e}")
+        return {"status": 500, "error": "An error occurred while retrieving active feature toggles"}
+
 
 # 1. Create a new feature toggle
 @feature_toggle_blueprint.route('/feature-toggle', methods=['POST'])
@@ -42,57 +489,58 @@ def create_feature_toggle():
                 expiration_date:
                     type: string
                     description: The end date of the feature toggle
+                rollout_percentage:
+                    type: number
+                    description: Share of the subjects (0-100) the feature toggle applies to, all by default
+                allow_list:
+                    type: array
+                    items:
+                        type: string
+                    description: Subject IDs the feature toggle always applies to
+                deny_list:
+                    type: array
+                    items:
+                        type: string
+                    description: Subject IDs the feature toggle never applies to
     responses:
         201:
             description: The feature toggle was created successfully
         400:
             description: The request was invalid
+        409:
+            description: A feature toggle with the same name already exists in the package
         500:
             description: An error occurred while creating the feature toggle
     """
     data = request.json
-    db = MongoConnectionHolder.get_db()
+    store = StorageHolder.get_store()
 
     # Check if the database connection was successful
-    if db is None:
+    if store is None:
         return jsonify({"error": "Could not connect to the database"}), 500
 
-    # Check if the request is valid
-    if not all(key in data for key in ['package_name', 'name', 'description', 'beginning_date', 'expiration_date']):
-        return jsonify({"error": "Invalid request"}), 400
-
-    # Check data is valid
-    try:
-        # Parse the dates
-        beginning_date = datetime.strptime(
-            data['beginning_date'], '%Y-%m-%d %H:%M:%S')
-        expiration_date = datetime.strptime(
-            data['expiration_date'], '%Y-%m-%d %H:%M:%S')
-    except ValueError:
-        return jsonify({"error": "Invalid date format. Please use YYYY-MM-DD HH:MM:SS"}), 400
+    feature_toggle_item, error = _validate_new_feature(data)
+    if error:
+        return jsonify({"error": error}), 400
 
-    if beginning_date > expiration_date:
-        return jsonify({"error": "Beginning date must be before expiration date"}), 400
-
-    # Create the feature toggle item
-    feature_toggle_item = {
-        "_id": str(uuid.uuid4()),
-        "name": data['name'],
-        "description": data['description'],
-        "beginning_date": beginning_date,
-        "expiration_date": expiration_date,
-        "created_at": datetime.now(),
-        "updated_at": datetime.now()
-    }
+    # Provision the package storage (e.g. its indexes) before the first insert creates it
+    if not PackageRegistry.exists(store, data['package_name']):
+        store.provision(data['package_name'])
 
     # Insert the feature toggle into the database
-    package_collection = db[data['package_name']]
-    package_collection.insert_one(feature_toggle_item)
+    try:
+        store.create(data['package_name'], feature_toggle_item)
+    except DuplicateFeatureError:
+        return jsonify({"error": f"Feature toggle '{data['name']}' already exists in package '{data['package_name']}'"}), 409
+    PackageRegistry.register(data['package_name'])
+    _publish_changes(data['package_name'], [('create', feature_toggle_item)])
 
     return jsonify({"message": "Feature toggle created successfully", '_id': feature_toggle_item['_id']}), 201
 
 # get All features in the specified package
 @feature_toggle_blueprint.route('/feature-toggles/<package_name>', methods=['GET'])
+@_conditional_get()
+@_single_flight()
 def get_all_features_for_package(package_name):
     """
     Retrieve all feature toggles for a specific package
@@ -103,6 +551,16 @@ def get_all_features_for_package(package_name):
         type: string
         required: true
         description: The name of the package
+      - name: include_archived
+        in: query
+        type: boolean
+        required: false
+        description: Also return the archived (long expired) feature toggles
+      - name: fields
+        in: query
+        type: string
+        required: false
+        description: Comma-separated fields to return, e.g. name,expiration_date
     responses:
       200:
         description: Successfully retrieved feature toggles
@@ -136,19 +594,17 @@ def get_all_features_for_package(package_name):
       404:
         description: The specified package does not exist
     """
-    db = MongoConnectionHolder.get_db()
-    if db is None:
+    store = StorageHolder.get_store()
+    if store is None:
         return jsonify({"error": "Could not connect to the database"}), 500
     
-    if package_name not in db.list_collection_names():
+    if not PackageRegistry.exists(store, package_name):
         return jsonify({"error": f"Package '{package_name}' does not exist"}), 404
     
 
     
     try:
-        collection = db[package_name]
-        feature_toggles = list(collection.find({}))  
-        return jsonify(feature_toggles), 200
+        return query_response(store, package_name, include_archived=_include_archived())
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({"error": "An error occurred"}), 500
@@ -157,6 +613,8 @@ def get_all_features_for_package(package_name):
 #  Get all active feature toggles for package name and date
 ##########
 @feature_toggle_blueprint.route('/feature-toggles/<package_name>/by-date', methods=['GET'])
+@_conditional_get()
+@_single_flight()
 def get_feature_toggles_by_date(package_name):
     """
     Get all active feature toggles by a specific date
@@ -172,6 +630,16 @@ def get_feature_toggles_by_date(package_name):
           type: string
           required: true
           description: Date in the format YYYY-MM-DD
+        - name: include_archived
+          in: query
+          type: boolean
+          required: false
+          description: Also return the archived (long expired) feature toggles
+        - name: fields
+          in: query
+          type: string
+          required: false
+          description: Comma-separated fields to return, e.g. name,expiration_date
     responses:
         200:
             description: List of active feature toggles by date
@@ -181,12 +649,12 @@ def get_feature_toggles_by_date(package_name):
             description: An error occurred while retrieving feature toggles
     """
     date_str = request.args.get('date', "")
-    db = MongoConnectionHolder.get_db()
-    if db is None:
+    store = StorageHolder.get_store()
+    if store is None:
         # Helpful error message for debugging
         return jsonify({'error': 'Database not initialized'}), 500
     
-    if package_name not in db.list_collection_names():
+    if not PackageRegistry.exists(store, package_name):
         return jsonify({"error": f"Package '{package_name}' does not exist"}), 404
     
 
@@ -196,17 +664,16 @@ def get_feature_toggles_by_date(package_name):
     except (ValueError, TypeError):
         return jsonify({'error': 'Invalid date format, use YYYY-MM-DD'}), 400
 
-    features_by_date = []
-    package_collection = db[package_name]
+    if _include_archived():
+        return query_response(store, package_name, include_archived=True, active_at=specific_date)
+
+    # Answer from the in-memory interval index once it is warm
+    index = IntervalIndex.get(store, package_name, PackageVersions.get(store, package_name))
+    if index is not None:
+        return documents_response(index.stab(specific_date))
 
     # Find feature toggles by date
-    active_features_by_date = list(package_collection.find({
-        'expiration_date': {'$gte': specific_date},
-        'beginning_date': {'$lte': specific_date}
-    }))
-    for feature in active_features_by_date:
-        features_by_date.append(feature)
-    return jsonify(features_by_date), 200
+    return query_response(store, package_name, active_at=specific_date)
 
 
 #  Delete all feature toggles for package name
@@ -228,17 +695,16 @@ def delete_all_feature_toggles(package_name):
         404:
             description: Package not found
     """
-    db = MongoConnectionHolder.get_db()
-    if db is None:
+    store = StorageHolder.get_store()
+    if store is None:
         return jsonify({"error": "Could not connect to the database"}), 500
     
-    if package_name not in db.list_collection_names():
+    if not PackageRegistry.exists(store, package_name):
         return jsonify({"error": f"Package '{package_name}' does not exist"}), 404
     
-    package_collection = db[package_name]
-    
-    # Delete all feature toggles
-    package_collection.delete_many({})
+    # Delete all feature toggles, dropping the package so it stops existing
+    store.drop_package(package_name)
+    _publish_changes(package_name, [('delete-all', None)])
     return jsonify({'message': 'All feature toggles deleted'}), 200
 
 
@@ -247,6 +713,8 @@ def delete_all_feature_toggles(package_name):
     
 # Get active features in the package
 @feature_toggle_blueprint.route('/feature-toggles/<package_name>/active', methods=['GET'])
+@_conditional_get(ActiveFeaturesCache.window)
+@_single_flight(ActiveFeaturesCache.window)
 def get_active_features(package_name):
 
     """
@@ -258,6 +726,11 @@ def get_active_features(package_name):
         type: string
         required: true
         description: The name of the package
+      - name: fields
+        in: query
+        type: string
+        required: false
+        description: Comma-separated fields to return, e.g. name,expiration_date
     responses:
       200:
         description: Successfully retrieved active feature toggles
@@ -291,22 +764,15 @@ def get_active_features(package_name):
         description: An error occurred while retrieving active feature toggles
     """
 
-    db = MongoConnectionHolder.get_db()
-    if db is None:
+    store = StorageHolder.get_store()
+    if store is None:
         return jsonify({"error": "Could not connect to the database"}), 500
     
-    if package_name not in db.list_collection_names():
+    if not PackageRegistry.exists(store, package_name):
         return jsonify({"error": f"Package '{package_name}' does not exist"}), 404
     
     try:
-        # Query the collection for all active features
-        current_time = datetime.now(timezone.utc)
-        collection = db[package_name]
-        active_features = list(collection.find({
-            "beginning_date": {"$lte": current_time},
-            "expiration_date": {"$gte": current_time}}))  
-
-        return jsonify(active_features), 200
+        return documents_response(_load_active_features(store, package_name, utc_now()))
     except Exception as e:
         return jsonify({"error": "An error occurred while retrieving active feature toggles"}), 500
     
@@ -339,24 +805,21 @@ def delete_feature_toggle(package_name, feature_id):
       500:
         description: An error occurred while deleting the feature toggle
     """
-    db = MongoConnectionHolder.get_db()
+    store = StorageHolder.get_store()
 
     # Validate database connection
-    if db is None:
+    if store is None:
         return jsonify({"error": "Could not connect to the database"}), 500
 
-    # Check if the package_name collection exists
-    if package_name not in db.list_collection_names():
+    # Check if the package exists
+    if not PackageRegistry.exists(store, package_name):
         return jsonify({"error": f"Package '{package_name}' does not exist"}), 404
     
     try:
-        collection = db[package_name]
         # Attempt to delete the feature toggle by string `_id`
-        result = collection.delete_one({"_id": feature_id})
-
-        # Check if a document was deleted
-        if result.deleted_count == 0:
+        if not store.delete(package_name, feature_id):
             return jsonify({"error": f"Feature with _id '{feature_id}' does not exist in package '{package_name}'"}), 404
+        _publish_changes(package_name, [('delete', feature_id)])
         
         return jsonify({"message": f"Feature with _id '{feature_id}' successfully deleted from package '{package_name}'"}), 200
     except Exception as e:
@@ -397,76 +860,54 @@ def update_feature_toggle(package_name, feature_id):
                 beginning_date:
                   type: string
                   description: Beginning date of the feature toggle in the format YYYY-MM-DD HH:MM:SS
+                version:
+                  type: integer
+                  description: Only update if the feature toggle is still at this version
     responses:
         200:
-            description: Dates updated
+            description: Dates updated, with the updated feature toggle
         400:
             description: Invalid date format
         404:
             description: Feature toggle not found
+        409:
+            description: The feature toggle is no longer at the given version
     """
     data = request.json
-    new_expiration_date = None
-    new_beginning_date = None
-    db = MongoConnectionHolder.get_db()
-    if db is None:
+    store = StorageHolder.get_store()
+    if store is None:
         # Helpful error message for debugging
         return jsonify({'error': 'Database not initialized'}), 500
     
-    # Check if the package_name collection exists
-    if package_name not in db.list_collection_names():
+    # Check if the package exists
+    if not PackageRegistry.exists(store, package_name):
         return jsonify({"error": f"Package '{package_name}' does not exist"}), 404
 
     # Check for new dates in request data
-    if 'expiration_date' in data:
-        new_expiration_date = data.get('expiration_date')
-    if 'beginning_date' in data:
-        new_beginning_date = data.get('beginning_date')
+    fields, error = _parse_date_updates(data)
+    if not error:
+        version, error = _parse_expected_version(data)
+    if error:
+        return jsonify({'error': error}), 400
 
-    if not 'expiration_date' in data and not 'beginning_date' in data:
-        return jsonify({'error': 'No dates provided'}), 400
-
-    try:
-        # Parse new dates
-        if new_expiration_date:
-            new_expiration_date = datetime.strptime(
-                new_expiration_date, '%Y-%m-%d %H:%M:%S')
-        if new_beginning_date:
-            new_beginning_date = datetime.strptime(
-                new_beginning_date, '%Y-%m-%d %H:%M:%S')
-    except ValueError:
-        return jsonify({'error': 'Invalid date format, use YYYY-MM-DD HH:MM:SS'}), 400
-
-    if new_beginning_date and new_expiration_date and new_beginning_date > new_expiration_date:
-        return jsonify({'error': 'Beginning date must be before expiration date'}), 400
-
-    package_collection = db[package_name]
-   
-    # Find and update feature toggle
-    feature = package_collection.find_one({'_id': feature_id})
-    if feature:
-        if new_expiration_date:
-            if new_expiration_date < feature['beginning_date']:
-                return jsonify({'error': 'Expiration date cannot be before beginning date'}), 400
-            feature['expiration_date'] = new_expiration_date
-        if new_beginning_date:
-            if new_beginning_date > feature['expiration_date']:
-                return jsonify({'error': 'Beginning date cannot be after expiration date'}), 400
-            feature['beginning_date'] = new_beginning_date
-        
-        # Update the updated_at field
-        feature['updated_at'] = datetime.now()
+    # Update the updated_at field
+    fields['updated_at'] = _timestamp()
 
-        package_collection.update_one(
-            {'_id': feature['_id']},
-            {'$set': feature}
-        )
-        return jsonify({'message': 'Dates updated'}), 200
+    # A single date must keep its order with the stored one: check it in the update query
+    feature = store.conditional_update(
+        package_name, feature_id, fields, version=version,
+        beginning_by=fields.get('expiration_date') if 'beginning_date' not in fields else None,
+        expiration_from=fields.get('beginning_date') if 'expiration_date' not in fields else None)
+    if feature is None:
+        return _update_failure(store, package_name, feature_id, fields, version, 'Feature toggle not found')
 
-    return jsonify({'error': 'Feature toggle not found'}), 404
+    _publish_changes(package_name, [('update', (feature_id, {**fields, 'version': feature['version']}))])
+    return jsonify({'message': 'Dates updated', 'feature': feature}), 200
 
 
 @feature_toggle_blueprint.route('/feature-toggles/<package_name>/recent', methods=['GET'])
+@_conditional_get(_clock_bucket)
+@_single_flight(_clock_bucket)
 def get_recent_features(package_name):
     """
     Retrieve all feature toggles created in the last 30 days for a specific package
@@ -477,6 +918,16 @@ def get_recent_features(package_name):
         type: string
         required: true
         description: The name of the package containing the features
+      - name: include_archived
+        in: query
+        type: boolean
+        required: false
+        description: Also return the archived (long expired) feature toggles
+      - name: fields
+        in: query
+        type: string
+        required: false
+        description: Comma-separated fields to return, e.g. name,expiration_date
     responses:
       200:
         description: Successfully retrieved recent feature toggles
@@ -486,26 +937,21 @@ def get_recent_features(package_name):
         description: An error occurred while retrieving feature toggles
     """
 
-    db = MongoConnectionHolder.get_db()
+    store = StorageHolder.get_store()
 
-    if db is None:
+    if store is None:
         return jsonify({'error': 'Database not initialized'}), 500
     
-    # Check if the package_name collection exists
-    if package_name not in db.list_collection_names():
+    # Check if the package exists
+    if not PackageRegistry.exists(store, package_name):
         return jsonify({"error": f"Package '{package_name}' does not exist"}), 404
     
     # Calculate the date 30 days ago
     thirty_days_ago = datetime.now() - timedelta(days=30)
 
     try:
-        package_collection = db[package_name]
-        recent_features = list(package_collection.find(
-            {"created_at": {"$gte": thirty_days_ago}},
-            {"_id": 0}  # Exclude `_id` or include it depending on your preference
-        ))
-
-        return jsonify(recent_features), 200
+        return query_response(store, package_name, hide_id=True, include_archived=_include_archived(),
+                              created_since=thirty_days_ago)
     except Exception as e:
         print(f"Error retrieving recent features: {e}")
         return jsonify({"error": "An error occurred while retrieving recent features"}), 500
@@ -541,55 +987,68 @@ def update_feature_info(package_name, feature_id):
                 description:
                   type: string
                   description: description of the feature 
+                rollout_percentage:
+                  type: number
+                  description: Share of the subjects (0-100) the feature applies to, null for all
+                allow_list:
+                  type: array
+                  items:
+                    type: string
+                  description: Subject IDs the feature always applies to
+                deny_list:
+                  type: array
+                  items:
+                    type: string
+                  description: Subject IDs the feature never applies to
+                version:
+                  type: integer
+                  description: Only update if the feature toggle is still at this version
     responses:
         200:
-            description: Feature updated successfully
+            description: Feature updated successfully, with the updated feature toggle
         404:
             description: Feature or package not found
         400:
             description: Invalid request data
+        409:
+            description: A feature toggle with the same name already exists in the package, or the feature toggle is no longer at the given version
     """
 
     data = request.json
-    db = MongoConnectionHolder.get_db()
+    store = StorageHolder.get_store()
 
-    if db is None:
+    if store is None:
         return jsonify({"error": "Database not initialized"}), 500
 
-    # Check if the package_name collection exists
-    if package_name not in db.list_collection_names():
+    # Check if the package exists
+    if not PackageRegistry.exists(store, package_name):
         return jsonify({"error": f"Package '{package_name}' does not exist"}), 404
 
-    package_collection = db[package_name]
-
-    # Find the feature toggle
-    feature = package_collection.find_one({"_id": feature_id})
-    if not feature:
-        return jsonify({"error": f"Feature toggle with ID '{feature_id}' not found"}), 404
-    
-    # Update fields
-    updates = {}
-    if 'name' in data and data['name']:
-        updates['name'] = data['name']
-    if 'description' in data and data['description']:
-        updates['description'] = data['description']
-    
-    if not updates:
-        return jsonify({"error": "No valid fields provided for update"}), 400
+    updates, error = _parse_info_updates(data)
+    if not error:
+        version, error = _parse_expected_version(data)
+    if error:
+        return jsonify({"error": error}), 400
 
     # Add updated_at field
-    updates['updated_at'] = datetime.now()
+    updates['updated_at'] = _timestamp()
 
       # Update the feature in the database
-    package_collection.update_one(
-        {"_id": feature_id},
-        {"$set": updates}
-    )
+    try:
+        feature = store.conditional_update(package_name, feature_id, updates, version=version)
+    except DuplicateFeatureError:
+        return jsonify({"error": f"Feature toggle '{updates['name']}' already exists in package '{package_name}'"}), 409
+    if feature is None:
+        return _update_failure(store, package_name, feature_id, updates, version,
+                               f"Feature toggle with ID '{feature_id}' not found")
+    _publish_changes(package_name, [('update', (feature_id, {**updates, 'version': feature['version']}))])
 
-    return jsonify({"message": "Feature updated successfully"}), 200
+    return jsonify({"message": "Feature updated successfully", "feature": feature}), 200
 
 
 @feature_toggle_blueprint.route('/feature-toggles/<package_name>/active-in-range', methods=['GET'])
+@_conditional_get()
+@_single_flight()
 def get_active_features_in_range(package_name):
 
     """
@@ -611,6 +1070,16 @@ parameters:
     type: string
     required: true
     description: "The end date of the range (format: YYYY-MM-DD)"
+  - name: include_archived
+    in: query
+    type: boolean
+    required: false
+    description: Also return the archived (long expired) feature toggles
+  - name: fields
+    in: query
+    type: string
+    required: false
+    description: Comma-separated fields to return, e.g. name,expiration_date
 responses:
   200:
     description: Successfully retrieved active feature toggles
@@ -648,13 +1117,13 @@ responses:
 """
 
   
-    db = MongoConnectionHolder.get_db()
+    store = StorageHolder.get_store()
 
-    if db is None:
+    if store is None:
         return jsonify({'error': 'Database not initialized'}), 500
     
-    # Check if the package_name collection exists
-    if package_name not in db.list_collection_names():
+    # Check if the package exists
+    if not PackageRegistry.exists(store, package_name):
         return jsonify({"error": f"Package '{package_name}' does not exist"}), 404
     
      # Get query parameters
@@ -676,22 +1145,24 @@ responses:
         return jsonify({"error": "Start date must be before end date"}), 400
     
     try:
-        package_collection = db[package_name]
+        if _include_archived():
+            return query_response(store, package_name, include_archived=True,
+                                  active_between=(start_date_parsed, end_date_parsed))
+
+        # Answer from the in-memory interval index once it is warm
+        index = IntervalIndex.get(store, package_name, PackageVersions.get(store, package_name))
+        if index is not None:
+            return documents_response(index.overlap(start_date_parsed, end_date_parsed))
 
         # Query for active features in the date range
-        active_features = list(package_collection.find(
-            {
-                "beginning_date": {"$lte": end_date_parsed},
-                "expiration_date": {"$gte": start_date_parsed}
-            }
-        ))
-
-        return jsonify(active_features), 200
+        return query_response(store, package_name, active_between=(start_date_parsed, end_date_parsed))
     except Exception as e:
         print(f"Error retrieving active features in range: {e}")
         return jsonify({"error": "An error occurred while retrieving features"}), 500
 
 @feature_toggle_blueprint.route('/feature-toggles/<package_name>/statistics', methods=['GET'])
+@_conditional_get(_clock_bucket)
+@_single_flight(_clock_bucket)
 def get_feature_statistics(package_name):
     """
     Retrieve feature usage statistics for a specific package
@@ -716,58 +1187,441 @@ def get_feature_statistics(package_name):
                 active_features:
                   type: integer
                   description: Number of currently active features
+                scheduled_features:
+                  type: integer
+                  description: Number of features whose beginning date is in the future
+                expired_features:
+                  type: integer
+                  description: Number of features whose expiration date has passed
+                recent_features:
+                  type: integer
+                  description: Number of features created in the last 30 days
       404:
         description: Package not found
       500:
         description: Internal server error
     """
-    db = MongoConnectionHolder.get_db()
-    if db is None:
+    store = StorageHolder.get_store()
+    if store is None:
         return jsonify({'error': 'Database not initialized'}), 500
 
-    # Check if the package_name collection exists
-    if package_name not in db.list_collection_names():
+    # Check if the package exists
+    if not PackageRegistry.exists(store, package_name):
         return jsonify({"error": f"Package '{package_name}' does not exist"}), 404
-    
-    collection = db[package_name]
-    current_time = datetime.now()
 
     try:
-        total_features = collection.count_documents({})
-        active_features = collection.count_documents({
-            "beginning_date": {"$lte": current_time},
-            "expiration_date": {"$gte": current_time}
-        })
-
-        return jsonify({
-            "total_features": total_features,
-            "active_features": active_features
-        }), 200
+        return jsonify(PackageStatistics.get(store, package_name)), 200
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    
-
-    
-    
-
-
-
-
-
 
 
+# Statistics of every package
+@feature_toggle_blueprint.route('/statistics', methods=['GET'])
+def get_statistics_summary():
+    """
+    Retrieve the feature usage statistics of every package and their totals
+    ---
+    responses:
+      200:
+        description: Successfully retrieved the statistics
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                packages:
+                  type: object
+                  description: The statistics of each package, as returned by /feature-toggles/{package_name}/statistics
+                totals:
+                  type: object
+                  description: The sum of each statistic over all packages
+      500:
+        description: Internal server error
+    """
+    store = StorageHolder.get_store()
+    if store is None:
+        return jsonify({'error': 'Database not initialized'}), 500
 
+    try:
+        return jsonify(PackageStatistics.summary(store, sorted(store.package_names()))), 200
 
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 
+# Bulk create/update/delete across packages
+@feature_toggle_blueprint.route('/feature-toggles/bulk', methods=['POST'])
+def bulk_feature_toggles():
+    """
+    Create, update and delete many feature toggles in one request
+    ---
+    parameters:
+        - name: bulk_request
+          in: body
+          required: true
+          description: The operations to run
+          schema:
+            id: bulk_request
+            required:
+                - operations
+            properties:
+                ordered:
+                    type: boolean
+                    description: Stop at the first failing operation of each package (default true)
+                operations:
+                    type: array
+                    items:
+                        type: object
+                        properties:
+                            op:
+                                type: string
+                                enum: [create, update-dates, update-info, delete]
+                                description: The operation to run
+                            package_name:
+                                type: string
+                                description: The name of the package
+                            feature_id:
+                                type: string
+                                description: The `_id` of the feature toggle (update-dates, update-info, delete)
+                            name:
+                                type: string
+                                description: The name of the feature (create, update-info)
+                            description:
+                                type: string
+                                description: The description of the feature (create, update-info)
+                            beginning_date:
+                                type: string
+                                description: The start date of the feature (create, update-dates)
+                            expiration_date:
+                                type: string
+                                description: The end date of the feature (create, update-dates)
+                            rollout_percentage:
+                                type: number
+                                description: Share of the subjects (0-100) the feature applies to (create, update-info)
+                            allow_list:
+                                type: array
+                                items:
+                                    type: string
+                                description: Subject IDs the feature always applies to (create, update-info)
+                            deny_list:
+                                type: array
+                                items:
+                                    type: string
+                                description: Subject IDs the feature never applies to (create, update-info)
+    responses:
+        200:
+            description: One result per operation, in request order, each with an HTTP-like status
+        400:
+            description: The request was invalid
+        500:
+            description: Could not connect to the database
+    """
+    data = request.json
+    store = StorageHolder.get_store()
+    if store is None:
+        return jsonify({"error": "Could not connect to the database"}), 500
 
+    if not isinstance(data, dict) or not isinstance(data.get('operations'), list):
+        return jsonify({"error": "Invalid request"}), 400
 
-    
+    operations = data['operations']
+    ordered = bool(data.get('ordered', True))
+    if len(operations) > MAX_BULK_OPERATIONS:
+        return jsonify({"error": f"At most {MAX_BULK_OPERATIONS} operations are allowed per request"}), 400
+
+    results = [None] * len(operations)
+
+    # Group the operations per package, keeping their order
+    packages = {}
+    for position, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in BULK_OPERATIONS:
+            results[position] = {"status": 400, "error": f"'op' must be one of: {', '.join(BULK_OPERATIONS)}"}
+        elif not isinstance(operation.get('package_name'), str) or not operation['package_name']:
+            results[position] = {"status": 400, "error": "Invalid request"}
+        elif operation['op'] != 'create' and not isinstance(operation.get('feature_id'), str):
+            results[position] = {"status": 400, "error": "'feature_id' is required"}
+        else:
+            packages.setdefault(operation['package_name'], []).append(position)
+
+    for package_name, positions in packages.items():
+        try:
+            _bulk_write_package(store, package_name, positions, operations, results, ordered)
+        except Exception as e:
+            print(f"Error running bulk operations on package '{package_name}': {e}")
+            for position in positions:
+                if results[position] is None:
+                    results[position] = {"status": 500, "error": "An error occurred while writing the feature toggles"}
+
+    for position, result in enumerate(results):
+        result['index'] = position
+    return jsonify({"results": results}), 200
+
+
+def _bulk_write_package(store, package_name, positions, operations, results, ordered):
+    """
+    Validate and write the bulk operations of one package with a single storage batch
+
+    :param store: The FeatureStore
+    :param package_name: The name of the package
+    :param positions: Positions of the package's operations in the request
+    :param operations: All operations of the request
+    :param results: Per-operation results, filled in place
+    :param ordered: Stop at the first failing operation
+    """
+    exists = PackageRegistry.exists(store, package_name)
+
+    # Load every toggle the batch touches in one round-trip and replay the batch on copies
+    feature_ids = [operations[position]['feature_id'] for position in positions if operations[position]['op'] != 'create']
+    features = {}
+    if exists and feature_ids:
+        features = store.get_many(package_name, feature_ids)
+
+    writes, planned = [], []
+    stopped = created = False
+    for position in positions:
+        if stopped:
+            results[position] = {"status": 424, "error": "Skipped after an earlier operation failed"}
+            continue
+
+        # A package created earlier in the batch exists for the operations after it
+        status, error, write, effect = _plan_bulk_operation(
+            package_name, exists or created, operations[position], features)
+        if error:
+            results[position] = {"status": status, "error": error}
+            stopped = ordered
+            continue
+        writes.append(write)
+        planned.append((position, status, effect))
+        created = created or effect[0] == 'create'
+
+    if not writes:
+        return
+
+    if not exists:
+        store.provision(package_name)
+
+    failed = store.write_batch(package_name, writes, ordered)
+
+    changes = []
+    for index, (position, status, effect) in enumerate(planned):
+        if index in failed:
+            write_error = failed[index]
+            if write_error is None:
+                results[position] = {"status": 424, "error": "Skipped after an earlier operation failed"}
+            elif isinstance(write_error, DuplicateFeatureError):
+                results[position] = {"status": 409, "error": "A feature toggle with the same name already exists in the package"}
+            elif isinstance(write_error, FeatureConflictError):
+                results[position] = {"status": 409, "error": "The feature toggle was modified by another request"}
+            else:
+                results[position] = {"status": 500, "error": str(write_error)}
+            continue
+
+        kind, payload = effect
+        changes.append(effect)
+        if kind == 'create':
+            PackageRegistry.register(package_name)
+            results[position] = {"status": status, "_id": payload['_id']}
+        elif kind == 'update':
+            results[position] = {"status": status, "_id": payload[0]}
+        else:
+            results[position] = {"status": status, "_id": payload}
+
+    # One version bump and cache invalidation for the whole package batch
+    if changes:
+        _publish_changes(package_name, changes)
+
+
+def _plan_bulk_operation(package_name, exists, operation, features):
+    """
+    Validate one bulk operation and translate it into a storage write
+
+    The validation rules are the ones of the single-toggle routes. `features`
+    holds the toggles touched by the batch and is updated as the operation
+    would update them, so later operations see its effect.
+
+    :param package_name: The name of the package
+    :param exists: Whether the package existed before the batch or a create was planned for it
+    :param operation: The bulk operation
+    :param features: Working copies of the toggles touched by the batch, by `_id`
+    :return: HTTP-like status, error message, FeatureStore.write_batch write and the effect to propagate
+    :rtype: tuple
+    """
+    op = operation['op']
+
+    if op == 'create':
+        feature_toggle_item, error = _validate_new_feature(operation)
+        if error:
+            return 400, error, None, None
+        features[feature_toggle_item['_id']] = dict(feature_toggle_item)
+        return 201, None, ('create', feature_toggle_item), ('create', feature_toggle_item)
+
+    feature_id = operation['feature_id']
+    if not exists:
+        return 404, f"Package '{package_name}' does not exist", None, None
+    feature = features.get(feature_id)
+    if feature is None:
+        return 404, f"Feature toggle with ID '{feature_id}' not found", None, None
+
+    if op == 'delete':
+        del features[feature_id]
+        return 200, None, ('delete', feature_id), ('delete', feature_id)
+
+    if op == 'update-dates':
+        fields, error = _parse_date_updates(operation)
+        if not error:
+            error = _check_date_updates(feature, fields)
+    else:
+        fields, error = _parse_info_updates(operation)
+    if error:
+        return 400, error, None, None
+
+    fields['updated_at'] = _timestamp()
+    # Written with the predicates of the single-toggle routes: the toggle must still be as read here
+    conditions = {
+        'version': feature.get('version', 0),
+        'beginning_by': fields.get('expiration_date') if 'beginning_date' not in fields else None,
+        'expiration_from': fields.get('beginning_date') if 'expiration_date' not in fields else None
+    }
+    feature.update(fields, version=feature.get('version', 0) + 1)
+    return 200, None, ('update', feature_id, fields, conditions), \
+        ('update', (feature_id, {**fields, 'version': feature['version']}))
 
 
+# Active features of many packages in one request
+@feature_toggle_blueprint.route('/feature-toggles/active', methods=['POST'])
+def get_active_features_for_packages():
+    """
+    Retrieve the active feature toggles of many packages at once
+    ---
+    parameters:
+        - name: packages_request
+          in: body
+          required: true
+          description: The packages to evaluate
+          schema:
+            id: packages_request
+            required:
+                - packages
+            properties:
+                packages:
+                    type: array
+                    items:
+                        type: string
+                    description: The names of the packages
+    responses:
+        200:
+            description: Per-package results keyed by package name, each with a status and either the active features or an error
+        400:
+            description: The request was invalid
+        500:
+            description: Could not connect to the database
+    """
+    data = request.json
+    store = StorageHolder.get_store()
+    if store is None:
+        return jsonify({"error": "Could not connect to the database"}), 500
 
+    packages = data.get('packages') if isinstance(data, dict) else None
+    if not isinstance(packages, list) or not all(isinstance(package_name, str) for package_name in packages):
+        return jsonify({"error": "'packages' must be a list of package names"}), 400
+    packages = list(dict.fromkeys(packages))
+    if len(packages) > MAX_BATCH_PACKAGES:
+        return jsonify({"error": f"At most {MAX_BATCH_PACKAGES} packages are allowed per request"}), 400
+
+    # Same evaluation time for every package, as in get_active_features
+    current_time = utc_now()
+    futures = {
+        package_name: _evaluation_executor.submit(_evaluate_package, store, package_name, current_time)
+        for package_name in packages
+    }
+    return jsonify({package_name: future.result() for package_name, future in futures.items()}), 200
 
 
+@feature_toggle_blueprint.route('/feature-toggles/<package_name>/evaluate', methods=['POST'])
+def evaluate_package_for_subjects(package_name):
+    """
+    Decide which feature toggles of a package apply to each of many subjects
+    ---
+    parameters:
+        - name: package_name
+          in: path
+          type: string
+          required: true
+          description: The name of the package
+        - name: cohort_request
+          in: body
+          required: true
+          description: The subjects to evaluate
+          schema:
+            id: cohort_request
+            required:
+                - subjects
+            properties:
+                subjects:
+                    type: array
+                    items:
+                        type: string
+                    description: The subject IDs (strings or integers)
+                at:
+                    type: string
+                    description: Evaluation time (YYYY-MM-DD HH:MM:SS, UTC), now by default
+                format:
+                    type: string
+                    enum: [bitmap, columns]
+                    description: bitmap (default) for a base64 bitmap per toggle, columns for a list of 0/1 values per toggle
+    responses:
+        200:
+            description: Per active feature toggle, the number of subjects it applies to and the bitmap or column of subjects
+        400:
+            description: The request was invalid
+        404:
+            description: The specified package does not exist
+        500:
+            description: An error occurred while evaluating the feature toggles
+    """
+    data = request.json
+    store = StorageHolder.get_store()
+    if store is None:
+        return jsonify({"error": "Could not connect to the database"}), 500
 
+    subjects = data.get('subjects') if isinstance(data, dict) else None
+    if not isinstance(subjects, list) or not all(
+            isinstance(subject, (str, int)) and not isinstance(subject, bool) for subject in subjects):
+        return jsonify({"error": "'subjects' must be a list of subject IDs"}), 400
+    if len(subjects) > MAX_EVALUATION_SUBJECTS:
+        return jsonify({"error": f"At most {MAX_EVALUATION_SUBJECTS} subjects are allowed per request"}), 400
+
+    output = data.get('format', 'bitmap')
+    if output not in COHORT_FORMATS:
+        return jsonify({"error": f"'format' must be one of: {', '.join(COHORT_FORMATS)}"}), 400
+
+    evaluated_at = None
+    if data.get('at') is not None:
+        try:
+            evaluated_at = datetime.strptime(data['at'], '%Y-%m-%d %H:%M:%S')
+        except (ValueError, TypeError):
+            return jsonify({"error": "Invalid date format. Please use YYYY-MM-DD HH:MM:SS"}), 400
+
+    if not PackageRegistry.exists(store, package_name):
+        return jsonify({"error": f"Package '{package_name}' does not exist"}), 404
 
+    try:
+        if evaluated_at is None:
+            evaluated_at = utc_now()
+            features = _load_active_features(store, package_name, evaluated_at)
+        else:
+            index = IntervalIndex.get(store, package_name, PackageVersions.get(store, package_name))
+            features = index.stab(evaluated_at) if index is not None else list(store.find(package_name, active_at=evaluated_at))
+
+        results = evaluate_cohort(features, subjects)
+    except Exception as e:
+        print(f"Error evaluating package '{package_name}': {e}")
+        return jsonify({"error": "An error occurred while evaluating the feature toggles"}), 500
+
+    return jsonify({
+        "evaluated_at": evaluated_at,
+        "subjects": len(subjects),
+        "format": output,
+        "features": {name: format_result(enabled, output) for name, enabled in results.items()}
+    }), 200
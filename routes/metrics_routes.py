@@ -0,0 +1,139 @@
+from flask import Blueprint, Response
+from database.connection import MongoConnectionHolder
+from database.package_registry import PackageRegistry
+from cache.active_cache import ActiveFeaturesCache
+from cache.interval_index import IntervalIndex
+from cache.package_statistics import PackageStatistics
+from cache.shared_cache import SharedCache, SHARED_CACHE_ENABLED
+from storage.layout import STORAGE_DUAL_READ
+from storage.dual_store import DualLayoutStore
+from utils.single_flight import SingleFlight
+from metrics.registry import MetricsRegistry, CONTENT_TYPE
+
+metrics_blueprint = Blueprint('metrics', __name__)
+
+# In-process caches reporting lookup hits and misses
+CACHES = {
+    "package_registry": PackageRegistry,
+    "active_features": ActiveFeaturesCache,
+    "interval_index": IntervalIndex,
+    "package_statistics": PackageStatistics,
+}
+if SHARED_CACHE_ENABLED:
+    CACHES["shared"] = SharedCache
+
+
+def _collect_caches():
+    """
+    Read the hit/miss counters of the in-process caches
+
+    :return: (name, type, documentation, samples) tuples
+    :rtype: list
+    """
+    stats = {name: cache.get_stats() for name, cache in CACHES.items()}
+    return [
+        ("feature_toggles_cache_hits_total", "counter", "Cache lookups answered from memory, by cache",
+         [({"cache": name}, cache_stats["hits"]) for name, cache_stats in stats.items()]),
+        ("feature_toggles_cache_misses_total", "counter", "Cache lookups that had to go to the storage, by cache",
+         [({"cache": name}, cache_stats["misses"]) for name, cache_stats in stats.items()]),
+        ("feature_toggles_cache_hit_ratio", "gauge", "Share of the lookups answered from memory since the start, by cache",
+         [({"cache": name}, cache_stats["hits"] / (cache_stats["hits"] + cache_stats["misses"]))
+          for name, cache_stats in stats.items() if cache_stats["hits"] + cache_stats["misses"]]),
+        ("feature_toggles_cache_packages", "gauge", "Packages held by each cache",
+         [({"cache": name}, cache_stats["packages"]) for name, cache_stats in stats.items()]),
+    ]
+
+
+def _collect_connection():
+    """
+    Read the connection pool counters and the circuit breaker state
+
+    :return: (name, type, documentation, samples) tuples
+    :rtype: list
+    """
+    stats = MongoConnectionHolder.get_stats()
+    pool = stats["pool"]
+    return [
+        ("feature_toggles_mongo_connections", "gauge", "Open and checked out MongoDB connections",
+         [({"state": "open"}, pool["connections_open"]), ({"state": "in_use"}, pool["connections_in_use"])]),
+        ("feature_toggles_mongo_network_errors_total", "counter", "MongoDB commands that failed at the network level",
+         [({}, pool["network_errors"])]),
+        ("feature_toggles_mongo_circuit_breaker_open", "gauge", "1 while the circuit breaker keeps requests off MongoDB",
+         [({}, 0 if stats["circuit_breaker"]["state"] == "closed" else 1)]),
+    ]
+
+
+def _collect_dual_reads():
+    """
+    Read the counters of the reads compared between the two storage layouts
+
+    :return: (name, type, documentation, samples) tuples
+    :rtype: list
+    """
+    stats = DualLayoutStore.get_stats()
+    return [
+        ("feature_toggles_dual_reads_total", "counter", "Reads compared with the secondary storage layout, by result",
+         [({"result": "match"}, stats["matches"]), ({"result": "mismatch"}, stats["mismatches"]),
+          ({"result": "error"}, stats["read_errors"])]),
+        ("feature_toggles_dual_mirror_errors_total", "counter", "Writes that could not be mirrored to the secondary storage layout",
+         [({}, stats["mirror_errors"])]),
+    ]
+
+
+def _collect_single_flight():
+    """
+    Read the counters of the requests coalesced by the single-flight layer
+
+    :return: (name, type, documentation, samples) tuples
+    :rtype: list
+    """
+    stats = SingleFlight.get_stats()
+    return [
+        ("feature_toggles_single_flight_requests_total", "counter",
+         "Package reads by route and single-flight result: leader ran the query, coalesced shared it (a query saved), "
+         "timeout ran its own after waiting",
+         [({"endpoint": endpoint, "result": result}, endpoint_stats[key])
+          for endpoint, endpoint_stats in sorted(stats["endpoints"].items())
+          for result, key in [("leader", "leaders"), ("coalesced", "coalesced"), ("timeout", "timeouts")]]),
+        ("feature_toggles_single_flight_in_flight", "gauge", "Queries currently shared by the single-flight layer",
+         [({}, stats["in_flight"])]),
+    ]
+
+
+def _collect_shared_cache():
+    """
+    Read the occupancy of the cache shared by the workers of the host
+
+    :return: (name, type, documentation, samples) tuples
+    :rtype: list
+    """
+    stats = SharedCache.get_stats()
+    return [
+        ("feature_toggles_shared_cache_bytes", "gauge", "Bytes of the shared cache file, in use by snapshots and in total",
+         [({"state": "used"}, stats["bytes"]), ({"state": "size"}, stats["size"])]),
+        ("feature_toggles_shared_cache_publishes_total", "counter", "Package snapshots published to the shared cache by this worker",
+         [({}, stats["publishes"])]),
+    ]
+
+
+MetricsRegistry.add_collector(_collect_caches)
+MetricsRegistry.add_collector(_collect_connection)
+MetricsRegistry.add_collector(_collect_single_flight)
+if STORAGE_DUAL_READ:
+    MetricsRegistry.add_collector(_collect_dual_reads)
+if SHARED_CACHE_ENABLED:
+    MetricsRegistry.add_collector(_collect_shared_cache)
+
+
+@metrics_blueprint.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Expose the request, MongoDB and cache metrics to Prometheus
+    ---
+    produces:
+        - text/plain
+    responses:
+        200:
+            description: The metrics in the Prometheus text exposition format
+    """
+    return Response(MetricsRegistry.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,118 @@
+"""
+Export and inspect feature toggle snapshots.
+
+Run from the repository root:
+
+    python -m snapshot.snapshot_cli export --output feature-toggles.snapshot
+    python -m snapshot.snapshot_cli info feature-toggles.snapshot
+    python -m snapshot.snapshot_cli active feature-toggles.snapshot --package my-package [--date YYYY-MM-DD]
+
+`export` reads the configured storage (STORAGE_ENGINE and the DB_* variables);
+`info` and `active` only need the snapshot file.
+"""
+from datetime import datetime
+from snapshot.snapshot_file import SnapshotReader, SnapshotError, export_snapshot
+import argparse
+import json
+import sys
+import time
+
+
+def _format_feature(feature):
+    # Dates in the format the API accepts
+    return {key: value.strftime('%Y-%m-%d %H:%M:%S') if isinstance(value, datetime) else value
+            for key, value in feature.items()}
+
+
+def export(output):
+    """
+    Write a snapshot of every package in the configured storage
+
+    :param output: Snapshot file to write
+    :return: The exit code
+    :rtype: int
+    """
+    # Imported here so reading a snapshot needs neither the database settings nor a driver
+    from storage.storage_holder import StorageHolder
+
+    store = StorageHolder.get_store()
+    if store is None:
+        print("Could not connect to the database", file=sys.stderr)
+        return 1
+    with open(output, 'wb') as snapshot:
+        stats = export_snapshot(store, snapshot)
+    print(json.dumps(stats))
+    return 0
+
+
+def info(path):
+    """
+    Print the packages of a snapshot and how long it took to open
+
+    :param path: Snapshot file
+    :return: The exit code
+    :rtype: int
+    """
+    started = time.perf_counter()
+    with SnapshotReader(path) as reader:
+        load_ms = (time.perf_counter() - started) * 1000
+        print(json.dumps({
+            "generated_at": reader.generated_at.strftime('%Y-%m-%d %H:%M:%S'),
+            "load_ms": round(load_ms, 3),
+            "packages": {package_name: {"features": reader.count(package_name), "version": reader.version(package_name)}
+                         for package_name in reader.package_names()}
+        }, indent=2))
+    return 0
+
+
+def active(path, package_name, when):
+    """
+    Print the toggles of a package active at a point in time
+
+    :param path: Snapshot file
+    :param package_name: The name of the package
+    :param when: Evaluation time (naive UTC), or None for now
+    :return: The exit code
+    :rtype: int
+    """
+    with SnapshotReader(path) as reader:
+        features = reader.active_features(package_name, when)
+    if features is None:
+        print(f"Package '{package_name}' does not exist", file=sys.stderr)
+        return 1
+    print(json.dumps([_format_feature(feature) for feature in features], indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help='Write a snapshot of every package')
+    export_parser.add_argument('--output', default='feature-toggles.snapshot', help='Snapshot file to write')
+
+    info_parser = commands.add_parser('info', help='Show the packages of a snapshot and its load time')
+    info_parser.add_argument('path', help='Snapshot file')
+
+    active_parser = commands.add_parser('active', help='Show the toggles of a package active at a time')
+    active_parser.add_argument('path', help='Snapshot file')
+    active_parser.add_argument('--package', required=True, help='The name of the package')
+    active_parser.add_argument('--date', help="YYYY-MM-DD (as /by-date) or 'YYYY-MM-DD HH:MM:SS' in UTC; now by default")
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'export':
+            sys.exit(export(args.output))
+        if args.command == 'info':
+            sys.exit(info(args.path))
+
+        when = None
+        if args.date:
+            try:
+                when = datetime.strptime(args.date, '%Y-%m-%d %H:%M:%S' if ' ' in args.date else '%Y-%m-%d')
+            except ValueError:
+                parser.error("Invalid date format, use YYYY-MM-DD or 'YYYY-MM-DD HH:MM:SS'")
+        sys.exit(active(args.path, args.package, when))
+    except (OSError, SnapshotError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,291 @@
+"""
+Binary snapshot of every package's feature toggles, for offline and edge evaluation.
+
+Layout (little endian):
+
+    header     magic, format version, block size, package count, generation
+               time, directory offset and length
+    packages   per package: the string payloads, then the fixed-size records
+               sorted by (beginning_date, expiration_date), then the largest
+               expiration date of every block of BLOCK_SIZE records
+    directory  per package: name, version, record offset and count, block offset
+
+Dates are stored as milliseconds since the epoch (naive UTC, the precision
+MongoDB keeps). A reader memory-maps the file and only parses the directory
+when it opens; records are decoded when a query matches them.
+"""
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from cache.active_cache import utc_now
+import json
+import mmap
+import struct
+
+
+MAGIC = b"FTSNAPSH"
+FORMAT_VERSION = 1
+
+# Records per block; a block whose largest expiration date is in the past is skipped as a whole
+BLOCK_SIZE = 64
+
+HEADER = struct.Struct("<8sHHIqQQ")
+# beginning, expiration, created_at, updated_at, payload offset, payload length
+RECORD = struct.Struct("<qqqqQI4x")
+BEGINNING = struct.Struct("<q")
+BLOCK_MAX = struct.Struct("<q")
+# name length, version, records offset, record count, blocks offset
+PACKAGE_ENTRY = struct.Struct("<HqQIQ")
+
+EPOCH = datetime(1970, 1, 1)
+
+# Payloads are always UTF-8 JSON, so skip json.loads' encoding detection
+_decode_payload = json.JSONDecoder().decode
+
+
+class SnapshotError(ValueError):
+    """Raised when a file is not a readable snapshot"""
+
+
+def _to_millis(date):
+    return (date - EPOCH) // timedelta(milliseconds=1)
+
+
+def _from_millis(millis):
+    # Positional arguments (days, seconds, microseconds, milliseconds) skip the keyword parsing
+    return EPOCH + timedelta(0, 0, 0, millis)
+
+
+def _pad(buffer):
+    # Keep the records and block maxima 8-byte aligned
+    buffer.extend(b"\0" * (-len(buffer) % 8))
+
+
+def write_snapshot(output, packages, versions=None, generated_at=None):
+    """
+    Write a snapshot file
+
+    :param output: Binary file object to write to
+    :param packages: Feature toggle documents by package name
+    :param versions: Optional package versions by package name
+    :param generated_at: Generation time (naive UTC), now by default
+    :return: Number of packages, feature toggles and bytes written
+    :rtype: dict
+    """
+    versions = versions or {}
+    buffer = bytearray(HEADER.size)
+    directory = []
+    feature_count = 0
+
+    for package_name in sorted(packages):
+        features = sorted(
+            packages[package_name],
+            key=lambda feature: (feature['beginning_date'], feature['expiration_date'], feature['_id']))
+
+        payloads = []
+        for feature in features:
+            payload = json.dumps([feature['_id'], feature['name'], feature['description']]).encode()
+            payloads.append((len(buffer), len(payload)))
+            buffer.extend(payload)
+        _pad(buffer)
+
+        records_offset = len(buffer)
+        for feature, (payload_offset, payload_length) in zip(features, payloads):
+            buffer.extend(RECORD.pack(
+                _to_millis(feature['beginning_date']), _to_millis(feature['expiration_date']),
+                _to_millis(feature['created_at']), _to_millis(feature['updated_at']),
+                payload_offset, payload_length))
+
+        blocks_offset = len(buffer)
+        for start in range(0, len(features), BLOCK_SIZE):
+            block = features[start:start + BLOCK_SIZE]
+            buffer.extend(BLOCK_MAX.pack(max(_to_millis(feature['expiration_date']) for feature in block)))
+
+        directory.append((package_name, versions.get(package_name, 0), records_offset, len(features), blocks_offset))
+        feature_count += len(features)
+
+    directory_offset = len(buffer)
+    for package_name, version, records_offset, record_count, blocks_offset in directory:
+        name = package_name.encode()
+        buffer.extend(PACKAGE_ENTRY.pack(len(name), version, records_offset, record_count, blocks_offset))
+        buffer.extend(name)
+
+    HEADER.pack_into(
+        buffer, 0, MAGIC, FORMAT_VERSION, BLOCK_SIZE, len(directory),
+        _to_millis(generated_at or utc_now()), directory_offset, len(buffer) - directory_offset)
+    output.write(buffer)
+    return {"packages": len(directory), "features": feature_count, "bytes": len(buffer)}
+
+
+def export_snapshot(store, output):
+    """
+    Write a snapshot of every package in a storage
+
+    :param store: The FeatureStore
+    :param output: Binary file object to write to
+    :return: Number of packages, feature toggles and bytes written
+    :rtype: dict
+    """
+    packages = {package_name: list(store.find(package_name)) for package_name in store.package_names()}
+    return write_snapshot(output, packages, store.versions())
+
+
+class SnapshotReader:
+    """
+    Memory-mapped snapshot answering "active toggles of a package at a time".
+
+    Opening a snapshot only reads its directory, so it takes about the same
+    time whatever the number of toggles. Records are decoded the first time a
+    query returns them and kept, so returned documents must not be modified.
+    A toggle is active at T when beginning_date <= T <= expiration_date, as
+    in the API.
+    """
+
+    def __init__(self, path):
+        self.__file = open(path, 'rb')
+        try:
+            self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, block_size, package_count, generated_at, directory_offset, directory_length = \
+                HEADER.unpack_from(self.__map, 0)
+        except (ValueError, struct.error):
+            self.__file.close()
+            raise SnapshotError(f"'{path}' is not a feature toggle snapshot")
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise SnapshotError(f"'{path}' is not a version {FORMAT_VERSION} feature toggle snapshot")
+
+        self.block_size = block_size
+        self.generated_at = _from_millis(generated_at)
+        self.__packages = {}
+        self.__decoded = {}
+        offset = directory_offset
+        for _ in range(package_count):
+            name_length, package_version, records_offset, record_count, blocks_offset = \
+                PACKAGE_ENTRY.unpack_from(self.__map, offset)
+            offset += PACKAGE_ENTRY.size
+            name = self.__map[offset:offset + name_length].decode()
+            offset += name_length
+            self.__packages[name] = (package_version, records_offset, record_count, blocks_offset)
+
+    def package_names(self):
+        """
+        List the packages of the snapshot
+
+        :return: The package names
+        :rtype: list
+        """
+        return list(self.__packages)
+
+    def version(self, package_name):
+        """
+        Get the version a package had when the snapshot was taken
+
+        :param package_name: The name of the package
+        :return: The version, or None if the package is not in the snapshot
+        :rtype: int
+        """
+        entry = self.__packages.get(package_name)
+        return entry[0] if entry is not None else None
+
+    def count(self, package_name):
+        """
+        Count the feature toggles of a package
+
+        :param package_name: The name of the package
+        :return: The number of toggles, or None if the package is not in the snapshot
+        :rtype: int
+        """
+        entry = self.__packages.get(package_name)
+        return entry[2] if entry is not None else None
+
+    def features(self, package_name):
+        """
+        Get every feature toggle of a package
+
+        :param package_name: The name of the package
+        :return: The toggles sorted by dates, which must not be modified, or None if the package is not in the snapshot
+        :rtype: list
+        """
+        entry = self.__packages.get(package_name)
+        if entry is None:
+            return None
+        _, records_offset, record_count, _ = entry
+        return [self.__decode(records_offset + position * RECORD.size) for position in range(record_count)]
+
+    def active_features(self, package_name, when=None):
+        """
+        Get the feature toggles of a package active at a point in time
+
+        :param package_name: The name of the package
+        :param when: Evaluation time (naive UTC), now by default
+        :return: The active toggles, which must not be modified, or None if the package is not in the snapshot
+        :rtype: list
+        """
+        entry = self.__packages.get(package_name)
+        if entry is None:
+            return None
+        _, records_offset, record_count, blocks_offset = entry
+        millis = _to_millis(when or utc_now())
+
+        # Records are sorted by beginning date: only the ones before `end` have begun
+        end = bisect_right(_Beginnings(self.__map, records_offset, record_count), millis)
+        active_features = []
+        for block in range((end + self.block_size - 1) // self.block_size):
+            if BLOCK_MAX.unpack_from(self.__map, blocks_offset + block * BLOCK_MAX.size)[0] < millis:
+                continue
+            for position in range(block * self.block_size, min(end, (block + 1) * self.block_size)):
+                offset = records_offset + position * RECORD.size
+                if RECORD.unpack_from(self.__map, offset)[1] >= millis:
+                    active_features.append(self.__decode(offset))
+        return active_features
+
+    def close(self):
+        """
+        Unmap and close the snapshot file
+        """
+        if not self.__map.closed:
+            self.__map.close()
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __decode(self, offset):
+        feature = self.__decoded.get(offset)
+        if feature is None:
+            feature = self.__decoded[offset] = self.__parse(offset)
+        return feature
+
+    def __parse(self, offset):
+        beginning, expiration, created_at, updated_at, payload_offset, payload_length = \
+            RECORD.unpack_from(self.__map, offset)
+        feature_id, name, description = _decode_payload(self.__map[payload_offset:payload_offset + payload_length].decode())
+        return {
+            "_id": feature_id,
+            "name": name,
+            "description": description,
+            "beginning_date": _from_millis(beginning),
+            "expiration_date": _from_millis(expiration),
+            "created_at": _from_millis(created_at),
+            "updated_at": _from_millis(updated_at)
+        }
+
+
+class _Beginnings:
+    """
+    Read-only sequence view of the beginning dates of a package's records, for bisect.
+    """
+    __slots__ = ("map", "offset", "length")
+
+    def __init__(self, snapshot_map, offset, length):
+        self.map = snapshot_map
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, position):
+        return BEGINNING.unpack_from(self.map, self.offset + position * RECORD.size)[0]
@@ -0,0 +1,309 @@
+class DuplicateFeatureError(Exception):
+    """
+    Raised when a write would give two feature toggles of a package the same name
+    """
+
+
+class FeatureConflictError(Exception):
+    """
+    Raised when a conditional update no longer matches its feature toggle
+    """
+
+
+class FeatureStore:
+    """
+    Storage interface of the feature toggles, one implementation per engine.
+
+    Feature toggles are dicts with `_id`, name, description, beginning_date,
+    expiration_date, created_at, updated_at and version, grouped by package. Read
+    criteria are keyword arguments combined with AND:
+
+    - active_at: datetime, toggles with beginning_date <= active_at <= expiration_date
+    - active_between: (start, end), toggles with beginning_date <= end and expiration_date >= start
+    - created_since: datetime, toggles with created_at >= created_since
+
+    The *_async methods serve the ASGI entry point. By default they call the
+    synchronous methods, which is right for engines that do no I/O.
+    """
+
+    # True when the engine answers date queries from its own in-memory index,
+    # so the routes skip the IntervalIndex cache layer
+    indexes_dates = False
+
+    def package_names(self):
+        """
+        List the packages
+
+        :return: The package names
+        :rtype: list
+        """
+        raise NotImplementedError
+
+    def package_exists(self, package_name):
+        """
+        Check if a package has feature toggles
+
+        :param package_name: The name of the package
+        :return: True if the package exists
+        :rtype: bool
+        """
+        raise NotImplementedError
+
+    def provision(self, package_name):
+        """
+        Prepare the storage of a new package (e.g. its indexes)
+
+        :param package_name: The name of the package
+        :return: True if the package storage is complete
+        :rtype: bool
+        """
+        return True
+
+    def create(self, package_name, feature):
+        """
+        Store a new feature toggle
+
+        :param package_name: The name of the package
+        :param feature: The feature toggle document
+        :raises DuplicateFeatureError: The name is taken in the package
+        """
+        raise NotImplementedError
+
+    def get(self, package_name, feature_id):
+        """
+        Get one feature toggle
+
+        :param package_name: The name of the package
+        :param feature_id: The `_id` of the feature toggle
+        :return: A copy of the document the caller may modify, or None
+        :rtype: dict
+        """
+        raise NotImplementedError
+
+    def get_many(self, package_name, feature_ids):
+        """
+        Get several feature toggles in one call
+
+        :param package_name: The name of the package
+        :param feature_ids: The `_id`s of the feature toggles
+        :return: Copies of the documents found, by `_id`
+        :rtype: dict
+        """
+        raise NotImplementedError
+
+    def find(self, package_name, after=None, limit=None, ordered=False, **criteria):
+        """
+        Find the feature toggles matching the criteria
+
+        :param package_name: The name of the package
+        :param after: (created_at, _id) keyset position; only toggles after it are returned
+        :param limit: Maximum number of toggles
+        :param ordered: Sort by (created_at, _id); implied by after and limit
+        :param criteria: active_at, active_between and/or created_since
+        :return: The documents, which must not be modified
+        :rtype: iterable
+        """
+        raise NotImplementedError
+
+    def next_beginning_after(self, package_name, when):
+        """
+        Get the nearest beginning date after a point in time
+
+        :param package_name: The name of the package
+        :param when: Naive UTC datetime
+        :return: The beginning date, or None if no toggle is scheduled
+        :rtype: datetime
+        """
+        raise NotImplementedError
+
+    def count(self, package_name, **criteria):
+        """
+        Count the feature toggles matching the criteria
+
+        :param package_name: The name of the package
+        :param criteria: active_at, active_between and/or created_since
+        :return: The number of toggles
+        :rtype: int
+        """
+        raise NotImplementedError
+
+    def update(self, package_name, feature_id, fields):
+        """
+        Set fields of a feature toggle
+
+        :param package_name: The name of the package
+        :param feature_id: The `_id` of the feature toggle
+        :param fields: The fields to set
+        :return: False if the feature toggle does not exist
+        :rtype: bool
+        :raises DuplicateFeatureError: The new name is taken in the package
+        """
+        raise NotImplementedError
+
+    def conditional_update(self, package_name, feature_id, fields, version=None, beginning_by=None, expiration_from=None):
+        """
+        Atomically set fields of a feature toggle and increment its version, if it still matches the conditions
+
+        :param package_name: The name of the package
+        :param feature_id: The `_id` of the feature toggle
+        :param fields: The fields to set
+        :param version: Only update a toggle at this version (a toggle without a version is at version 0)
+        :param beginning_by: Only update a toggle with beginning_date <= beginning_by
+        :param expiration_from: Only update a toggle with expiration_date >= expiration_from
+        :return: The updated document, or None if the toggle does not exist or a condition does not hold
+        :rtype: dict
+        :raises DuplicateFeatureError: The new name is taken in the package
+        """
+        raise NotImplementedError
+
+    def delete(self, package_name, feature_id):
+        """
+        Delete one feature toggle
+
+        :param package_name: The name of the package
+        :param feature_id: The `_id` of the feature toggle
+        :return: False if the feature toggle does not exist
+        :rtype: bool
+        """
+        raise NotImplementedError
+
+    def drop_package(self, package_name):
+        """
+        Delete a package and all its feature toggles, archived ones included
+
+        :param package_name: The name of the package
+        """
+        raise NotImplementedError
+
+    def write_batch(self, package_name, writes, ordered):
+        """
+        Apply several writes to one package in one call
+
+        :param package_name: The name of the package
+        :param writes: ('create', feature), ('update', feature_id, fields, conditions) or ('delete', feature_id)
+                       tuples; an update is a conditional_update with `conditions` as keyword arguments
+        :param ordered: Stop at the first failing write
+        :return: The failed writes by position: the error (FeatureConflictError for an update whose conditions
+                 no longer hold), or None when skipped after an earlier failure
+        :rtype: dict
+        """
+        raise NotImplementedError
+
+    def replace_many(self, package_name, features):
+        """
+        Write whole feature toggle documents, inserting the missing ones
+
+        Used to copy toggles from another layout; a copy replaces any stored
+        toggle with the same `_id`.
+
+        :param package_name: The name of the package
+        :param features: The feature documents
+        """
+        raise NotImplementedError
+
+    def archive_expired(self, package_name, expired_before, limit):
+        """
+        Move feature toggles that expired before a date to the archive
+
+        Archived toggles are left out of every read but find_archived.
+
+        :param package_name: The name of the package
+        :param expired_before: Naive UTC datetime; toggles with an earlier expiration_date are archived
+        :param limit: Maximum number of toggles to move
+        :return: The `_id` of the archived toggles
+        :rtype: list
+        """
+        raise NotImplementedError
+
+    def find_archived(self, package_name, after=None, limit=None, ordered=False, **criteria):
+        """
+        Find the archived feature toggles matching the criteria
+
+        Same arguments and result as find.
+
+        :return: The documents, which must not be modified
+        :rtype: iterable
+        """
+        return []
+
+    def bump_version(self, package_name, count=1):
+        """
+        Increment the version of a package
+
+        :param package_name: The name of the package
+        :param count: Number of changes written
+        :return: The new version
+        :rtype: int
+        """
+        raise NotImplementedError
+
+    def versions(self):
+        """
+        Get the version of every package that was written
+
+        :return: Versions by package name
+        :rtype: dict
+        """
+        raise NotImplementedError
+
+    def append_changes(self, package_name, changes):
+        """
+        Append changes to the change log of a package
+
+        The log only keeps the most recent changes; older ones are dropped.
+
+        :param package_name: The name of the package
+        :param changes: Change events, each with its package version
+        """
+        raise NotImplementedError
+
+    def changes_since(self, package_name, version, limit):
+        """
+        Read the logged changes of a package newer than a version
+
+        :param package_name: The name of the package
+        :param version: The last version the client has seen
+        :param limit: Maximum number of changes
+        :return: The changes in version order
+        :rtype: list
+        """
+        raise NotImplementedError
+
+    def index_status(self):
+        """
+        Report the index status of every package
+
+        :return: Per-package existing, missing and failed indexes
+        :rtype: list
+        """
+        return []
+
+    def provision_all(self):
+        """
+        Prepare the storage of every existing package
+
+        :return: Number of packages with complete storage
+        :rtype: int
+        """
+        return len(self.package_names())
+
+    async def package_names_async(self):
+        return self.package_names()
+
+    async def package_exists_async(self, package_name):
+        return self.package_exists(package_name)
+
+    async def find_async(self, package_name, **criteria):
+        """
+        Find the feature toggles matching the criteria
+
+        :return: The documents
+        :rtype: list
+        """
+        return list(self.find(package_name, **criteria))
+
+    async def next_beginning_after_async(self, package_name, when):
+        return self.next_beginning_after(package_name, when)
+
+    async def versions_async(self):
+        return self.versions()
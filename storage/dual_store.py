@@ -0,0 +1,207 @@
+from storage.base import FeatureStore
+from storage.layout import STORAGE_DUAL_READ_SAMPLE_RATE
+import random
+import threading
+
+
+def _comparable(result):
+    """
+    Normalize a read result so both layouts can be compared
+
+    :param result: A document, a list/cursor of documents, a dict of documents by `_id`, or a scalar
+    :return: The documents by `_id` for lists, the value otherwise
+    """
+    if isinstance(result, (str, int, bool, dict)) or result is None or not hasattr(result, '__iter__'):
+        return result
+    return {document['_id']: document for document in result}
+
+
+class DualLayoutStore(FeatureStore):
+    """
+    Two MongoDB layouts kept in step while migrating between them (STORAGE_DUAL_READ).
+
+    The primary (STORAGE_LAYOUT) serves every read and takes the writes first.
+    Each write is then mirrored to the secondary as whole documents, so a
+    toggle missed by the migration copy is filled in by its next write.
+    STORAGE_DUAL_READ_SAMPLE_RATE of the reads are also run on the secondary
+    and compared; the counters tell when the secondary can take over. Streamed
+    reads are never compared, as comparing would read them whole. A failed
+    mirror or secondary read is counted, never returned to the client.
+    Versions, archive and change log are shared by both layouts.
+    """
+    __reads = 0
+    __matches = 0
+    __mismatches = 0
+    __read_errors = 0
+    __mirror_errors = 0
+    __lock = threading.Lock()
+
+    def __init__(self, primary, secondary):
+        self.db = primary.db
+        self.primary = primary
+        self.secondary = secondary
+
+    def __read(self, method, package_name, *args, compare=True, **kwargs):
+        result = getattr(self.primary, method)(package_name, *args, **kwargs)
+        with DualLayoutStore.__lock:
+            DualLayoutStore.__reads += 1
+        if not compare or random.random() >= STORAGE_DUAL_READ_SAMPLE_RATE:
+            return result
+
+        # Cursors can only be read once: compare and return a list
+        if hasattr(result, '__iter__') and not isinstance(result, (str, dict)):
+            result = list(result)
+        try:
+            other = getattr(self.secondary, method)(package_name, *args, **kwargs)
+            matches = _comparable(result) == _comparable(other)
+        except Exception as e:
+            print(f"Error reading package '{package_name}' from the secondary layout ({method}): {e}")
+            with DualLayoutStore.__lock:
+                DualLayoutStore.__read_errors += 1
+            return result
+
+        with DualLayoutStore.__lock:
+            if matches:
+                DualLayoutStore.__matches += 1
+            else:
+                DualLayoutStore.__mismatches += 1
+        if not matches:
+            print(f"Layouts differ on package '{package_name}' ({method})")
+        return result
+
+    def __mirror(self, package_name, method, *args):
+        try:
+            getattr(self.secondary, method)(package_name, *args)
+        except Exception as e:
+            print(f"Error mirroring a write of package '{package_name}' to the secondary layout ({method}): {e}")
+            with DualLayoutStore.__lock:
+                DualLayoutStore.__mirror_errors += 1
+
+    def __mirror_documents(self, package_name, feature_ids):
+        # Copy the current state of the written toggles, deleting those that no longer exist
+        try:
+            features = self.primary.get_many(package_name, feature_ids)
+        except Exception as e:
+            print(f"Error reading package '{package_name}' to mirror its writes: {e}")
+            with DualLayoutStore.__lock:
+                DualLayoutStore.__mirror_errors += 1
+            return
+        deleted = [('delete', feature_id) for feature_id in feature_ids if feature_id not in features]
+        if features:
+            self.__mirror(package_name, 'replace_many', list(features.values()))
+        if deleted:
+            self.__mirror(package_name, 'write_batch', deleted, False)
+
+    @staticmethod
+    def get_stats():
+        """
+        Get the dual-read counters
+
+        :return: Reads, compared reads that matched or differed, failed secondary reads and failed mirrored writes
+        :rtype: dict
+        """
+        with DualLayoutStore.__lock:
+            return {
+                "reads": DualLayoutStore.__reads,
+                "matches": DualLayoutStore.__matches,
+                "mismatches": DualLayoutStore.__mismatches,
+                "read_errors": DualLayoutStore.__read_errors,
+                "mirror_errors": DualLayoutStore.__mirror_errors
+            }
+
+    def package_names(self):
+        return self.primary.package_names()
+
+    def package_exists(self, package_name):
+        return self.__read('package_exists', package_name)
+
+    def provision(self, package_name):
+        complete = self.primary.provision(package_name)
+        self.__mirror(package_name, 'provision')
+        return complete
+
+    def create(self, package_name, feature):
+        self.primary.create(package_name, feature)
+        self.__mirror(package_name, 'replace_many', [feature])
+
+    def get(self, package_name, feature_id):
+        return self.__read('get', package_name, feature_id)
+
+    def get_many(self, package_name, feature_ids):
+        return self.__read('get_many', package_name, feature_ids)
+
+    def find(self, package_name, after=None, limit=None, ordered=False, **criteria):
+        # An ordered read without limit is a stream (utils.pagination): keep its cursor lazy
+        return self.__read('find', package_name, after=after, limit=limit, ordered=ordered,
+                           compare=limit is not None or not ordered, **criteria)
+
+    def next_beginning_after(self, package_name, when):
+        return self.__read('next_beginning_after', package_name, when)
+
+    def count(self, package_name, **criteria):
+        return self.__read('count', package_name, **criteria)
+
+    def update(self, package_name, feature_id, fields):
+        updated = self.primary.update(package_name, feature_id, fields)
+        if updated:
+            self.__mirror_documents(package_name, [feature_id])
+        return updated
+
+    def conditional_update(self, package_name, feature_id, fields, version=None, beginning_by=None, expiration_from=None):
+        feature = self.primary.conditional_update(package_name, feature_id, fields, version, beginning_by, expiration_from)
+        if feature is not None:
+            self.__mirror(package_name, 'replace_many', [feature])
+        return feature
+
+    def delete(self, package_name, feature_id):
+        deleted = self.primary.delete(package_name, feature_id)
+        self.__mirror(package_name, 'delete', feature_id)
+        return deleted
+
+    def drop_package(self, package_name):
+        self.primary.drop_package(package_name)
+        self.__mirror(package_name, 'drop_package')
+
+    def write_batch(self, package_name, writes, ordered):
+        failed = self.primary.write_batch(package_name, writes, ordered)
+        feature_ids = [write[1]['_id'] if write[0] == 'create' else write[1]
+                       for position, write in enumerate(writes) if position not in failed]
+        if feature_ids:
+            self.__mirror_documents(package_name, feature_ids)
+        return failed
+
+    def replace_many(self, package_name, features):
+        self.primary.replace_many(package_name, features)
+        self.__mirror(package_name, 'replace_many', features)
+
+    def archive_expired(self, package_name, expired_before, limit):
+        archived = self.primary.archive_expired(package_name, expired_before, limit)
+        if archived:
+            # The archive is shared: only remove the live copies
+            self.__mirror(package_name, 'write_batch', [('delete', feature_id) for feature_id in archived], False)
+        return archived
+
+    def find_archived(self, package_name, after=None, limit=None, ordered=False, **criteria):
+        return self.primary.find_archived(package_name, after=after, limit=limit, ordered=ordered, **criteria)
+
+    def bump_version(self, package_name, count=1):
+        return self.primary.bump_version(package_name, count)
+
+    def versions(self):
+        return self.primary.versions()
+
+    def append_changes(self, package_name, changes):
+        self.primary.append_changes(package_name, changes)
+
+    def changes_since(self, package_name, version, limit):
+        return self.primary.changes_since(package_name, version, limit)
+
+    def index_status(self):
+        return self.primary.index_status() + self.secondary.index_status()
+
+    def provision_all(self):
+        try:
+            self.secondary.provision_all()
+        except Exception as e:
+            print(f"Error provisioning the secondary layout: {e}")
+        return self.primary.provision_all()
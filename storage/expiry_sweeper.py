@@ -0,0 +1,132 @@
+from datetime import timedelta
+from cache.active_cache import utc_now
+import os
+import threading
+import time
+
+
+# What happens to expired feature toggles: "off" keeps them, "archive" moves them to the archive
+# with a background sweeper, "ttl" lets a MongoDB TTL index delete them
+EXPIRY_MODE = os.getenv("EXPIRY_MODE", "off")
+
+EXPIRY_MODES = ["off", "archive", "ttl"]
+
+if EXPIRY_MODE not in EXPIRY_MODES:
+    raise ValueError(f"EXPIRY_MODE must be one of: {', '.join(EXPIRY_MODES)}")
+
+# How long a toggle stays live after its expiration date before it is archived (or deleted in ttl mode)
+EXPIRY_RETENTION_DAYS = float(os.getenv("EXPIRY_RETENTION_DAYS", 30))
+
+# Pause between two sweeps of every package
+EXPIRY_SWEEP_INTERVAL_SECONDS = float(os.getenv("EXPIRY_SWEEP_INTERVAL_SECONDS", 3600))
+
+# Toggles moved per batch, and batches per second, to bound the load a sweep puts on the database
+EXPIRY_SWEEP_BATCH_SIZE = int(os.getenv("EXPIRY_SWEEP_BATCH_SIZE", 500))
+EXPIRY_SWEEP_BATCHES_PER_SECOND = float(os.getenv("EXPIRY_SWEEP_BATCHES_PER_SECOND", 2))
+
+
+class ExpirySweeper:
+    """
+    Background archiving of expired feature toggles (EXPIRY_MODE=archive).
+
+    Every EXPIRY_SWEEP_INTERVAL_SECONDS each package's toggles that expired
+    more than EXPIRY_RETENTION_DAYS ago are moved to the archive, in batches
+    of EXPIRY_SWEEP_BATCH_SIZE at most EXPIRY_SWEEP_BATCHES_PER_SECOND times
+    per second. Each batch is published like a bulk delete, so package
+    versions, caches and event subscribers follow. A sweep is idempotent,
+    so several workers may run one.
+    """
+    __thread = None
+    __stop = threading.Event()
+    __sweep_lock = threading.Lock()
+    __sweeps = 0
+    __archived = 0
+    __errors = 0
+    __last_sweep = None
+
+    @staticmethod
+    def start(get_store, publish):
+        """
+        Start sweeping in a background thread
+
+        :param get_store: Callable returning the FeatureStore, or None while it is unreachable
+        :param publish: Callable(package_name, changes) propagating the archived toggles as deletes
+        """
+        if ExpirySweeper.__thread is not None:
+            return
+        ExpirySweeper.__stop.clear()
+        ExpirySweeper.__thread = threading.Thread(target=ExpirySweeper.__run, args=(get_store, publish), daemon=True)
+        ExpirySweeper.__thread.start()
+
+    @staticmethod
+    def stop():
+        """
+        Stop sweeping
+        """
+        ExpirySweeper.__stop.set()
+        ExpirySweeper.__thread = None
+
+    @staticmethod
+    def sweep(store, publish, stop=None):
+        """
+        Archive the expired toggles of every package now
+
+        :param store: The FeatureStore
+        :param publish: Callable(package_name, changes) propagating the archived toggles as deletes
+        :param stop: Event cancelling the sweep between two batches; a manual sweep (None) runs to the end,
+                     even after stop()
+        :return: The number of archived toggles by package name
+        :rtype: dict
+        """
+        stop = stop or threading.Event()
+        with ExpirySweeper.__sweep_lock:
+            expired_before = utc_now() - timedelta(days=EXPIRY_RETENTION_DAYS)
+            archived = {}
+            for package_name in store.package_names():
+                while not stop.is_set():
+                    feature_ids = store.archive_expired(package_name, expired_before, EXPIRY_SWEEP_BATCH_SIZE)
+                    if feature_ids:
+                        archived[package_name] = archived.get(package_name, 0) + len(feature_ids)
+                        publish(package_name, [('delete', feature_id) for feature_id in feature_ids])
+                        # Rate limit: only batches that wrote count
+                        stop.wait(1 / EXPIRY_SWEEP_BATCHES_PER_SECOND)
+                    if len(feature_ids) < EXPIRY_SWEEP_BATCH_SIZE:
+                        break
+
+            ExpirySweeper.__sweeps += 1
+            ExpirySweeper.__archived += sum(archived.values())
+            ExpirySweeper.__last_sweep = time.time()
+            return archived
+
+    @staticmethod
+    def get_stats():
+        """
+        Get the sweeper counters
+
+        :return: Mode, retention, sweeps run, toggles archived, errors and the age of the last sweep in seconds
+        :rtype: dict
+        """
+        last_sweep = ExpirySweeper.__last_sweep
+        return {
+            "mode": EXPIRY_MODE,
+            "retention_days": EXPIRY_RETENTION_DAYS,
+            "running": ExpirySweeper.__thread is not None,
+            "sweeps": ExpirySweeper.__sweeps,
+            "archived": ExpirySweeper.__archived,
+            "errors": ExpirySweeper.__errors,
+            "last_sweep_seconds_ago": round(time.time() - last_sweep, 3) if last_sweep is not None else None
+        }
+
+    @staticmethod
+    def __run(get_store, publish):
+        while not ExpirySweeper.__stop.is_set():
+            try:
+                store = get_store()
+                if store is not None:
+                    archived = ExpirySweeper.sweep(store, publish, ExpirySweeper.__stop)
+                    if archived:
+                        print(f"Expiry sweep archived {sum(archived.values())} feature toggles in {len(archived)} packages")
+            except Exception as e:
+                ExpirySweeper.__errors += 1
+                print(f"Error sweeping expired feature toggles: {e}")
+            ExpirySweeper.__stop.wait(EXPIRY_SWEEP_INTERVAL_SECONDS)
@@ -0,0 +1,24 @@
+from database.package_registry import SYSTEM_COLLECTION_PREFIX
+import os
+
+
+# Layout of the MongoDB storage: "collections" (one collection per package) or "shared"
+# (every toggle in one collection, with the package name as an indexed field)
+STORAGE_LAYOUT = os.getenv("STORAGE_LAYOUT", "collections")
+
+STORAGE_LAYOUTS = ["collections", "shared"]
+
+if STORAGE_LAYOUT not in STORAGE_LAYOUTS:
+    raise ValueError(f"STORAGE_LAYOUT must be one of: {', '.join(STORAGE_LAYOUTS)}")
+
+# While migrating between layouts: mirror every write to the other layout and compare reads with it
+STORAGE_DUAL_READ = os.getenv("STORAGE_DUAL_READ", "false").lower() in ("1", "true", "yes")
+
+# Share of the reads compared with the other layout while STORAGE_DUAL_READ is on
+STORAGE_DUAL_READ_SAMPLE_RATE = float(os.getenv("STORAGE_DUAL_READ_SAMPLE_RATE", 0.01))
+
+# Feature toggles of every package in the shared layout, with a package_name field
+FEATURES_COLLECTION = f"{SYSTEM_COLLECTION_PREFIX}feature_toggles"
+
+# One {_id: package_name} document per package in the shared layout, so empty packages still exist
+PACKAGES_COLLECTION = f"{SYSTEM_COLLECTION_PREFIX}packages"
@@ -0,0 +1,150 @@
+"""
+Copy the package collections into the shared layout and verify the copy.
+
+Run from the repository root, with the DB_* variables of the database:
+
+    python -m storage.layout_migration copy [--package my-package] [--batch-size 1000] [--batches-per-second 10]
+    python -m storage.layout_migration verify [--package my-package] [--repair]
+
+`copy` inserts the toggles of every package collection that are missing from
+__feature_toggles, in batches sorted by `_id`, and registers the packages in
+__packages. Toggles already copied are left alone, so a copy can be
+interrupted and run again. Run it while the API runs with
+STORAGE_DUAL_READ=true: the writes made meanwhile reach both layouts.
+
+`verify` compares both layouts toggle by toggle and reports the toggles
+missing from __feature_toggles, different or extra (e.g. deleted while
+being copied); `--repair` rewrites them from the package collections.
+"""
+from database.connection import MongoConnectionHolder
+from database.package_registry import list_package_names
+from storage.base import DuplicateFeatureError
+from storage.layout import FEATURES_COLLECTION
+from storage.mongo_store import MongoStore, SharedMongoStore
+import argparse
+import json
+import sys
+import time
+
+
+def _batches(collection, query, batch_size, batches_per_second):
+    """
+    Read a collection in batches sorted by `_id`, at most batches_per_second batches per second
+
+    :param collection: The collection
+    :param query: The MongoDB query
+    :param batch_size: Documents per batch
+    :param batches_per_second: Largest number of batches per second, 0 for no limit
+    :return: The batches of documents
+    :rtype: generator
+    """
+    last_id = None
+    while True:
+        started = time.monotonic()
+        batch_query = query if last_id is None else {**query, "_id": {"$gt": last_id}}
+        batch = list(collection.find(batch_query).sort("_id", 1).limit(batch_size))
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1]['_id']
+        if batches_per_second > 0:
+            time.sleep(max(0.0, 1 / batches_per_second - (time.monotonic() - started)))
+
+
+def copy(db, package_names, batch_size, batches_per_second):
+    """
+    Insert the toggles of the package collections missing from the shared layout
+
+    :param db: MongoDB database
+    :param package_names: The packages to copy
+    :param batch_size: Toggles per batch
+    :param batches_per_second: Largest number of batches per second, 0 for no limit
+    :return: Per package, the toggles read and the toggles inserted
+    :rtype: dict
+    """
+    target = SharedMongoStore(db)
+    stats = {}
+    for package_name in package_names:
+        target.provision(package_name)
+        read = inserted = 0
+        for batch in _batches(db[package_name], {}, batch_size, batches_per_second):
+            failed = target.write_batch(package_name, [('create', feature) for feature in batch], False)
+            # Toggles already copied fail with a duplicate _id
+            errors = [error for error in failed.values() if not isinstance(error, DuplicateFeatureError)]
+            if errors:
+                raise errors[0]
+            read += len(batch)
+            inserted += len(batch) - len(failed)
+        stats[package_name] = {"read": read, "inserted": inserted}
+        print(f"Copied package '{package_name}': {inserted} of {read} toggles inserted", file=sys.stderr)
+    return stats
+
+
+def verify(db, package_names, batch_size, batches_per_second, repair):
+    """
+    Compare the package collections with the shared layout
+
+    :param db: MongoDB database
+    :param package_names: The packages to compare
+    :param batch_size: Toggles per batch
+    :param batches_per_second: Largest number of batches per second, 0 for no limit
+    :param repair: Rewrite the differing toggles of the shared layout from the package collections
+    :return: Per package, the toggles compared, missing from the shared layout, different and extra
+    :rtype: dict
+    """
+    source = MongoStore(db)
+    target = SharedMongoStore(db)
+    stats = {}
+    for package_name in package_names:
+        compared = missing = different = extra = 0
+        for batch in _batches(db[package_name], {}, batch_size, batches_per_second):
+            copies = target.get_many(package_name, [feature['_id'] for feature in batch])
+            stale = [feature for feature in batch if copies.get(feature['_id']) != feature]
+            compared += len(batch)
+            missing += sum(1 for feature in stale if feature['_id'] not in copies)
+            different += sum(1 for feature in stale if feature['_id'] in copies)
+            if repair and stale:
+                target.replace_many(package_name, stale)
+
+        for batch in _batches(db[FEATURES_COLLECTION], {"package_name": package_name}, batch_size, batches_per_second):
+            originals = source.get_many(package_name, [feature['_id'] for feature in batch])
+            extras = [feature['_id'] for feature in batch if feature['_id'] not in originals]
+            extra += len(extras)
+            if repair and extras:
+                target.write_batch(package_name, [('delete', feature_id) for feature_id in extras], False)
+
+        if repair and not target.package_exists(package_name):
+            target.provision(package_name)
+        stats[package_name] = {"compared": compared, "missing": missing, "different": different, "extra": extra}
+        print(f"Verified package '{package_name}': {missing} missing, {different} different, {extra} extra",
+              file=sys.stderr)
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in [('copy', 'Copy the package collections into the shared layout'),
+                            ('verify', 'Compare the package collections with the shared layout')]:
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('--package', action='append', help='Only this package (repeatable); all packages by default')
+        command.add_argument('--batch-size', type=int, default=1000, help='Toggles per batch')
+        command.add_argument('--batches-per-second', type=float, default=10, help='Largest number of batches per second, 0 for no limit')
+        if name == 'verify':
+            command.add_argument('--repair', action='store_true', help='Rewrite the toggles that differ')
+    args = parser.parse_args()
+
+    db = MongoConnectionHolder.get_db()
+    if db is None:
+        print("Could not connect to the database", file=sys.stderr)
+        sys.exit(1)
+
+    packages = args.package or list_package_names(db)
+    if args.command == 'copy':
+        result = copy(db, packages, args.batch_size, args.batches_per_second)
+    else:
+        result = verify(db, packages, args.batch_size, args.batches_per_second, args.repair)
+    print(json.dumps(result))
+    if args.command == 'verify' and not args.repair and any(
+            package["missing"] or package["different"] or package["extra"] for package in result.values()):
+        sys.exit(2)
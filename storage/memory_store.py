@@ -0,0 +1,243 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from cache.interval_index import PackageIndex
+from database.change_log import CHANGE_LOG_MAX_ENTRIES
+from storage.base import FeatureStore, DuplicateFeatureError, FeatureConflictError
+import threading
+
+
+class _MemoryPackage:
+    """
+    The feature toggles of one package and their indexes.
+    """
+    __slots__ = ("index", "names", "created")
+
+    def __init__(self):
+        # Interval tree over (beginning_date, expiration_date), also the primary store by `_id`
+        self.index = PackageIndex([])
+        # name -> `_id`, enforcing unique names like the name_unique MongoDB index (unused in archives)
+        self.names = {}
+        # Sorted (created_at, _id) keys, serving created_since and keyset pages
+        self.created = []
+
+
+def _sort_key(feature):
+    return feature['created_at'], feature['_id']
+
+
+def _find(package, after=None, limit=None, ordered=False, active_at=None, active_between=None, created_since=None):
+    """
+    Find the feature toggles of a package matching storage criteria
+
+    :param package: The _MemoryPackage, read with the store lock held
+    :return: The documents
+    :rtype: list
+    """
+    if active_at is None and active_between is None:
+        # Walk the creation order, starting at the first key past the bounds
+        start = 0
+        if created_since is not None:
+            start = bisect_left(package.created, (created_since,))
+        if after is not None:
+            start = max(start, bisect_right(package.created, tuple(after)))
+        stop = len(package.created) if limit is None else start + limit
+        return [package.index.get(feature_id) for _, feature_id in package.created[start:stop]]
+
+    features = package.index.stab(active_at) if active_at is not None else package.index.overlap(*active_between)
+    if active_at is not None and active_between is not None:
+        start, end = active_between
+        features = [feature for feature in features if feature['beginning_date'] <= end and feature['expiration_date'] >= start]
+    if created_since is not None:
+        features = [feature for feature in features if feature['created_at'] >= created_since]
+    if ordered or after is not None or limit is not None:
+        features.sort(key=_sort_key)
+    if after is not None:
+        features = [feature for feature in features if _sort_key(feature) > tuple(after)]
+    return features if limit is None else features[:limit]
+
+
+class MemoryStore(FeatureStore):
+    """
+    In-process storage for tests, benchmarks and single-process edge deployments.
+
+    Date queries are answered by an interval tree in O(log n + k) and creation
+    date ranges by a sorted list, so no external service is involved. Stored
+    documents are replaced rather than modified, so the lists handed out by
+    find() stay valid snapshots. Data lives as long as the process; with
+    several workers each one has its own copy.
+    """
+    indexes_dates = True
+
+    def __init__(self):
+        self.__packages = {}
+        self.__archives = {}
+        self.__versions = {}
+        # Last CHANGE_LOG_MAX_ENTRIES changes per package, kept when the package is dropped
+        self.__changes = {}
+        self.__lock = threading.RLock()
+
+    def package_names(self):
+        with self.__lock:
+            return list(self.__packages)
+
+    def package_exists(self, package_name):
+        with self.__lock:
+            return package_name in self.__packages
+
+    def create(self, package_name, feature):
+        with self.__lock:
+            package = self.__packages.get(package_name)
+            if package is None:
+                package = self.__packages[package_name] = _MemoryPackage()
+            if feature['name'] in package.names:
+                raise DuplicateFeatureError(f"Feature toggle '{feature['name']}' already exists")
+            package.index.insert(dict(feature))
+            package.names[feature['name']] = feature['_id']
+            insort(package.created, _sort_key(feature))
+
+    def get(self, package_name, feature_id):
+        with self.__lock:
+            package = self.__packages.get(package_name)
+            feature = package.index.get(feature_id) if package is not None else None
+        return dict(feature) if feature is not None else None
+
+    def get_many(self, package_name, feature_ids):
+        features = {}
+        for feature_id in feature_ids:
+            feature = self.get(package_name, feature_id)
+            if feature is not None:
+                features[feature_id] = feature
+        return features
+
+    def find(self, package_name, after=None, limit=None, ordered=False, **criteria):
+        with self.__lock:
+            package = self.__packages.get(package_name)
+            return _find(package, after, limit, ordered, **criteria) if package is not None else []
+
+    def next_beginning_after(self, package_name, when):
+        with self.__lock:
+            package = self.__packages.get(package_name)
+            return package.index.next_beginning_after(when) if package is not None else None
+
+    def count(self, package_name, **criteria):
+        with self.__lock:
+            package = self.__packages.get(package_name)
+            if package is None:
+                return 0
+            if not criteria:
+                return len(package.index)
+            if list(criteria) == ['active_at']:
+                return package.index.count_active(criteria['active_at'])
+        return len(self.find(package_name, **criteria))
+
+    def update(self, package_name, feature_id, fields):
+        with self.__lock:
+            package = self.__packages.get(package_name)
+            feature = package.index.get(feature_id) if package is not None else None
+            if feature is None:
+                return False
+
+            name = fields.get('name', feature['name'])
+            if name != feature['name']:
+                if name in package.names:
+                    raise DuplicateFeatureError(f"Feature toggle '{name}' already exists")
+                del package.names[feature['name']]
+                package.names[name] = feature_id
+            if 'created_at' in fields and fields['created_at'] != feature['created_at']:
+                del package.created[bisect_left(package.created, _sort_key(feature))]
+                insort(package.created, (fields['created_at'], feature_id))
+            package.index.update(feature_id, fields)
+            return True
+
+    def conditional_update(self, package_name, feature_id, fields, version=None, beginning_by=None, expiration_from=None):
+        with self.__lock:
+            feature = self.get(package_name, feature_id)
+            if feature is None \
+                    or version is not None and feature.get('version', 0) != version \
+                    or beginning_by is not None and feature['beginning_date'] > beginning_by \
+                    or expiration_from is not None and feature['expiration_date'] < expiration_from:
+                return None
+            fields = {**fields, 'version': feature.get('version', 0) + 1}
+            self.update(package_name, feature_id, fields)
+            return {**feature, **fields}
+
+    def delete(self, package_name, feature_id):
+        with self.__lock:
+            package = self.__packages.get(package_name)
+            feature = package.index.get(feature_id) if package is not None else None
+            if feature is None:
+                return False
+            package.index.remove(feature_id)
+            del package.names[feature['name']]
+            del package.created[bisect_left(package.created, _sort_key(feature))]
+            return True
+
+    def drop_package(self, package_name):
+        with self.__lock:
+            self.__packages.pop(package_name, None)
+            self.__archives.pop(package_name, None)
+
+    def archive_expired(self, package_name, expired_before, limit):
+        with self.__lock:
+            package = self.__packages.get(package_name)
+            if package is None:
+                return []
+            expired = [package.index.get(feature_id) for _, feature_id in package.created]
+            expired = [feature for feature in expired if feature['expiration_date'] < expired_before][:limit]
+
+            archive = self.__archives.get(package_name)
+            if archive is None:
+                archive = self.__archives[package_name] = _MemoryPackage()
+            for feature in expired:
+                self.delete(package_name, feature['_id'])
+                archive.index.insert(feature)
+                insort(archive.created, _sort_key(feature))
+            return [feature['_id'] for feature in expired]
+
+    def find_archived(self, package_name, after=None, limit=None, ordered=False, **criteria):
+        with self.__lock:
+            archive = self.__archives.get(package_name)
+            return _find(archive, after, limit, ordered, **criteria) if archive is not None else []
+
+    def write_batch(self, package_name, writes, ordered):
+        failed = {}
+        with self.__lock:
+            for position, write in enumerate(writes):
+                if ordered and failed:
+                    failed[position] = None
+                    continue
+                try:
+                    if write[0] == 'create':
+                        self.create(package_name, write[1])
+                    elif write[0] == 'update':
+                        if self.conditional_update(package_name, write[1], write[2], **write[3]) is None:
+                            failed[position] = FeatureConflictError(
+                                f"Feature toggle '{write[1]}' no longer matches the update")
+                    else:
+                        self.delete(package_name, write[1])
+                except DuplicateFeatureError as e:
+                    failed[position] = e
+        return failed
+
+    def bump_version(self, package_name, count=1):
+        with self.__lock:
+            self.__versions[package_name] = self.__versions.get(package_name, 0) + count
+            return self.__versions[package_name]
+
+    def versions(self):
+        with self.__lock:
+            return dict(self.__versions)
+
+    def append_changes(self, package_name, changes):
+        with self.__lock:
+            log = self.__changes.get(package_name)
+            if log is None:
+                log = self.__changes[package_name] = deque(maxlen=CHANGE_LOG_MAX_ENTRIES)
+            log.extend(changes)
+
+    def changes_since(self, package_name, version, limit):
+        with self.__lock:
+            changes = [change for change in self.__changes.get(package_name, ()) if change['version'] > version]
+        # Concurrent writes may append their versions out of order
+        changes.sort(key=lambda change: change['version'])
+        return changes[:limit]
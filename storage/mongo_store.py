@@ -0,0 +1,400 @@
+from pymongo import ASCENDING, IndexModel, InsertOne, ReplaceOne, DeleteOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError, BulkWriteError, CollectionInvalid
+from database.package_registry import list_package_names, is_system_collection, SYSTEM_COLLECTION_PREFIX
+from database.package_versions import VERSIONS_COLLECTION
+from database.change_log import CHANGE_LOG_COLLECTION, CHANGE_LOG_SIZE_BYTES
+from database.index_manager import IndexManager, SHARED_INDEXES
+from storage.base import FeatureStore, DuplicateFeatureError, FeatureConflictError
+from storage.layout import FEATURES_COLLECTION, PACKAGES_COLLECTION
+
+
+# Order of paginated and streamed lists, served by the created_at_id index
+PAGE_SORT = [("created_at", ASCENDING), ("_id", ASCENDING)]
+
+# Archived feature toggles of every package, with a package_name field
+ARCHIVE_COLLECTION = f"{SYSTEM_COLLECTION_PREFIX}archived_features"
+
+ARCHIVE_INDEXES = [
+    IndexModel([("package_name", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)], name="package_created_at_id"),
+]
+
+CHANGE_LOG_INDEXES = [
+    IndexModel([("package_name", ASCENDING), ("version", ASCENDING)], name="package_version"),
+]
+
+
+def mongo_filter(after=None, active_at=None, active_between=None, created_since=None):
+    """
+    Translate storage criteria into a MongoDB query
+
+    :param after: (created_at, _id) keyset position
+    :param active_at: Point in time the toggles are active at
+    :param active_between: (start, end) window the toggles are active in
+    :param created_since: Earliest creation date
+    :return: The MongoDB query
+    :rtype: dict
+    """
+    clauses = []
+    if active_at is not None:
+        clauses.append({"beginning_date": {"$lte": active_at}, "expiration_date": {"$gte": active_at}})
+    if active_between is not None:
+        start, end = active_between
+        clauses.append({"beginning_date": {"$lte": end}, "expiration_date": {"$gte": start}})
+    if created_since is not None:
+        clauses.append({"created_at": {"$gte": created_since}})
+    if after is not None:
+        created_at, feature_id = after
+        clauses.append({"$or": [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "_id": {"$gt": feature_id}}
+        ]})
+    if not clauses:
+        return {}
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+class MongoStore(FeatureStore):
+    """
+    MongoDB storage: one collection per package, versions in __package_versions,
+    archived toggles in __archived_features and recent changes in the capped
+    __change_log.
+    """
+
+    # Fields left out of the returned documents
+    projection = None
+
+    def __init__(self, db):
+        self.db = db
+        self.__archive_indexed = False
+        self.__change_log_created = False
+
+    def _collection(self, package_name):
+        """
+        The collection holding the feature toggles of a package
+
+        :param package_name: The name of the package
+        :return: The collection
+        :rtype: Collection
+        """
+        return self.db[package_name]
+
+    def _query(self, package_name, query):
+        """
+        Restrict a query to the feature toggles of a package
+
+        :param package_name: The name of the package
+        :param query: The MongoDB query
+        :return: The restricted query
+        :rtype: dict
+        """
+        return query
+
+    def _document(self, package_name, feature):
+        """
+        The stored form of a feature toggle document
+
+        :param package_name: The name of the package
+        :param feature: The feature document
+        :return: The document to write
+        :rtype: dict
+        """
+        return feature
+
+    def package_names(self):
+        return list_package_names(self.db)
+
+    def package_exists(self, package_name):
+        return package_name in self.db.list_collection_names(filter={"name": package_name})
+
+    def provision(self, package_name):
+        # Provision the indexes before the first insert creates the collection
+        return IndexManager.ensure_indexes(self.db[package_name])
+
+    def create(self, package_name, feature):
+        try:
+            self._collection(package_name).insert_one(self._document(package_name, feature))
+        except DuplicateKeyError as e:
+            raise DuplicateFeatureError(str(e))
+
+    def get(self, package_name, feature_id):
+        return self._collection(package_name).find_one(self._query(package_name, {"_id": feature_id}), self.projection)
+
+    def get_many(self, package_name, feature_ids):
+        query = self._query(package_name, {"_id": {"$in": list(feature_ids)}})
+        return {feature['_id']: feature for feature in self._collection(package_name).find(query, self.projection)}
+
+    def find(self, package_name, after=None, limit=None, ordered=False, **criteria):
+        cursor = self._collection(package_name).find(self._query(package_name, mongo_filter(after, **criteria)), self.projection)
+        if ordered or after is not None or limit is not None:
+            cursor = cursor.sort(PAGE_SORT)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return cursor
+
+    def next_beginning_after(self, package_name, when):
+        # The nearest scheduled feature decides when the active set grows
+        next_scheduled = self._collection(package_name).find_one(
+            self._query(package_name, {"beginning_date": {"$gt": when}}),
+            {"beginning_date": 1},
+            sort=[("beginning_date", 1)])
+        return next_scheduled['beginning_date'] if next_scheduled else None
+
+    def count(self, package_name, **criteria):
+        return self._collection(package_name).count_documents(self._query(package_name, mongo_filter(**criteria)))
+
+    def update(self, package_name, feature_id, fields):
+        try:
+            result = self._collection(package_name).update_one(self._query(package_name, {"_id": feature_id}), {"$set": fields})
+        except DuplicateKeyError as e:
+            raise DuplicateFeatureError(str(e))
+        return result.matched_count > 0
+
+    def conditional_update(self, package_name, feature_id, fields, version=None, beginning_by=None, expiration_from=None):
+        query = {"_id": feature_id}
+        if version is not None:
+            # A missing version counts as 0; {"$in": [None]} also matches a missing field
+            query["version"] = version if version else {"$in": [0, None]}
+        if beginning_by is not None:
+            query["beginning_date"] = {"$lte": beginning_by}
+        if expiration_from is not None:
+            query["expiration_date"] = {"$gte": expiration_from}
+        try:
+            return self._collection(package_name).find_one_and_update(
+                self._query(package_name, query),
+                {"$set": fields, "$inc": {"version": 1}},
+                projection=self.projection,
+                return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError as e:
+            raise DuplicateFeatureError(str(e))
+
+    def delete(self, package_name, feature_id):
+        return self._collection(package_name).delete_one(self._query(package_name, {"_id": feature_id})).deleted_count > 0
+
+    def drop_package(self, package_name):
+        self.db[package_name].drop()
+        self.db[ARCHIVE_COLLECTION].delete_many({"package_name": package_name})
+
+    def archive_expired(self, package_name, expired_before, limit):
+        if not self.__archive_indexed:
+            self.db[ARCHIVE_COLLECTION].create_indexes(ARCHIVE_INDEXES)
+            self.__archive_indexed = True
+
+        collection = self._collection(package_name)
+        expired = self._query(package_name, {"expiration_date": {"$lt": expired_before}})
+        features = list(collection.find(expired, self.projection, sort=[("expiration_date", ASCENDING)], limit=limit))
+        if not features:
+            return []
+
+        # Copy first, then delete: an interrupted sweep leaves a duplicate rather than a lost toggle
+        archive = self.db[ARCHIVE_COLLECTION]
+        try:
+            archive.insert_many([{**feature, "package_name": package_name} for feature in features], ordered=False)
+        except BulkWriteError as e:
+            # Copies made by an earlier interrupted sweep or by another worker are fine
+            if any(write_error.get('code') != 11000 for write_error in e.details.get('writeErrors', [])):
+                raise
+        feature_ids = [feature['_id'] for feature in features]
+        collection.delete_many({"_id": {"$in": feature_ids}, **expired})
+
+        # A toggle whose dates were extended in between stays live, so drop its copy
+        live_ids = {feature['_id'] for feature in collection.find({"_id": {"$in": feature_ids}}, {"_id": 1})}
+        if live_ids:
+            archive.delete_many({"_id": {"$in": list(live_ids)}, "package_name": package_name})
+        return [feature_id for feature_id in feature_ids if feature_id not in live_ids]
+
+    def find_archived(self, package_name, after=None, limit=None, ordered=False, **criteria):
+        query = {"package_name": package_name}
+        criteria_filter = mongo_filter(after, **criteria)
+        if criteria_filter:
+            query = {"$and": [query, criteria_filter]}
+        cursor = self.db[ARCHIVE_COLLECTION].find(query, {"package_name": 0})
+        if ordered or after is not None or limit is not None:
+            cursor = cursor.sort(PAGE_SORT)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return cursor
+
+    def write_batch(self, package_name, writes, ordered):
+        # bulk_write does not tell which update matched nothing, so each conditional update is its own
+        # find_one_and_update; the creates and deletes between two updates go in one bulk_write
+        failed = {}
+        start = 0
+        while start < len(writes) and not (ordered and failed):
+            if writes[start][0] == 'update':
+                _, feature_id, fields, conditions = writes[start]
+                try:
+                    if self.conditional_update(package_name, feature_id, fields, **conditions) is None:
+                        failed[start] = FeatureConflictError(f"Feature toggle '{feature_id}' no longer matches the update")
+                except Exception as e:
+                    failed[start] = e
+                start += 1
+                continue
+            end = start
+            while end < len(writes) and writes[end][0] != 'update':
+                end += 1
+            failed.update(self._bulk_write(package_name, writes[start:end], start, ordered))
+            start = end
+
+        if ordered and failed:
+            for index in range(min(failed) + 1, len(writes)):
+                failed.setdefault(index, None)
+        return failed
+
+    def _bulk_write(self, package_name, writes, offset, ordered):
+        requests = [InsertOne(self._document(package_name, write[1])) if write[0] == 'create'
+                    else DeleteOne(self._query(package_name, {"_id": write[1]})) for write in writes]
+        failed = {}
+        try:
+            self._collection(package_name).bulk_write(requests, ordered=ordered)
+        except BulkWriteError as e:
+            for write_error in e.details.get('writeErrors', []):
+                message = write_error.get('errmsg', "Write failed")
+                failed[offset + write_error['index']] = (DuplicateFeatureError(message) if write_error.get('code') == 11000
+                                                         else Exception(message))
+        return failed
+
+    def replace_many(self, package_name, features):
+        if features:
+            self._collection(package_name).bulk_write(
+                [ReplaceOne({"_id": feature['_id']}, self._document(package_name, feature), upsert=True)
+                 for feature in features], ordered=False)
+
+    def bump_version(self, package_name, count=1):
+        document = self.db[VERSIONS_COLLECTION].find_one_and_update(
+            {"_id": package_name},
+            {"$inc": {"version": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER)
+        return document['version']
+
+    def versions(self):
+        return {document['_id']: document['version'] for document in self.db[VERSIONS_COLLECTION].find({})}
+
+    def append_changes(self, package_name, changes):
+        if not self.__change_log_created:
+            try:
+                self.db.create_collection(CHANGE_LOG_COLLECTION, capped=True, size=CHANGE_LOG_SIZE_BYTES)
+            except CollectionInvalid:
+                # Already created, possibly by another worker
+                pass
+            self.db[CHANGE_LOG_COLLECTION].create_indexes(CHANGE_LOG_INDEXES)
+            self.__change_log_created = True
+
+        # One document per package version, so a retried append cannot log a change twice
+        documents = [{**change, "_id": f"{package_name}:{change['version']}"} for change in changes]
+        try:
+            self.db[CHANGE_LOG_COLLECTION].insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            if any(write_error.get('code') != 11000 for write_error in e.details.get('writeErrors', [])):
+                raise
+
+    def changes_since(self, package_name, version, limit):
+        cursor = self.db[CHANGE_LOG_COLLECTION].find(
+            {"package_name": package_name, "version": {"$gt": version}},
+            {"_id": 0})
+        return list(cursor.sort("version", ASCENDING).limit(limit))
+
+    def index_status(self):
+        return IndexManager.status(self.db)
+
+    def provision_all(self):
+        return IndexManager.backfill(self.db)
+
+
+class SharedMongoStore(MongoStore):
+    """
+    MongoDB storage in the shared layout: the toggles of every package in
+    __feature_toggles, with a package_name field that leads every index and is
+    left out of the returned documents, and the package names in __packages.
+    Versions, archive and change log are those of MongoStore.
+    """
+    projection = {"package_name": 0}
+
+    def __init__(self, db):
+        super().__init__(db)
+        self.__indexed = False
+
+    def _collection(self, package_name):
+        return self.db[FEATURES_COLLECTION]
+
+    def _query(self, package_name, query):
+        return {**query, "package_name": package_name}
+
+    def _document(self, package_name, feature):
+        return {**feature, "package_name": package_name}
+
+    def package_names(self):
+        return [document['_id'] for document in self.db[PACKAGES_COLLECTION].find({}, {"_id": 1})]
+
+    def package_exists(self, package_name):
+        return self.db[PACKAGES_COLLECTION].count_documents({"_id": package_name}, limit=1) > 0
+
+    def provision(self, package_name):
+        if not self.__indexed:
+            self.__indexed = IndexManager.ensure_indexes(self.db[FEATURES_COLLECTION], SHARED_INDEXES)
+        self.db[PACKAGES_COLLECTION].replace_one({"_id": package_name}, {}, upsert=True)
+        return self.__indexed
+
+    def drop_package(self, package_name):
+        # Toggles first: a package without its __packages entry no longer exists
+        self.db[FEATURES_COLLECTION].delete_many({"package_name": package_name})
+        self.db[PACKAGES_COLLECTION].delete_one({"_id": package_name})
+        self.db[ARCHIVE_COLLECTION].delete_many({"package_name": package_name})
+
+    def index_status(self):
+        return IndexManager.status(self.db, [FEATURES_COLLECTION], SHARED_INDEXES)
+
+    def provision_all(self):
+        self.__indexed = IndexManager.ensure_indexes(self.db[FEATURES_COLLECTION], SHARED_INDEXES)
+        return len(self.package_names()) if self.__indexed else 0
+
+
+class AsyncMongoStore(FeatureStore):
+    """
+    The read side of MongoStore on an AsyncMongoClient database, for the ASGI entry point.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    async def package_names_async(self):
+        return [name for name in await self.db.list_collection_names() if not is_system_collection(name)]
+
+    async def package_exists_async(self, package_name):
+        return package_name in await self.db.list_collection_names(filter={"name": package_name})
+
+    async def find_async(self, package_name, **criteria):
+        return await self.db[package_name].find(mongo_filter(**criteria)).to_list(None)
+
+    async def next_beginning_after_async(self, package_name, when):
+        next_scheduled = await self.db[package_name].find_one(
+            {"beginning_date": {"$gt": when}},
+            {"beginning_date": 1},
+            sort=[("beginning_date", 1)])
+        return next_scheduled['beginning_date'] if next_scheduled else None
+
+    async def versions_async(self):
+        return {document['_id']: document['version'] async for document in self.db[VERSIONS_COLLECTION].find({})}
+
+
+class AsyncSharedMongoStore(AsyncMongoStore):
+    """
+    The read side of SharedMongoStore on an AsyncMongoClient database, for the ASGI entry point.
+    """
+
+    async def package_names_async(self):
+        return [document['_id'] async for document in self.db[PACKAGES_COLLECTION].find({}, {"_id": 1})]
+
+    async def package_exists_async(self, package_name):
+        return await self.db[PACKAGES_COLLECTION].count_documents({"_id": package_name}, limit=1) > 0
+
+    async def find_async(self, package_name, **criteria):
+        query = {**mongo_filter(**criteria), "package_name": package_name}
+        return await self.db[FEATURES_COLLECTION].find(query, SharedMongoStore.projection).to_list(None)
+
+    async def next_beginning_after_async(self, package_name, when):
+        next_scheduled = await self.db[FEATURES_COLLECTION].find_one(
+            {"package_name": package_name, "beginning_date": {"$gt": when}},
+            {"beginning_date": 1},
+            sort=[("beginning_date", 1)])
+        return next_scheduled['beginning_date'] if next_scheduled else None
@@ -0,0 +1,86 @@
+from database.connection import MongoConnectionHolder
+from database.async_connection import AsyncMongoConnectionHolder
+from storage.mongo_store import MongoStore, AsyncMongoStore, SharedMongoStore, AsyncSharedMongoStore
+from storage.dual_store import DualLayoutStore
+from storage.memory_store import MemoryStore
+from storage.layout import STORAGE_LAYOUT, STORAGE_DUAL_READ
+import os
+
+
+# Storage engine of the feature toggles: "mongo", or "memory" for an in-process store
+# (tests, benchmarks, single-process edge deployments; not shared between workers)
+STORAGE_ENGINE = os.getenv("STORAGE_ENGINE", "mongo")
+
+STORAGE_ENGINES = ["mongo", "memory"]
+
+if STORAGE_ENGINE not in STORAGE_ENGINES:
+    raise ValueError(f"STORAGE_ENGINE must be one of: {', '.join(STORAGE_ENGINES)}")
+
+
+class StorageHolder:
+    """
+    The FeatureStore of the configured STORAGE_ENGINE, shared by the whole process.
+
+    With MongoDB, STORAGE_LAYOUT picks one collection per package or the shared
+    collection, and STORAGE_DUAL_READ keeps the other layout in step.
+    """
+    __memory_store = MemoryStore() if STORAGE_ENGINE == "memory" else None
+    __store = None
+    __async_store = None
+
+    @staticmethod
+    def get_store():
+        """
+        Get the feature toggle storage
+
+        :return: The store, or None while the database is unreachable
+        :rtype: FeatureStore
+        """
+        if StorageHolder.__memory_store is not None:
+            return StorageHolder.__memory_store
+
+        db = MongoConnectionHolder.get_db()
+        if db is None:
+            return None
+        store = StorageHolder.__store
+        if store is None or store.db is not db:
+            store = StorageHolder.__store = StorageHolder.create_mongo_store(db)
+        return store
+
+    @staticmethod
+    def create_mongo_store(db, layout=STORAGE_LAYOUT, dual_read=STORAGE_DUAL_READ):
+        """
+        Create the MongoDB store of a layout
+
+        :param db: MongoDB database
+        :param layout: "collections" or "shared"
+        :param dual_read: Mirror the writes to the other layout and compare reads with it
+        :return: The store
+        :rtype: FeatureStore
+        """
+        store = SharedMongoStore(db) if layout == "shared" else MongoStore(db)
+        if dual_read:
+            other = MongoStore(db) if layout == "shared" else SharedMongoStore(db)
+            store = DualLayoutStore(store, other)
+        return store
+
+    @staticmethod
+    def get_async_store():
+        """
+        Get the feature toggle storage for the async (ASGI) routes
+
+        :return: The store, or None while the database is unreachable
+        :rtype: FeatureStore
+        """
+        if StorageHolder.__memory_store is not None:
+            return StorageHolder.__memory_store
+
+        db = AsyncMongoConnectionHolder.get_db()
+        if db is None:
+            return None
+        store = StorageHolder.__async_store
+        if store is None or store.db is not db:
+            # Async reads only use the primary layout
+            store_class = AsyncSharedMongoStore if STORAGE_LAYOUT == "shared" else AsyncMongoStore
+            store = StorageHolder.__async_store = store_class(db)
+        return store
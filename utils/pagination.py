@@ -0,0 +1,210 @@
+from flask import request, jsonify, current_app, Response, stream_with_context
+from datetime import datetime
+from metrics.instrumentation import observe_result_size
+from utils.serialization import parse_fields, project
+from heapq import merge
+from itertools import chain, islice
+import base64
+import json
+import os
+
+
+# Largest page a client can ask for with `limit`
+MAX_PAGE_LIMIT = int(os.getenv("MAX_PAGE_LIMIT", 1000))
+
+STREAM_MIMETYPES = {
+    "ndjson": "application/x-ndjson",
+    "json": "application/json"
+}
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class PaginationError(ValueError):
+    """Raised when the pagination or projection query parameters are invalid"""
+
+
+def encode_cursor(document):
+    """
+    Build the opaque cursor pointing after a document
+
+    :param document: The last document of a page
+    :return: The cursor token
+    :rtype: str
+    """
+    position = json.dumps([document['created_at'].isoformat(), document['_id']])
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(token):
+    """
+    Decode a cursor built by encode_cursor
+
+    :param token: The cursor token
+    :return: The (created_at, _id) position
+    :rtype: tuple
+    """
+    try:
+        created_at, feature_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return datetime.fromisoformat(created_at), feature_id
+    except (ValueError, TypeError):
+        raise PaginationError("Invalid cursor")
+
+
+def parse_page_args():
+    """
+    Read the `limit`, `cursor` and `stream` query parameters of the request
+
+    :return: The limit (or None), the decoded cursor (or None) and the stream format (or None)
+    :rtype: tuple
+    """
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    stream = request.args.get('stream')
+
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise PaginationError("'limit' must be an integer")
+        if limit < 1 or limit > MAX_PAGE_LIMIT:
+            raise PaginationError(f"'limit' must be between 1 and {MAX_PAGE_LIMIT}")
+
+    if stream is not None:
+        if stream not in STREAM_MIMETYPES:
+            raise PaginationError(f"'stream' must be one of: {', '.join(STREAM_MIMETYPES)}")
+        if limit is not None:
+            raise PaginationError("'limit' cannot be combined with 'stream'")
+
+    return limit, decode_cursor(cursor) if cursor else None, stream
+
+
+def parse_shape(hide_id=False):
+    """
+    Read the `fields` query parameter of the request
+
+    :param hide_id: Leave `_id` out of the returned documents
+    :return: Callable reshaping a document, or None to return the documents as they are
+    :rtype: function
+    """
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        raise PaginationError(str(e))
+
+    if fields is not None:
+        if hide_id:
+            fields = [name for name in fields if name != '_id']
+        return lambda document: project(document, fields)
+    return _without_id if hide_id else None
+
+
+def _without_id(document):
+    # Stored documents may be shared with the caches, so never strip `_id` in place
+    return {key: value for key, value in document.items() if key != '_id'}
+
+
+def _stream_response(documents, stream, shape):
+    dumps = current_app.json.dumps
+
+    def generate():
+        if stream == "json":
+            yield "["
+        separator = ""
+        for document in documents:
+            if shape is not None:
+                document = shape(document)
+            if stream == "json":
+                yield separator + dumps(document)
+                separator = ","
+            else:
+                yield dumps(document) + "\n"
+        if stream == "json":
+            yield "]"
+
+    return Response(stream_with_context(generate()), mimetype=STREAM_MIMETYPES[stream]), 200
+
+
+def _page_response(documents, limit, shape):
+    page = documents[:limit]
+    observe_result_size(len(page))
+    next_cursor = encode_cursor(page[-1]) if len(documents) > limit else None
+    response = jsonify([shape(document) for document in page] if shape is not None else page)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response, 200
+
+
+def query_response(store, package_name, hide_id=False, include_archived=False, **criteria):
+    """
+    Respond with the feature toggles matching storage criteria, honouring the pagination parameters
+
+    Without `limit`, `cursor` or `stream` the documents are returned as a
+    single JSON array in storage order, as before. Otherwise they are ordered
+    by (created_at, _id): `limit` returns one page and the cursor of the next
+    page in the X-Next-Cursor header, and `stream` sends NDJSON or a chunked
+    JSON array straight from the storage cursor. `fields` limits the returned
+    documents to a comma-separated list of toggle fields.
+
+    :param store: The FeatureStore
+    :param package_name: The name of the package
+    :param hide_id: Leave `_id` out of the returned documents
+    :param include_archived: Also return the matching archived toggles, after the live ones or merged in page order
+    :param criteria: FeatureStore.find criteria
+    :return: The Flask response and status code
+    :rtype: tuple
+    """
+    try:
+        limit, after, stream = parse_page_args()
+        shape = parse_shape(hide_id)
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def find(**options):
+        documents = store.find(package_name, **options, **criteria)
+        if not include_archived:
+            return documents
+        archived = store.find_archived(package_name, **options, **criteria)
+        if not options:
+            return chain(documents, archived)
+        # Both sources are in (created_at, _id) order
+        documents = merge(documents, archived, key=lambda document: (document['created_at'], document['_id']))
+        return documents if options.get('limit') is None else islice(documents, options['limit'])
+
+    if limit is None and after is None and stream is None:
+        documents = [shape(document) for document in find()] if shape is not None else list(find())
+        observe_result_size(len(documents))
+        return jsonify(documents), 200
+
+    if stream is not None:
+        return _stream_response(find(after=after, ordered=True), stream, shape)
+    return _page_response(list(find(after=after, limit=limit + 1)), limit, shape)
+
+
+def documents_response(documents):
+    """
+    Respond with in-memory documents, honouring the pagination parameters
+
+    Same contract as query_response, for results served from the in-process caches.
+
+    :param documents: The matching feature toggle documents
+    :return: The Flask response and status code
+    :rtype: tuple
+    """
+    try:
+        limit, after, stream = parse_page_args()
+        shape = parse_shape()
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if limit is None and after is None and stream is None:
+        observe_result_size(len(documents))
+        return jsonify([shape(document) for document in documents] if shape is not None else documents), 200
+
+    documents = sorted(documents, key=lambda document: (document['created_at'], document['_id']))
+    if after is not None:
+        documents = [document for document in documents if (document['created_at'], document['_id']) > after]
+
+    if stream is not None:
+        return _stream_response(iter(documents), stream, shape)
+    return _page_response(documents[:limit + 1], limit, shape)
@@ -0,0 +1,99 @@
+from flask.json.provider import JSONProvider, DefaultJSONProvider
+from decimal import Decimal
+import orjson
+import os
+
+
+# Encoder of the JSON responses: "flask" (Flask's default, RFC 822 dates) or "orjson" (ISO 8601 dates, several times faster)
+JSON_ENCODER = os.getenv("JSON_ENCODER", "flask")
+
+JSON_ENCODERS = ["flask", "orjson"]
+
+if JSON_ENCODER not in JSON_ENCODERS:
+    raise ValueError(f"JSON_ENCODER must be one of: {', '.join(JSON_ENCODERS)}")
+
+# Fields of a feature toggle document, in the order a `fields` projection returns them
+TOGGLE_FIELDS = ['_id', 'name', 'description', 'beginning_date', 'expiration_date', 'created_at', 'updated_at', 'version',
+                 'rollout_percentage', 'allow_list', 'deny_list']
+
+# Stored dates are naive UTC: write them with a +00:00 offset
+ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+
+
+def _orjson_default(value):
+    # The types Flask's provider handles that orjson does not
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, "__html__"):
+        return str(value.__html__())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(JSONProvider):
+    """
+    Flask JSON provider backed by orjson.
+
+    Datetimes are written in ISO 8601 with their UTC offset
+    ("2030-01-01T00:00:00+00:00") and keys keep the document order instead of
+    being sorted.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_orjson_default, option=ORJSON_OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps(obj), mimetype="application/json")
+
+
+def json_provider_class():
+    """
+    Get the JSON provider selected by JSON_ENCODER
+
+    :return: The provider class
+    :rtype: type
+    """
+    return OrjsonProvider if JSON_ENCODER == "orjson" else DefaultJSONProvider
+
+
+def init_app(app):
+    """
+    Serialize the JSON responses of a Flask app with the JSON_ENCODER provider
+
+    :param app: The Flask app
+    """
+    app.json = json_provider_class()(app)
+
+
+def parse_fields(value):
+    """
+    Parse a `fields` query parameter
+
+    :param value: Comma-separated field names, or None
+    :return: The requested fields in TOGGLE_FIELDS order, or None to return whole documents
+    :rtype: list
+    """
+    if value is None:
+        return None
+    requested = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = sorted(requested.difference(TOGGLE_FIELDS))
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. 'fields' accepts: {', '.join(TOGGLE_FIELDS)}")
+    if not requested:
+        raise ValueError("'fields' must name at least one field")
+    return [name for name in TOGGLE_FIELDS if name in requested]
+
+
+def project(document, fields):
+    """
+    Copy the requested fields of a feature toggle document
+
+    :param document: The feature toggle document
+    :param fields: The field names, from parse_fields
+    :return: The projected document
+    :rtype: dict
+    """
+    return {name: document[name] for name in fields if name in document}
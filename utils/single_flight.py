@@ -0,0 +1,177 @@
+from flask import request, current_app
+import asyncio
+import os
+import threading
+import time
+
+
+# Share one query between identical concurrent reads of a package
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Longest a read waits for an identical read in flight before querying the database itself
+SINGLE_FLIGHT_TIMEOUT_SECONDS = float(os.getenv("SINGLE_FLIGHT_TIMEOUT_SECONDS", 5))
+
+
+def flight_key(package_name, state):
+    """
+    Build the single-flight key of the current request
+
+    The package state (version and time bucket) is part of the key: a read
+    that starts after a write never gets the answer of a query that started
+    before it.
+
+    :param package_name: The name of the package
+    :param state: The package state the request is answered for, e.g. its version
+    :return: The (endpoint, package, state, query parameters) key
+    :rtype: tuple
+    """
+    return request.endpoint, package_name, state, tuple(sorted(request.args.items(multi=True)))
+
+
+def capture_response(response):
+    """
+    Serialize a response so other requests can replay it
+
+    :param response: A Flask response that is not streamed
+    :return: The status code, headers and body
+    :rtype: tuple
+    """
+    return response.status_code, list(response.headers.items()), response.get_data()
+
+
+def replay_response(captured):
+    """
+    Build a fresh response from a captured one
+
+    :param captured: The result of capture_response
+    :return: The response
+    :rtype: Response
+    """
+    status, headers, body = captured
+    return current_app.response_class(body, status=status, headers=headers)
+
+
+class _Flight:
+    __slots__ = ("done", "deadline", "result", "failed")
+
+    def __init__(self, deadline, done):
+        self.done = done
+        self.deadline = deadline
+        self.result = None
+        self.failed = False
+
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent reads into one database query.
+
+    The first request of a key (the leader) runs the query; the requests of
+    the same key arriving meanwhile wait for its captured response instead of
+    sending the same query. A flight lasts at most SINGLE_FLIGHT_TIMEOUT_SECONDS:
+    past it, or when the leader fails, the waiting requests run the query
+    themselves and the next request of the key starts a new flight.
+    Threads (WSGI) and coroutines (ASGI) have separate flights.
+    """
+    __flights = {}
+    __async_flights = {}
+    # endpoint -> [leaders, coalesced, timeouts]
+    __counters = {}
+    __lock = threading.Lock()
+
+    @staticmethod
+    def __count(endpoint, position):
+        with SingleFlight.__lock:
+            counters = SingleFlight.__counters.get(endpoint)
+            if counters is None:
+                counters = SingleFlight.__counters[endpoint] = [0, 0, 0]
+            counters[position] += 1
+
+    @staticmethod
+    def do(key, function, timeout=SINGLE_FLIGHT_TIMEOUT_SECONDS):
+        """
+        Run a function once for all the concurrent callers of a key
+
+        :param key: The flight key, starting with the endpoint name
+        :param function: Callable computing the shared result
+        :param timeout: Longest the flight of this key may last, in seconds
+        :return: The result of the function, possibly computed for another caller
+        """
+        now = time.monotonic()
+        with SingleFlight.__lock:
+            flight = SingleFlight.__flights.get(key)
+            leader = flight is None or flight.deadline <= now
+            if leader:
+                flight = SingleFlight.__flights[key] = _Flight(now + timeout, threading.Event())
+
+        if leader:
+            SingleFlight.__count(key[0], 0)
+            try:
+                flight.result = function()
+                return flight.result
+            except Exception:
+                flight.failed = True
+                raise
+            finally:
+                with SingleFlight.__lock:
+                    if SingleFlight.__flights.get(key) is flight:
+                        del SingleFlight.__flights[key]
+                flight.done.set()
+
+        if flight.done.wait(max(flight.deadline - now, 0)) and not flight.failed:
+            SingleFlight.__count(key[0], 1)
+            return flight.result
+        SingleFlight.__count(key[0], 2)
+        return function()
+
+    @staticmethod
+    async def do_async(key, function, timeout=SINGLE_FLIGHT_TIMEOUT_SECONDS):
+        """
+        Async counterpart of do, for coroutines of one event loop
+
+        :param key: The flight key, starting with the endpoint name
+        :param function: Coroutine function computing the shared result
+        :param timeout: Longest the flight of this key may last, in seconds
+        :return: The result of the function, possibly computed for another caller
+        """
+        now = time.monotonic()
+        flight = SingleFlight.__async_flights.get(key)
+        if flight is None or flight.deadline <= now:
+            flight = SingleFlight.__async_flights[key] = _Flight(now + timeout, asyncio.Event())
+            SingleFlight.__count(key[0], 0)
+            try:
+                flight.result = await function()
+                return flight.result
+            except BaseException:
+                flight.failed = True
+                raise
+            finally:
+                if SingleFlight.__async_flights.get(key) is flight:
+                    del SingleFlight.__async_flights[key]
+                flight.done.set()
+
+        try:
+            await asyncio.wait_for(flight.done.wait(), max(flight.deadline - now, 0))
+        except asyncio.TimeoutError:
+            pass
+        if flight.done.is_set() and not flight.failed:
+            SingleFlight.__count(key[0], 1)
+            return flight.result
+        SingleFlight.__count(key[0], 2)
+        return await function()
+
+    @staticmethod
+    def get_stats():
+        """
+        Get the single-flight counters
+
+        :return: Per endpoint, the requests that ran the query for their flight, those served by another
+                 request's query (queries saved) and those whose wait timed out or whose leader failed;
+                 and the flights in progress
+        :rtype: dict
+        """
+        with SingleFlight.__lock:
+            return {
+                "endpoints": {endpoint: {"leaders": leaders, "coalesced": coalesced, "timeouts": timeouts}
+                              for endpoint, (leaders, coalesced, timeouts) in SingleFlight.__counters.items()},
+                "in_flight": len(SingleFlight.__flights) + len(SingleFlight.__async_flights)
+            }